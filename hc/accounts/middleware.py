@@ -1,3 +1,4 @@
+from django.utils.functional import SimpleLazyObject
 from hc.accounts.models import Profile
 
 
@@ -9,7 +10,8 @@ class TeamAccessMiddleware(object):
         if request.user.is_authenticated:
             teams_q = Profile.objects.filter(member__user_id=request.user.id)
             teams_q = teams_q.select_related("user")
-            request.teams = list(teams_q)
+            # Only pages with the team menu need this
+            request.teams = SimpleLazyObject(lambda: list(teams_q))
 
             try:
                 profile = request.user.profile
@@ -10,6 +10,7 @@ from django.core import signing
 from django.db import models
 from django.urls import reverse
 from django.utils import timezone
+from hc.api.status import CheckRow
 from hc.lib import emails
 
 
@@ -64,7 +65,8 @@ class Profile(models.Model):
         unsub_link = "%s%s?token=%s" % (settings.SITE_ROOT, path, token)
 
         ctx = {
-            "checks": self.user.check_set.order_by("created"),
+            "rows": CheckRow.evaluate(self.user.check_set.order_by("created"),
+                                      now),
             "now": now,
             "unsub_link": unsub_link
         }
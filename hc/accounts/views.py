@@ -15,7 +15,7 @@ from hc.accounts.forms import (EmailPasswordForm, InviteTeamMemberForm,
                                RemoveTeamMemberForm, ReportSettingsForm,
                                SetPasswordForm, TeamNameForm)
 from hc.accounts.models import Profile, Member
-from hc.api.models import Channel, Check
+from hc.api.models import Channel, Check, Tag
 from hc.lib.badges import get_badge_url
 
 
@@ -197,9 +197,8 @@ def profile(request):
                 profile.save()
                 messages.success(request, "Team Name updated!")
 
-    tags = set()
-    for check in Check.objects.filter(user=request.team.user):
-        tags.update(check.tags_list())
+    q = Tag.objects.filter(user=request.team.user, n_checks__gt=0)
+    tags = set(q.values_list("name", flat=True))
 
     username = request.team.user.username
     badge_urls = []
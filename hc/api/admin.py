@@ -1,7 +1,7 @@
 from django.contrib import admin
 from django.core.paginator import Paginator
 from django.db import connection
-from hc.api.models import Channel, Check, Notification, Ping
+from hc.api.models import Channel, Check, Notification, Outbox, Ping
 
 
 class OwnershipListFilter(admin.SimpleListFilter):
@@ -147,8 +147,9 @@ class ChannelsAdmin(admin.ModelAdmin):
     search_fields = ["value", "user__email"]
     list_select_related = ("user", )
     list_display = ("id", "code", "email", "formatted_kind", "value",
-                    "num_notifications")
+                    "num_notifications", "breaker")
     list_filter = ("kind", )
+    actions = ["reset_breaker"]
 
     def email(self, obj):
         return obj.user.email if obj.user else None
@@ -183,6 +184,19 @@ class ChannelsAdmin(admin.ModelAdmin):
 
     num_notifications.short_description = "# Notifications"
 
+    def breaker(self, obj):
+        state = obj.breaker_state()
+        if obj.n_failures:
+            state += " (%d failures)" % obj.n_failures
+
+        return state
+
+    def reset_breaker(self, request, qs):
+        n = qs.update(n_failures=0, breaker_until=None)
+        self.message_user(request, "%d circuit breaker(s) reset" % n)
+
+    reset_breaker.short_description = "Reset circuit breaker"
+
 
 @admin.register(Notification)
 class NotificationsAdmin(admin.ModelAdmin):
@@ -200,3 +214,22 @@ class NotificationsAdmin(admin.ModelAdmin):
 
     def channel_value(self, obj):
         return obj.channel.value
+
+
+@admin.register(Outbox)
+class OutboxAdmin(admin.ModelAdmin):
+    search_fields = ["owner__name", "owner__code", "channel__value"]
+    list_select_related = ("owner", "channel")
+    list_display = ("id", "created", "check_status", "check_name",
+                    "channel_kind", "channel_value", "n_attempts",
+                    "next_attempt")
+    list_filter = ("created", "check_status", "channel__kind")
+
+    def check_name(self, obj):
+        return obj.owner.name_then_code()
+
+    def channel_kind(self, obj):
+        return obj.channel.kind
+
+    def channel_value(self, obj):
+        return obj.channel.value
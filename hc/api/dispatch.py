@@ -0,0 +1,125 @@
+""" Deliver many notifications concurrently from an asyncio event loop.
+
+The transports are blocking, so each notification still runs in a worker
+thread. The event loop decides what runs when: at most `concurrency`
+notifications are in flight overall, and at most `per_host` of them go
+to the same destination. A burst of status changes is then delivered in
+roughly one round trip, while a single slow webhook host can only hold
+up its own notifications.
+
+"""
+
+import asyncio
+from collections import defaultdict
+
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from hc.lib import db
+
+
+class Dispatcher(object):
+    def __init__(self, concurrency=None, per_host=None):
+        if concurrency is None:
+            concurrency = settings.DISPATCH_CONCURRENCY
+        if per_host is None:
+            per_host = settings.DISPATCH_PER_HOST
+
+        self.concurrency = concurrency
+        self.per_host = per_host
+        self.loop = asyncio.new_event_loop()
+        self.executor = ThreadPoolExecutor(max_workers=concurrency)
+
+    def notify(self, channel, check):
+        """ Runs in a worker thread. Same as Channel.notify, which also
+        records the Notification. """
+
+        db.check()
+        try:
+            return channel.notify(check)
+        finally:
+            db.release()
+
+    def notify_many(self, channel, checks):
+        """ Runs in a worker thread. Same as Channel.notify_many. """
+
+        db.check()
+        try:
+            return channel.notify_many(checks)
+        finally:
+            db.release()
+
+    async def run_limited(self, fn, channel, arg, limit, host_limit):
+        async with limit:
+            async with host_limit:
+                return await self.loop.run_in_executor(
+                    self.executor, fn, channel, arg)
+
+    async def send(self, fn, pairs):
+        """ Call fn(channel, arg) for each (channel, arg) pair. """
+
+        # Created inside the running loop, so they belong to it
+        limit = asyncio.Semaphore(self.concurrency)
+        host_limits = defaultdict(lambda: asyncio.Semaphore(self.per_host))
+
+        tasks = []
+        for channel, arg in pairs:
+            host_limit = host_limits[channel.transport.destination]
+            coro = self.run_limited(fn, channel, arg, limit, host_limit)
+            tasks.append(coro)
+
+        return await asyncio.gather(*tasks, return_exceptions=True)
+
+    def dispatch(self, checks):
+        """ Notify all channels of all the given checks.
+
+        Return a list of (check, channel, error) for failed notifications.
+
+        """
+
+        pairs = []
+        for check in checks:
+            if check.status not in ("up", "down"):
+                raise NotImplementedError("Unexpected status: %s" %
+                                          check.status)
+
+            for channel in check.channel_set.all():
+                pairs.append((channel, check))
+
+        results = self.loop.run_until_complete(
+            self.send(self.notify, pairs))
+
+        errors = []
+        for (channel, check), error in zip(pairs, results):
+            if isinstance(error, Exception):
+                error = "Unexpected error: %s" % error
+            if error not in ("", "no-op"):
+                errors.append((check, channel, error))
+
+        return errors
+
+    def dispatch_digests(self, groups):
+        """ Notify each channel about its checks with one digest, see
+        Channel.notify_many. `groups` is a list of (channel, checks).
+
+        Return a list of (check, channel, error) for failed notifications.
+
+        """
+
+        results = self.loop.run_until_complete(
+            self.send(self.notify_many, groups))
+
+        errors = []
+        for (channel, checks), result in zip(groups, results):
+            if isinstance(result, Exception):
+                error = "Unexpected error: %s" % result
+                result = [(check, error) for check in checks]
+
+            for check, error in result:
+                if error not in ("", "no-op"):
+                    errors.append((check, channel, error))
+
+        return errors
+
+    def close(self):
+        self.loop.close()
+        self.executor.shutdown()
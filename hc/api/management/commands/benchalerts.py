@@ -0,0 +1,97 @@
+import threading
+import time
+import uuid
+from datetime import timedelta as td
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.utils import timezone
+from hc.api.management.commands import sendalerts
+from hc.api.models import Check
+from six import StringIO
+
+
+class ConnectionCounter(object):
+    """ Counts new database connections, from any thread. """
+
+    def __init__(self):
+        self.n = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, **kwargs):
+        with self.lock:
+            self.n += 1
+
+
+class Command(BaseCommand):
+    help = """Benchmark database connection churn in sendalerts.
+
+    Simulates an outage: a number of checks, without channels, all go
+    down at once, and one sendalerts pass handles them. Reports the new
+    database connections opened and the time taken, first with
+    CONN_MAX_AGE = 0, then with persistent connections. The checks and
+    their owner are created in the configured database and removed
+    afterwards.
+
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--checks',
+            type=int,
+            dest='checks',
+            default=1000,
+            help='Number of checks going down',
+        )
+
+    def run(self, user, max_age):
+        now = timezone.now()
+        Check.objects.filter(user=user).update(
+            status="up", last_ping=now - td(days=2),
+            alert_after=now - td(hours=1))
+
+        connections.databases["default"]["CONN_MAX_AGE"] = max_age
+        counter = ConnectionCounter()
+        connection_created.connect(counter)
+        try:
+            start = time.time()
+            sendalerts.Command(stdout=StringIO()).handle_many()
+            elapsed = time.time() - start
+        finally:
+            connection_created.disconnect(counter)
+
+        assert not Check.objects.filter(user=user, status="up").exists()
+        return counter.n, elapsed
+
+    def handle(self, *args, **options):
+        n = options["checks"]
+        # A fresh name each time, a crashed run may have left one behind
+        name = "benchalerts-%s" % uuid.uuid4().hex[:8]
+        user = User.objects.create(username=name)
+
+        max_age = connections.databases["default"]["CONN_MAX_AGE"]
+        try:
+            Check.objects.bulk_create([
+                Check(user=user, name="Check %d" % i, tags="foo")
+                for i in range(0, n)])
+
+            # bulk_create() skips Check.save(), which fills the Tag table
+            for check in Check.objects.filter(user=user):
+                check.sync_tags()
+
+            before, slow = self.run(user, 0)
+            self.stdout.write("CONN_MAX_AGE = 0:   %5d connections, %.2fs"
+                              % (before, slow))
+
+            # The worker threads keep their connections from here on
+            after, fast = self.run(user, 600)
+            self.stdout.write("CONN_MAX_AGE = 600: %5d connections, %.2fs"
+                              % (after, fast))
+        finally:
+            connections.databases["default"]["CONN_MAX_AGE"] = max_age
+            user.delete()
+
+        return "Done! %d checks went down, %d connections became %d." % (
+            n, before, after)
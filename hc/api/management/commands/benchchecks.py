@@ -0,0 +1,108 @@
+import time
+import uuid
+from datetime import timedelta as td
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.template import engines
+from django.test import Client
+from django.utils import timezone
+from hc.accounts.models import Profile
+from hc.api.models import Check
+from hc.api.status import CheckRow
+
+# The status cell of the check list, before and after CheckRow
+PER_CHECK = """{% for check in checks %}
+{% if check.get_status == "new" %}new{% elif check.get_status == "paused" %}
+paused{% elif check.in_grace_period %}grace{% elif check.get_status == "up" %}
+up{% elif check.get_status == "down" %}down{% endif %}{% endfor %}"""
+
+PER_ROW = """{% for row in rows %}
+{% if row.status == "new" %}new{% elif row.status == "paused" %}
+paused{% elif row.in_grace %}grace{% elif row.status == "up" %}
+up{% elif row.status == "down" %}down{% endif %}{% endfor %}"""
+
+
+def _time(fn, n):
+    start = time.time()
+    for i in range(0, n):
+        fn()
+
+    return (time.time() - start) / n
+
+
+class Command(BaseCommand):
+    help = """Benchmark the My Checks page with many checks.
+
+    Creates a user with the given number of checks in the configured
+    database, in all states, and reports how long the My Checks page
+    takes to render, and how long its status column takes with
+    Check.get_status() calls and with CheckRow. The user and checks are
+    removed afterwards.
+
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--checks',
+            type=int,
+            dest='checks',
+            default=5000,
+            help='Number of checks on the page',
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            dest='repeat',
+            default=5,
+            help='Number of times to render each',
+        )
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        # A fresh name each time, a crashed run may have left one behind
+        name = "benchchecks-%s" % uuid.uuid4().hex[:8]
+        user = User.objects.create(username=name)
+
+        n = options["repeat"]
+        try:
+            Profile.objects.create(user=user)
+
+            # Up, late, down and new checks, in turn
+            pings = [now, now - td(days=1, minutes=30), now - td(days=2),
+                     None]
+            checks = []
+            for i in range(0, options["checks"]):
+                last_ping = pings[i % 4]
+                status = "new" if last_ping is None else "up"
+                checks.append(Check(user=user, name="Check %d" % i,
+                                    tags="foo bar", status=status,
+                                    last_ping=last_ping))
+            Check.objects.bulk_create(checks)
+
+            # bulk_create() skips Check.save(), which fills the Tag table
+            for check in Check.objects.filter(user=user):
+                check.sync_tags()
+
+            client = Client()
+            client.force_login(user, "hc.accounts.backends.EmailBackend")
+            page = _time(lambda: client.get("/checks/"), n)
+
+            engine = engines["django"]
+            per_check = engine.from_string(PER_CHECK)
+            per_row = engine.from_string(PER_ROW)
+
+            slow = _time(lambda: per_check.render({"checks": checks}), n)
+            fast = _time(lambda: per_row.render(
+                {"rows": CheckRow.evaluate(checks)}), n)
+        finally:
+            user.delete()
+
+        self.stdout.write("My Checks page:               %8.1f ms"
+                          % (page * 1000))
+        self.stdout.write("status column, get_status(): %8.1f ms"
+                          % (slow * 1000))
+        self.stdout.write("status column, CheckRow:     %8.1f ms"
+                          % (fast * 1000))
+
+        return "Done! The status column is %.1fx faster." % (slow / fast)
@@ -0,0 +1,83 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from djmail.template_mail import InlineCSSTemplateMail
+from hc.api.models import Check
+from hc.api.status import CheckRow
+from hc.api.transports import Summary
+from hc.lib.emails import CompiledTemplateMail
+
+
+def _run(mail_class, name, make_ctx, n):
+    start = time.time()
+    for i in range(0, n):
+        mail_class(name).make_email_object("alice@example.org", make_ctx())
+
+    return n / (time.time() - start)
+
+
+class Command(BaseCommand):
+    help = """Benchmark rendering of alert and report emails.
+
+    Renders emails about a made-up list of checks, with CSS inlined on
+    every message (djmail's InlineCSSTemplateMail) and with precompiled
+    templates (hc.lib.emails), and reports emails per second for each.
+    Nothing is sent or written to the database.
+
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--emails',
+            type=int,
+            dest='emails',
+            default=100,
+            help='Number of emails to render of each kind',
+        )
+        parser.add_argument(
+            '--checks',
+            type=int,
+            dest='checks',
+            default=20,
+            help='Number of checks in each email',
+        )
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        checks = []
+        for i in range(0, options["checks"]):
+            check = Check(name="Check %d" % i, tags="foo bar", status="up")
+            check.last_ping = now
+            checks.append(check)
+
+        def alert_ctx():
+            # A new Summary each time, so the summary table is rendered
+            # for every email
+            return {"now": now, "SITE_ROOT": settings.SITE_ROOT,
+                    "check": checks[0], "summary": Summary(checks)}
+
+        def report_ctx():
+            return {"now": now, "SITE_ROOT": settings.SITE_ROOT,
+                    "rows": CheckRow.evaluate(checks), "unsub_link": "#"}
+
+        kinds = [("alert", alert_ctx), ("report", report_ctx)]
+
+        n = options["emails"]
+        speedups = []
+        for name, make_ctx in kinds:
+            # Warm up, so the compiled templates are ready
+            _run(CompiledTemplateMail, name, make_ctx, 1)
+
+            slow = _run(InlineCSSTemplateMail, name, make_ctx, n)
+            fast = _run(CompiledTemplateMail, name, make_ctx, n)
+            speedups.append(fast / slow)
+
+            self.stdout.write("%-6s inlined per message: %8.1f emails/s"
+                              % (name, slow))
+            self.stdout.write("%-6s precompiled:         %8.1f emails/s"
+                              % (name, fast))
+
+        speedups = " and ".join("%.1fx" % speedup for speedup in speedups)
+        return "Done! Precompiled is %s faster." % speedups
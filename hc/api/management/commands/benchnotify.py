@@ -0,0 +1,103 @@
+import threading
+import time
+
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from django.core.management.base import BaseCommand
+from six.moves import BaseHTTPServer, socketserver
+
+from hc.api import transports
+from hc.api.models import Channel, Check
+
+
+class StubHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    # Keep-alive needs HTTP/1.1
+    protocol_version = "HTTP/1.1"
+    # Otherwise the body waits for the client to ACK the headers
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"OK")
+
+    def log_message(self, *args):
+        pass
+
+
+class StubServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class Unpooled(object):
+    """ Stands in for transports.session, opening a new connection for
+    every request like plain requests.request() does. """
+
+    def request(self, method, url, **kwargs):
+        return requests.request(method, url, **kwargs)
+
+
+class Command(BaseCommand):
+    help = """Benchmark webhook notifications with and without pooling.
+
+    Sends webhook notifications to a stub HTTP server on localhost, from
+    a thread pool like sendalerts does, and reports notifications per
+    second with the shared keep-alive session and with a new connection
+    for every notification. Nothing is written to the database.
+
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--notifications',
+            type=int,
+            dest='notifications',
+            default=1000,
+            help='Number of notifications to send in each mode',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            dest='workers',
+            default=10,
+            help='Number of threads sending notifications',
+        )
+
+    def run(self, transport, check, n, workers):
+        executor = ThreadPoolExecutor(max_workers=workers)
+        start = time.time()
+        errors = list(executor.map(transport.notify, [check] * n))
+        elapsed = time.time() - start
+        executor.shutdown()
+
+        assert not any(errors), errors[0]
+        return n / elapsed
+
+    def handle(self, *args, **options):
+        server = StubServer(("127.0.0.1", 0), StubHandler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+        url = "http://127.0.0.1:%d/" % server.server_address[1]
+        transport = transports.Webhook(Channel(kind="webhook", value=url))
+        check = Check(status="down")
+        n, workers = options["notifications"], options["workers"]
+
+        pooled_session = transports.session
+        try:
+            transports.session = Unpooled()
+            unpooled = self.run(transport, check, n, workers)
+            self.stdout.write("new connection each: %8.1f notifications/s"
+                              % unpooled)
+
+            transports.session = pooled_session
+            pooled = self.run(transport, check, n, workers)
+            self.stdout.write("pooled keep-alive:   %8.1f notifications/s"
+                              % pooled)
+        finally:
+            transports.session = pooled_session
+            server.shutdown()
+
+        return "Done! Pooling is %.2fx faster." % (pooled / unpooled)
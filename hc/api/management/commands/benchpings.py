@@ -0,0 +1,66 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory
+from hc.api.models import Check
+
+
+def _run(app, environ, n):
+    def start_response(status, headers):
+        assert status.startswith("200"), status
+
+    start = time.time()
+    for i in range(0, n):
+        result = app(dict(environ), start_response)
+        for chunk in result:
+            pass
+
+        if hasattr(result, "close"):
+            result.close()
+
+    return n / (time.time() - start)
+
+
+class Command(BaseCommand):
+    help = """Benchmark the ping endpoint.
+
+    Calls the full Django application (hc.wsgi) and the lean ping
+    application (hc.wsgi_ping) in-process, and reports requests per second
+    for each. Pings go to a temporary check in the configured database,
+    which is removed afterwards.
+
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--requests',
+            type=int,
+            dest='requests',
+            default=1000,
+            help='Number of pings to send to each application',
+        )
+
+    def handle(self, *args, **options):
+        # Imported here, these set up the WSGI handlers
+        from hc.wsgi import application as full_app
+        from hc.wsgi_ping import application as lean_app
+
+        n = options["requests"]
+        check = Check.objects.create(name="benchpings")
+        environ = RequestFactory().get("/ping/%s/" % check.code,
+                                       HTTP_USER_AGENT="benchpings").environ
+
+        try:
+            # Warm up both, so neither pays for connecting to the database
+            _run(full_app, environ, 10)
+            _run(lean_app, environ, 10)
+
+            full_rps = _run(full_app, environ, n)
+            self.stdout.write("hc.wsgi:      %8.1f requests/s" % full_rps)
+
+            lean_rps = _run(lean_app, environ, n)
+            self.stdout.write("hc.wsgi_ping: %8.1f requests/s" % lean_rps)
+        finally:
+            check.delete()
+
+        return "Done! hc.wsgi_ping is %.2fx faster." % (lean_rps / full_rps)
@@ -0,0 +1,116 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from hc.api.models import Check, CheckTag, Tag
+
+# All that Check.tag_names(), late_bound() and sync_tags() need
+FIELDS = ("id", "user_id", "tags", "status", "last_ping", "timeout")
+
+
+class Command(BaseCommand):
+    help = """Check the Tag and CheckTag tables against Check.tags.
+
+    Fixes checks whose CheckTag rows do not match their tags field, and
+    tags whose aggregates have drifted from their checks: wrong check or
+    down counts, or a late_after later than the earliest time one of the
+    tag's checks can go late. With --dry-run only reports them.
+
+    Safe to run while checks change: a tag that changes while the
+    command works it out is left alone, and reported as skipped.
+
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            dest='dry_run',
+            default=False,
+            help='Report problems without fixing them',
+        )
+
+    def checks(self):
+        return Check.objects.only(*FIELDS).iterator()
+
+    def sync(self, dry_run):
+        """ Fix CheckTag rows, return the number of checks fixed. """
+
+        linked = {}
+        for check_id, name in CheckTag.objects.values_list("owner_id",
+                                                           "tag__name"):
+            linked.setdefault(check_id, set()).add(name)
+
+        n = 0
+        for check in self.checks():
+            if check.tag_names() != linked.get(check.id, set()):
+                n += 1
+                if not dry_run:
+                    self.sync_check(check.id)
+
+        return n
+
+    def sync_check(self, check_id):
+        # Reload and lock the check, its status may have changed since
+        # it was listed
+        with transaction.atomic():
+            q = Check.objects.select_for_update().filter(id=check_id)
+            for check in q:
+                check.sync_tags()
+
+    def handle(self, *args, **options):
+        dry_run = options["dry_run"]
+        n_checks = self.sync(dry_run)
+
+        # The aggregates as they are before scanning the checks. A tag
+        # only gets fixed if they have not changed since.
+        tags = list(Tag.objects.values_list("id", "user_id", "name",
+                                            "n_checks", "n_down",
+                                            "late_after"))
+
+        # The aggregates each tag should have, by (user id, name). Taken
+        # from Check.tags, so a dry run sees what a real run would fix.
+        now = timezone.now()
+        stats = {}
+        for check in self.checks():
+            change = (1, int(check.status == "down"), check.late_bound(now))
+            for name in check.tag_names():
+                key = (check.user_id, name)
+                stats[key] = Tag.combine([stats.get(key, (0, 0, None)),
+                                          change])
+
+        n_tags, n_skipped = 0, 0
+        for tag_id, user_id, name, n, n_down, late_after in tags:
+            good = stats.get((user_id, name), (0, 0, None))
+            bound = good[2]
+
+            # A late_after earlier than needed is fine
+            if bound is not None and (late_after is None or
+                                      late_after > bound):
+                wanted = good
+            else:
+                wanted = (good[0], good[1], late_after)
+
+            if (n, n_down, late_after) == wanted:
+                continue
+
+            n_tags += 1
+            if dry_run:
+                continue
+
+            q = Tag.objects.filter(id=tag_id, n_checks=n, n_down=n_down)
+            if late_after is None:
+                q = q.filter(late_after__isnull=True)
+            else:
+                q = q.filter(late_after=late_after)
+
+            if not q.update(n_checks=good[0], n_down=good[1],
+                            late_after=bound, changed=now):
+                n_skipped += 1
+
+        verb = "Found" if dry_run else "Fixed"
+        result = "Done! %s %d checks and %d tags" % (verb, n_checks,
+                                                     n_tags - n_skipped)
+        if n_skipped:
+            result += ", skipped %d tags that changed meanwhile" % n_skipped
+
+        return result
@@ -1,37 +1,518 @@
+import argparse
+import heapq
 import logging
+import os
+import random
+import signal
 import time
+from collections import defaultdict
+from datetime import timedelta as td
 
 from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
 from django.core.management.base import BaseCommand
-from django.db import connection
+from django.db import connection, connections, transaction
+from django.db.models import Min
 from django.utils import timezone
-from hc.api.models import Check
+from hc.api import metrics, transports
+from hc.api.models import Channel, Check, update_tag_stats
+from hc.lib import db
+from hc.lib import metrics as exporter
 
 executor = ThreadPoolExecutor(max_workers=10)
 logger = logging.getLogger(__name__)
 
+# Allow for web servers' clocks and for pings that were committed
+# after they were timestamped
+REFRESH_OVERLAP = td(seconds=5)
+
+
+def tag_change(check):
+    """ How the check going up or down changes its tags' aggregates. """
+
+    if check.status == "down":
+        return (0, 1, None)
+
+    return (0, -1, check.late_bound())
+
+
+def parse_shard(value):
+    """ Parse --shard's "i/N" into (i, N). """
+
+    try:
+        i, n = [int(part) for part in value.split("/")]
+    except ValueError:
+        raise argparse.ArgumentTypeError("expected i/N, for example 0/4")
+
+    if not 0 <= i < n:
+        raise argparse.ArgumentTypeError("i must be between 0 and N - 1")
+
+    return i, n
+
+
+def in_shard(query, shard):
+    """ Narrow a Check query down to one shard, (i, N): the checks whose
+    owner's id modulo N is i. With shard=None, return it unchanged. """
+
+    if shard is None:
+        return query
+
+    i, n = shard
+    return query.extra(where=["api_check.user_id %% %s = %s"], params=[n, i])
+
+
+def _flip_pg(now, shard):
+    sql = """
+    UPDATE api_check
+    SET status = CASE WHEN status = 'up' THEN 'down' ELSE 'up' END
+    WHERE user_id IS NOT NULL AND (
+        (status = 'up' AND alert_after < %s) OR
+        (status = 'down' AND alert_after > %s))
+    """
+    params = [now, now]
+    if shard is not None:
+        sql += " AND user_id %% %s = %s"
+        params += [shard[1], shard[0]]
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql + " RETURNING id, status, last_ping, timeout",
+                       params)
+
+        flipped = {row[0]: row[1:] for row in cursor.fetchall()}
+
+    if not flipped:
+        return []
+
+    # The checks may change again before they are loaded here, so the
+    # fields that tag aggregates depend on come from the UPDATE itself
+    q = Check.objects.filter(id__in=list(flipped)).select_related("user")
+    checks = list(q)
+    for check in checks:
+        check.status, check.last_ping, check.timeout = flipped[check.id]
+
+    return checks
+
+
+def _flip_fallback(now, shard):
+    query = Check.objects.filter(user__isnull=False).select_related("user")
+    query = in_shard(query, shard)
+    going_down = query.filter(alert_after__lt=now, status="up")
+    going_up = query.filter(alert_after__gt=now, status="down")
+
+    # On MySQL the selected rows stay locked until the updates. SQLite
+    # ignores select_for_update(), so each update also checks the old
+    # status, and only the checks that it changed are returned.
+    with transaction.atomic():
+        down = list(going_down.select_for_update())
+        up = list(going_up.select_for_update())
+        down = [check for check in down if _set_status(check, "down")]
+        up = [check for check in up if _set_status(check, "up")]
+
+    return down + up
+
+
+def _set_status(check, status):
+    """ Change the check's status unless another process got to it
+    first. Return True if it changed. """
+
+    q = Check.objects.filter(id=check.id, status=check.status)
+    if not q.update(status=status):
+        return False
+
+    check.status = status
+    return True
+
+
+def flip_due(now, shard=None):
+    """ Set the new status of all checks that are going down or up.
+
+    Return the checks that changed, with their new status. Each check
+    is returned to exactly one sendalerts process.
+
+    On PostgreSQL this is a single UPDATE ... RETURNING statement.
+
+    """
+
+    if connection.vendor == "postgresql":
+        return _flip_pg(now, shard)
+
+    return _flip_fallback(now, shard)
+
+
+class DeadlineScheduler(object):
+    """ Keeps upcoming alert_after deadlines in a min-heap.
+
+    The heap only tells sendalerts when to wake up. What is actually due
+    is still decided by the queries in handle_many(), so stale entries
+    (checks that were pinged or paused since) only cause a spurious
+    wakeup.
+
+    """
+
+    def __init__(self, rebuild_interval=60, shard=None):
+        self.shard = shard
+        self.heap = []
+        self.rebuild_interval = td(seconds=rebuild_interval)
+        self.rebuilt = None
+        self.scanned = None
+
+    def push(self, deadline):
+        heapq.heappush(self.heap, deadline)
+
+    def rebuild(self, now):
+        """ Load deadlines of all checks that can go down.
+
+        Return True if any down checks have been pinged and need to go
+        up. That includes pings refresh() does not see, because their
+        timestamps are older than the last scan.
+
+        """
+
+        q = in_shard(Check.objects.filter(user__isnull=False), self.shard)
+        up = q.filter(status="up", alert_after__isnull=False)
+        self.heap = list(up.values_list("alert_after", flat=True))
+        heapq.heapify(self.heap)
+
+        self.rebuilt = now
+        if self.scanned is None:
+            self.scanned = now
+
+        return q.filter(status="down", alert_after__gt=now).exists()
+
+    def refresh(self, now):
+        """ Add deadlines of checks pinged since the last scan, and the
+        earliest deadline of all, which a shortened timeout or grace time
+        can move earlier without a ping.
+
+        Return True if any of the pinged checks are down and need to go
+        up.
+
+        """
+
+        if self.rebuilt is None or now - self.rebuilt > self.rebuild_interval:
+            # Pauses and new checks are picked up here
+            return self.rebuild(now)
+
+        q = in_shard(Check.objects.filter(user__isnull=False), self.shard)
+        pinged = q.filter(last_ping__gte=self.scanned - REFRESH_OVERLAP)
+        going_up = False
+        for status, alert_after in pinged.values_list("status",
+                                                      "alert_after"):
+            if alert_after is None:
+                continue
+
+            self.push(alert_after)
+            if status == "down" and alert_after > now:
+                going_up = True
+
+        # Only the earliest deadline decides when to wake up. Another
+        # deadline that moved earlier becomes the earliest once the ones
+        # before it have passed, and is picked up then.
+        up = q.filter(status="up").aggregate(Min("alert_after"))
+        earliest = up["alert_after__min"]
+        if earliest is not None and (not self.heap or
+                                     earliest < self.heap[0]):
+            self.push(earliest)
+
+        self.scanned = now
+        return going_up
+
+    def pop_due(self, now):
+        """ Remove past deadlines. Return True if there were any. """
+
+        due = False
+        while self.heap and self.heap[0] <= now:
+            heapq.heappop(self.heap)
+            due = True
+
+        return due
+
+    def seconds_to_next(self, now, limit):
+        """ Return seconds until the next deadline, but at most `limit`. """
+
+        if not self.heap:
+            return limit
+
+        delta = (self.heap[0] - now).total_seconds()
+        return max(0, min(delta, limit))
+
 
 class Command(BaseCommand):
     help = 'Sends UP/DOWN email alerts'
+    # Set with --asyncio
+    dispatcher = None
+    # Set with --bulk
+    bulk = False
+    # Set with --shard, as (i, N)
+    shard = None
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--scheduler',
+            action='store_true',
+            dest='scheduler',
+            default=False,
+            help='Sleep until the next alert_after deadline instead of '
+                 'polling the database every second',
+        )
+        parser.add_argument(
+            '--poll',
+            type=float,
+            dest='poll',
+            default=5,
+            help='With --scheduler, look for pinged checks this often',
+        )
+        parser.add_argument(
+            '--rebuild',
+            type=float,
+            dest='rebuild',
+            default=60,
+            help='With --scheduler, reload all deadlines this often',
+        )
+        parser.add_argument(
+            '--asyncio',
+            action='store_true',
+            dest='asyncio',
+            default=False,
+            help='Send all notifications concurrently from an asyncio '
+                 'event loop, instead of one check per thread',
+        )
+        parser.add_argument(
+            '--bulk',
+            action='store_true',
+            dest='bulk',
+            default=False,
+            help='Update the status of all due checks in one statement, '
+                 'instead of one check at a time',
+        )
+        parser.add_argument(
+            '--metrics-port',
+            type=int,
+            dest='metrics_port',
+            default=None,
+            help='Serve latency metrics in Prometheus format on this port '
+                 'of localhost',
+        )
+        parser.add_argument(
+            '--shard',
+            type=parse_shard,
+            dest='shard',
+            default=None,
+            help='Only handle checks whose owner\'s id modulo N is i, '
+                 'given as i/N',
+        )
+        parser.add_argument(
+            '--shards',
+            type=int,
+            dest='shards',
+            default=None,
+            help='Start this many processes, one for each shard, and '
+                 'restart them if they exit',
+        )
 
     def handle_many(self):
         """ Send alerts for many checks simultaneously. """
+
+        db.check()
+        start = time.time()
+        try:
+            if self.bulk:
+                return self.handle_bulk()
+
+            return self.handle_due()
+        finally:
+            metrics.pass_duration.observe(time.time() - start)
+            if settings.METRICS_FILE:
+                exporter.write(settings.METRICS_FILE)
+
+    def handle_due(self):
+        """ Select the checks going up or down, and claim and alert
+        them. """
+
         query = Check.objects.filter(user__isnull=False).select_related("user")
+        query = in_shard(query, self.shard)
 
         now = timezone.now()
         going_down = query.filter(alert_after__lt=now, status="up")
         going_up = query.filter(alert_after__gt=now, status="down")
         # Don't combine this in one query so Postgres can query using index:
         checks = list(going_down.iterator()) + list(going_up.iterator())
+        metrics.due_checks.set(len(checks))
         if not checks:
             return False
 
+        # Alerts for the same user in this pass share one check summary
+        transports.summaries.begin()
+
+        # Other sendalerts processes may have selected the same checks.
+        # Go through them in random order so each process claims
+        # a different subset first.
+        random.shuffle(checks)
+
+        if settings.DIGEST_THRESHOLD and not settings.NOTIFICATION_OUTBOX:
+            claimed = [check for check in checks if self.claim(check)]
+            db.release()
+            self.send_digests(claimed)
+            return True
+
+        if self.dispatcher and not settings.NOTIFICATION_OUTBOX:
+            claimed = [check for check in checks if self.claim(check)]
+            db.release()
+            self.dispatch(claimed)
+            return True
+
         futures = [executor.submit(self.handle_one, check) for check in checks]
         for future in futures:
             future.result()
 
         return True
 
+    def handle_bulk(self):
+        """ Like handle_many, but change the status of all due checks
+        first, in one go. """
+
+        if settings.NOTIFICATION_OUTBOX:
+            with transaction.atomic():
+                checks = self.flip_due()
+                counts = [check.queue_alert() for check in checks]
+
+            db.release()
+            for check, n in zip(checks, counts):
+                tmpl = "\nQueued %d notifications, status=%s, code=%s\n"
+                self.stdout.write(tmpl % (n, check.status, check.code))
+
+            return len(checks) > 0
+
+        checks = self.flip_due()
+        db.release()
+        if not checks:
+            return False
+
+        transports.summaries.begin()
+        if settings.DIGEST_THRESHOLD:
+            self.send_digests(checks)
+        elif self.dispatcher:
+            self.dispatch(checks)
+        else:
+            futures = [executor.submit(self.send_alert, check)
+                       for check in checks]
+            for future in futures:
+                future.result()
+
+        return True
+
+    def flip_due(self):
+        now = timezone.now()
+        # Tag aggregates change in the same transaction as the statuses,
+        # so nobody sees one without the other
+        with transaction.atomic():
+            checks = flip_due(now, self.shard)
+            update_tag_stats({check.id: tag_change(check)
+                              for check in checks})
+
+        metrics.due_checks.set(len(checks))
+        for check in checks:
+            self.record_change(check, now)
+
+        return checks
+
+    def record_change(self, check, now):
+        """ Note when the check's status changed, and how long after
+        it should have. """
+
+        check.status_changed = now
+        metrics.status_changes.inc(status=check.status)
+
+        since = check.last_ping
+        if check.status == "down":
+            since = check.alert_after
+
+        if since is not None:
+            delay = (now - since).total_seconds()
+            metrics.flip_delay.observe(delay, status=check.status)
+
+    def claim(self, check):
+        """ Save the check's new status.
+
+        Only update the row if its status has not changed since the check
+        was selected. If another sendalerts process got here first, return
+        False: that process will send the alert instead.
+
+        """
+
+        now = timezone.now()
+        old_status = check.status
+        check.status = check.get_status()
+        q = Check.objects.filter(id=check.id, status=old_status)
+        with transaction.atomic():
+            if not q.update(status=check.status):
+                return False
+
+            if check.status != old_status:
+                update_tag_stats({check.id: tag_change(check)})
+
+        if check.status != old_status:
+            self.record_change(check, now)
+
+        return True
+
+    def dispatch(self, checks):
+        """ Notify all channels of the claimed checks at once. """
+
+        for check in checks:
+            tmpl = "\nSending alert, status=%s, code=%s\n"
+            self.stdout.write(tmpl % (check.status, check.code))
+
+        for check, ch, error in self.dispatcher.dispatch(checks):
+            self.stdout.write("ERROR: %s %s %s\n" % (ch.kind, ch.value, error))
+
+        db.release()
+
+    def send_digests(self, checks):
+        """ Notify each channel about all of its claimed checks at once. """
+
+        checks = sorted(checks, key=lambda check: check.name)
+        by_id = {check.id: check for check in checks}
+
+        by_channel = defaultdict(list)
+        q = Channel.checks.through.objects.filter(check_id__in=list(by_id))
+        for channel_id, check_id in q.values_list("channel_id", "check_id"):
+            by_channel[channel_id].append(by_id[check_id])
+
+        channels = Channel.objects.in_bulk(list(by_channel))
+        db.release()
+
+        for check in checks:
+            tmpl = "\nSending alert, status=%s, code=%s\n"
+            self.stdout.write(tmpl % (check.status, check.code))
+
+        groups = [(channels[channel_id], channel_checks)
+                  for channel_id, channel_checks in by_channel.items()]
+
+        if self.dispatcher:
+            errors = self.dispatcher.dispatch_digests(groups)
+            # A digest fails for all of its checks with the same error
+            for ch, error in set((ch, error) for _, ch, error in errors):
+                self.stdout.write("ERROR: %s %s %s\n" %
+                                  (ch.kind, ch.value, error))
+            return
+
+        futures = [executor.submit(self.notify_channel, channel,
+                                   channel_checks)
+                   for channel, channel_checks in groups]
+        for future in futures:
+            future.result()
+
+    def notify_channel(self, channel, checks):
+        db.check()
+        # A digest fails for all of its checks with the same error
+        errors = set(error for check, error in channel.notify_many(checks))
+        for error in errors - set(["", "no-op"]):
+            self.stdout.write("ERROR: %s %s %s\n" %
+                              (channel.kind, channel.value, error))
+
+        db.release()
+
     def handle_one(self, check):
         """ Send an alert for a single check.
 
@@ -40,22 +521,82 @@ class Command(BaseCommand):
 
         """
 
-        # Save the new status. If sendalerts crashes,
+        db.check()
+        if settings.NOTIFICATION_OUTBOX:
+            # Save the new status and queue the notifications together,
+            # so a crash can't lose the alert
+            with transaction.atomic():
+                claimed = self.claim(check)
+                if claimed:
+                    n = check.queue_alert()
+
+            db.release()
+            if not claimed:
+                return False
+
+            tmpl = "\nQueued %d notifications, status=%s, code=%s\n"
+            self.stdout.write(tmpl % (n, check.status, check.code))
+            return True
+
+        # Save the new status first. If sendalerts crashes,
         # it won't process this check again.
-        check.status = check.get_status()
-        check.save()
+        if not self.claim(check):
+            db.release()
+            return False
+
+        return self.send_alert(check)
 
+    def send_alert(self, check):
+        """ Send an alert for a claimed check. """
+
+        db.check()
         tmpl = "\nSending alert, status=%s, code=%s\n"
         self.stdout.write(tmpl % (check.status, check.code))
         errors = check.send_alert()
         for ch, error in errors:
             self.stdout.write("ERROR: %s %s %s\n" % (ch.kind, ch.value, error))
 
-        connection.close()
+        db.release()
         return True
 
-    def handle(self, *args, **options):
-        self.stdout.write("sendalerts is now running")
+    def handle_scheduled(self, scheduler, poll):
+        """ Send alerts if a deadline has passed or a down check has been
+        pinged. Return the number of seconds to sleep. """
+
+        now = timezone.now()
+        going_up = scheduler.refresh(now)
+        if scheduler.pop_due(now) or going_up:
+            self.handle_many()
+
+        return scheduler.seconds_to_next(timezone.now(), poll)
+
+    def run_scheduler(self, poll, rebuild):
+        scheduler = DeadlineScheduler(rebuild, self.shard)
+        last_mark = time.time()
+        while True:
+            time.sleep(self.handle_scheduled(scheduler, poll))
+
+            if time.time() - last_mark > 60:
+                last_mark = time.time()
+                formatted = timezone.now().isoformat()
+                self.stdout.write("-- MARK %s --" % formatted)
+
+    def run(self, options):
+        if options["asyncio"]:
+            # Only loaded when asked for, as it needs Python 3.5+
+            from hc.api.dispatch import Dispatcher
+            self.dispatcher = Dispatcher()
+
+        if options["metrics_port"]:
+            port = options["metrics_port"]
+            if self.shard:
+                # One port per shard, starting from the given one
+                port += self.shard[0]
+
+            exporter.serve("127.0.0.1", port)
+
+        if options["scheduler"]:
+            self.run_scheduler(options["poll"], options["rebuild"])
 
         ticks = 0
         while True:
@@ -68,3 +609,58 @@ class Command(BaseCommand):
             if ticks % 60 == 0:
                 formatted = timezone.now().isoformat()
                 self.stdout.write("-- MARK %s --" % formatted)
+
+    def fork_shard(self, i, n, options):
+        """ Start a child process that runs shard i of n. Return its pid. """
+
+        pid = os.fork()
+        if pid == 0:
+            # The child starts over with its own signal handling and its
+            # own database connections
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            self.shard = (i, n)
+            try:
+                self.run(options)
+            except Exception:
+                logger.exception("Shard %d/%d failed" % (i, n))
+            finally:
+                os._exit(1)
+
+        return pid
+
+    def supervise(self, n, options):
+        """ Run each of the n shards in its own process. Restart shard
+        processes that exit, stop them all when stopped. """
+
+        # Forked children must not share the parent's connection
+        connections.close_all()
+
+        children = {}
+        for i in range(0, n):
+            children[self.fork_shard(i, n, options)] = i
+
+        def stop(signum, frame):
+            raise SystemExit(0)
+
+        signal.signal(signal.SIGTERM, stop)
+        try:
+            while True:
+                pid, status = os.wait()
+                i = children.pop(pid)
+                self.stdout.write("Shard %d/%d exited, restarting" % (i, n))
+                time.sleep(1)
+                children[self.fork_shard(i, n, options)] = i
+        finally:
+            for pid in children:
+                os.kill(pid, signal.SIGTERM)
+
+    def handle(self, *args, **options):
+        self.stdout.write("sendalerts is now running")
+
+        self.bulk = options["bulk"]
+        self.shard = options["shard"]
+
+        if options["shards"]:
+            self.supervise(options["shards"], options)
+        else:
+            self.run(options)
@@ -0,0 +1,97 @@
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from hc.lib import db, mailqueue
+
+
+class Command(BaseCommand):
+    help = """Sends email messages queued by hc.lib.mailqueue.
+
+    Only one sendemails process should run at a time.
+
+    """
+
+    # Created by handle(), with --workers threads
+    executor = None
+
+    def __init__(self, *args, **kwargs):
+        super(Command, self).__init__(*args, **kwargs)
+        self.workers = 2
+        self.batch_size = 100
+        self.local = threading.local()
+        self.senders = []
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            dest='batch_size',
+            default=100,
+            help='Number of messages each worker sends per batch',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            dest='workers',
+            default=2,
+            help='Number of SMTP connections to send over in parallel',
+        )
+
+    def send_batch(self, rows):
+        # Each worker thread keeps its own SMTP connection open
+        if not hasattr(self.local, "sender"):
+            self.local.sender = mailqueue.Sender()
+            self.senders.append(self.local.sender)
+
+        db.check()
+        try:
+            return self.local.sender.send(rows)
+        finally:
+            db.release()
+
+    def close(self):
+        for sender in self.senders:
+            sender.close()
+
+    def handle_many(self):
+        """ Send a batch of messages on every worker. Return the number
+        of messages sent, or None if the queue was empty. """
+
+        rows = mailqueue.claim(self.batch_size * self.workers)
+        if not rows:
+            return None
+
+        batches = [rows[i:i + self.batch_size]
+                   for i in range(0, len(rows), self.batch_size)]
+        futures = [self.executor.submit(self.send_batch, batch)
+                   for batch in batches]
+        return sum(future.result() for future in futures)
+
+    def handle(self, *args, **options):
+        self.workers = options["workers"]
+        self.executor = ThreadPoolExecutor(max_workers=self.workers)
+        self.batch_size = options["batch_size"]
+
+        n = mailqueue.release()
+        self.stdout.write("sendemails is now running, %d messages requeued"
+                          % n)
+
+        ticks = 0
+        try:
+            while True:
+                n = self.handle_many()
+                if n is None:
+                    ticks += 1
+                    time.sleep(1)
+                else:
+                    ticks = 1
+                    self.stdout.write("Sent %d messages" % n)
+
+                if ticks % 60 == 0:
+                    formatted = timezone.now().isoformat()
+                    self.stdout.write("-- MARK %s --" % formatted)
+        finally:
+            self.close()
@@ -0,0 +1,132 @@
+import logging
+import random
+import time
+from datetime import timedelta as td
+
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from hc.api import metrics, transports
+from hc.api.models import Outbox
+from hc.lib import db
+from hc.lib import metrics as exporter
+
+logger = logging.getLogger(__name__)
+
+# A claimed item is not picked up by other sendoutbox processes for this
+# long. Should be well above the time a delivery attempt can take.
+LEASE = td(minutes=5)
+
+
+def retry_delay(n_attempts):
+    """ Exponential backoff with jitter, in seconds. """
+
+    delay = settings.OUTBOX_RETRY_DELAY * 2 ** (n_attempts - 1)
+    delay = min(delay, settings.OUTBOX_MAX_RETRY_DELAY)
+    return random.uniform(delay / 2.0, delay)
+
+
+class Command(BaseCommand):
+    help = 'Delivers notifications queued by sendalerts'
+    # Created by handle(), with --workers threads
+    executor = None
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers',
+            type=int,
+            dest='workers',
+            default=10,
+            help='Number of notifications to deliver in parallel',
+        )
+        parser.add_argument(
+            '--metrics-port',
+            type=int,
+            dest='metrics_port',
+            default=None,
+            help='Serve delivery metrics in Prometheus format on this port '
+                 'of localhost',
+        )
+
+    def claim(self, now, limit=100):
+        """ Return due items, after pushing their next_attempt forward so
+        other sendoutbox processes skip them. """
+
+        q = Outbox.objects.filter(next_attempt__lte=now)
+        q = q.select_related("owner", "owner__user", "channel", "channel__user")
+        q = q.order_by("next_attempt")[:limit]
+
+        claimed = []
+        for item in q:
+            # Only succeeds if no other process claimed the item meanwhile
+            mine = Outbox.objects.filter(id=item.id,
+                                         next_attempt=item.next_attempt)
+            if mine.update(next_attempt=now + LEASE):
+                claimed.append(item)
+
+        return claimed
+
+    def deliver(self, item):
+        """ Make one delivery attempt, then either remove the item, or
+        schedule another attempt. """
+
+        db.check()
+        try:
+            error = item.deliver()
+        except Exception:
+            logger.exception("Delivery failed")
+            error = "Unexpected error"
+
+        now = timezone.now()
+        item.n_attempts += 1
+
+        if error in ("", "no-op"):
+            item.delete()
+        elif now - item.created > td(seconds=settings.OUTBOX_MAX_AGE):
+            tmpl = "Giving up on %s %s: %s\n"
+            self.stdout.write(tmpl % (item.channel.kind, item.channel.value,
+                                      error))
+            item.delete()
+        else:
+            delay = td(seconds=retry_delay(item.n_attempts))
+            item.next_attempt = now + delay
+            item.save(update_fields=["n_attempts", "next_attempt"])
+
+        db.release()
+        return error
+
+    def handle_many(self):
+        """ Deliver all due items. Return False if there were none. """
+
+        metrics.outbox_items.set(Outbox.objects.count())
+        items = self.claim(timezone.now())
+        if not items:
+            return False
+
+        # Alerts for the same user in this batch share one check summary
+        transports.summaries.begin()
+        for future in [self.executor.submit(self.deliver, item)
+                       for item in items]:
+            future.result()
+
+        return True
+
+    def handle(self, *args, **options):
+        self.executor = ThreadPoolExecutor(max_workers=options["workers"])
+        if options["metrics_port"]:
+            exporter.serve("127.0.0.1", options["metrics_port"])
+
+        self.stdout.write("sendoutbox is now running")
+
+        ticks = 0
+        while True:
+            if self.handle_many():
+                ticks = 1
+            else:
+                ticks += 1
+                time.sleep(1)
+
+            if ticks % 60 == 0:
+                formatted = timezone.now().isoformat()
+                self.stdout.write("-- MARK %s --" % formatted)
@@ -0,0 +1,262 @@
+import asyncio
+import logging
+import re
+import uuid
+from collections import defaultdict
+
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils import timezone
+from hc.api import pings
+
+logger = logging.getLogger(__name__)
+
+ADDRESS = re.compile(r"<([^>]*)>")
+# Max. number of pings passed to a single pings.record_many() call
+CHUNK_SIZE = 100
+
+
+def _parse_address(arg):
+    """ Return the address from a "FROM:<...>" or "TO:<...>" argument. """
+
+    m = ADDRESS.search(arg)
+    if m:
+        return m.group(1).strip()
+
+    return arg.partition(":")[2].strip()
+
+
+def _parse_code(address):
+    """ Return the check code from a "<code>@<domain>" address,
+    or None if the local part is not a valid UUID. """
+
+    local_part = address.rpartition("@")[0]
+    try:
+        return uuid.UUID(local_part)
+    except ValueError:
+        return None
+
+
+class PingBatcher(object):
+    """ Collects received email pings and writes them in batches.
+
+    Pings are written by a single worker thread, every `interval` seconds
+    or as soon as `batch_size` pings have been collected.
+
+    """
+
+    def __init__(self, loop, interval=1.0, batch_size=500):
+        self.loop = loop
+        self.interval = interval
+        self.batch_size = batch_size
+        self.pending = []
+        self.wakeup = asyncio.Event()
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+    def add(self, code, remote_addr, mail_from):
+        self.pending.append((code, timezone.now(), remote_addr, mail_from))
+        if len(self.pending) >= self.batch_size:
+            self.wakeup.set()
+
+    async def flush(self):
+        batch, self.pending = self.pending, []
+        if batch:
+            await self.loop.run_in_executor(self.executor, self.write, batch)
+
+    async def run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+
+            self.wakeup.clear()
+            await self.flush()
+
+    def write(self, batch):
+        # Pings from the same sender share remote_addr and user agent,
+        # so they can be recorded together
+        groups = defaultdict(list)
+        for code, ts, remote_addr, mail_from in batch:
+            groups[(remote_addr, mail_from)].append((code, ts))
+
+        for (remote_addr, mail_from), items in groups.items():
+            for i in range(0, len(items), CHUNK_SIZE):
+                try:
+                    pings.record_many(items[i:i + CHUNK_SIZE],
+                                      remote_addr=remote_addr,
+                                      scheme="email",
+                                      method="email",
+                                      ua="Email from %s" % mail_from)
+                except Exception:
+                    logger.exception("Could not record email pings")
+                    # The connection may be broken, get a fresh one
+                    connection.close()
+
+
+class SMTPSession(object):
+    """ Handles one SMTP connection.
+
+    Implements just enough of RFC 5321 to receive messages: the message
+    itself is discarded, and each recipient address that looks like
+    "<code>@<domain>" is recorded as a ping.
+
+    """
+
+    def __init__(self, reader, writer, batcher, hostname, timeout):
+        self.reader = reader
+        self.writer = writer
+        self.batcher = batcher
+        self.hostname = hostname
+        self.timeout = timeout
+
+        peer = writer.get_extra_info("peername")
+        self.remote_addr = peer[0] if peer else None
+        self.reset()
+
+    def reset(self):
+        self.mail_from = None
+        self.codes = []
+
+    def reply(self, line):
+        self.writer.write(line.encode("utf-8") + b"\r\n")
+
+    async def readline(self):
+        return await asyncio.wait_for(self.reader.readline(), self.timeout)
+
+    async def read_data(self):
+        """ Read and discard message contents up to the final ".". """
+
+        while True:
+            line = await self.readline()
+            if not line:
+                return False
+            if line.rstrip(b"\r\n") == b".":
+                return True
+
+    async def handle(self):
+        self.reply("220 %s ESMTP healthchecks" % self.hostname)
+        while True:
+            line = await self.readline()
+            if not line:
+                break
+
+            line = line.decode("utf-8", "replace").strip()
+            command, _, arg = line.partition(" ")
+            command = command.upper()
+
+            if command in ("HELO", "EHLO"):
+                self.reset()
+                self.reply("250 %s" % self.hostname)
+            elif command == "MAIL":
+                self.reset()
+                self.mail_from = _parse_address(arg)
+                self.reply("250 OK")
+            elif command == "RCPT":
+                if self.mail_from is None:
+                    self.reply("503 Need MAIL command")
+                    continue
+
+                code = _parse_code(_parse_address(arg))
+                if code is None:
+                    self.reply("550 No such check")
+                    continue
+
+                self.codes.append(code)
+                self.reply("250 OK")
+            elif command == "DATA":
+                if not self.codes:
+                    self.reply("503 Need RCPT command")
+                    continue
+
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                await self.writer.drain()
+                if not await self.read_data():
+                    break
+
+                for code in self.codes:
+                    self.batcher.add(code, self.remote_addr, self.mail_from)
+
+                self.reset()
+                self.reply("250 OK")
+            elif command == "RSET":
+                self.reset()
+                self.reply("250 OK")
+            elif command == "NOOP":
+                self.reply("250 OK")
+            elif command == "QUIT":
+                self.reply("221 Bye")
+                break
+            else:
+                self.reply("502 Command not implemented")
+
+            await self.writer.drain()
+
+        await self.writer.drain()
+
+
+class Command(BaseCommand):
+    help = "Receive email pings over SMTP"
+    # Drop clients that have been idle for this many seconds
+    timeout = 60
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--host',
+            dest='host',
+            default='localhost',
+            help='Address to listen on',
+        )
+        parser.add_argument(
+            '--port',
+            type=int,
+            dest='port',
+            default=25,
+            help='Port to listen on',
+        )
+
+    async def handle_connection(self, reader, writer):
+        session = SMTPSession(reader, writer, self.batcher,
+                              settings.PING_EMAIL_DOMAIN, self.timeout)
+        try:
+            await session.handle()
+        except (asyncio.TimeoutError, ConnectionError, ValueError):
+            # Idle client, dropped connection or a line that is too long
+            pass
+        finally:
+            writer.close()
+
+    def start(self, loop, host, port):
+        """ Start listening and return the server. """
+
+        self.batcher = PingBatcher(loop)
+        self.batcher_task = loop.create_task(self.batcher.run())
+
+        coro = asyncio.start_server(self.handle_connection, host, port)
+        return loop.run_until_complete(coro)
+
+    def stop(self, loop, server):
+        """ Stop listening and write out any pending pings. """
+
+        server.close()
+        loop.run_until_complete(server.wait_closed())
+        self.batcher_task.cancel()
+        loop.run_until_complete(self.batcher.flush())
+        self.batcher.executor.shutdown()
+
+    def handle(self, *args, **options):
+        loop = asyncio.get_event_loop()
+        server = self.start(loop, options["host"], options["port"])
+        self.stdout.write("smtpd is listening on %s:%d" %
+                          (options["host"], options["port"]))
+
+        try:
+            loop.run_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop(loop, server)
+
+        return "Done!"
@@ -0,0 +1,48 @@
+""" Alert latency and throughput metrics, see hc.lib.metrics. """
+
+from hc.lib.metrics import Counter, Gauge, Histogram
+
+flip_delay = Histogram(
+    "hc_status_change_delay_seconds",
+    "Time from a check's alert_after (going down) or last ping (going "
+    "up) until sendalerts changed its status",
+    labels=["status"])
+
+delivery_delay = Histogram(
+    "hc_notification_delay_seconds",
+    "Time from a check's status change until its notification was "
+    "delivered",
+    labels=["kind"])
+
+notification_duration = Histogram(
+    "hc_notification_duration_seconds",
+    "Time spent sending a notification, including retries",
+    labels=["kind"])
+
+notifications = Counter(
+    "hc_notifications_total",
+    "Notifications sent, including failed ones",
+    labels=["kind"])
+
+notification_errors = Counter(
+    "hc_notification_errors_total",
+    "Notifications that failed",
+    labels=["kind"])
+
+status_changes = Counter(
+    "hc_status_changes_total",
+    "Checks that sendalerts changed the status of",
+    labels=["status"])
+
+due_checks = Gauge(
+    "hc_sendalerts_due_checks",
+    "Checks found going up or down in the last sendalerts pass")
+
+pass_duration = Histogram(
+    "hc_sendalerts_pass_duration_seconds",
+    "Time a sendalerts pass took, including sending its notifications")
+
+outbox_items = Gauge(
+    "hc_outbox_items",
+    "Notifications waiting in the outbox, including ones being retried, "
+    "as of the last sendoutbox pass")
@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10 on 2026-10-18 10:47
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0026_auto_20160415_1824'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='ping',
+            name='created',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
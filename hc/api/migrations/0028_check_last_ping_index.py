@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10 on 2026-10-18 10:52
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0027_ping_created_default'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='check',
+            name='last_ping',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+    ]
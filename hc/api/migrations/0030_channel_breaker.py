@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10 on 2026-10-18 11:00
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0029_outbox'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='channel',
+            name='breaker_until',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='channel',
+            name='n_failures',
+            field=models.IntegerField(default=0),
+        ),
+    ]
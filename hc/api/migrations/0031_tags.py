@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10 on 2026-10-18 11:25
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_tags(apps, schema_editor):
+    Check = apps.get_model("api", "Check")
+    Tag = apps.get_model("api", "Tag")
+    CheckTag = apps.get_model("api", "CheckTag")
+
+    q = Check.objects.filter(user__isnull=False).exclude(tags="")
+    tags, rows = {}, []
+    for check_id, user_id, value in q.values_list("id", "user_id", "tags"):
+        for name in set(t.strip() for t in value.split(" ") if t.strip()):
+            if len(name) > 191:
+                # Too long to index, and rejected for new checks
+                continue
+
+            key = (user_id, name)
+            if key not in tags:
+                tags[key] = Tag.objects.create(user_id=user_id, name=name)
+
+            rows.append(CheckTag(owner_id=check_id, tag=tags[key]))
+
+    CheckTag.objects.bulk_create(rows, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('api', '0030_channel_breaker'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CheckTag',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='api.Check')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Tag',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=191)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='checktag',
+            name='tag',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='api.Tag'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='tag',
+            unique_together=set([('user', 'name')]),
+        ),
+        migrations.AlterUniqueTogether(
+            name='checktag',
+            unique_together=set([('owner', 'tag')]),
+        ),
+        migrations.RunPython(fill_tags, migrations.RunPython.noop),
+    ]
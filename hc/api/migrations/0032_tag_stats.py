@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10 on 2026-10-18 11:30
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.utils import timezone
+import django.utils.timezone
+
+
+def fill_stats(apps, schema_editor):
+    Tag = apps.get_model("api", "Tag")
+    CheckTag = apps.get_model("api", "CheckTag")
+
+    now = timezone.now()
+    stats = {}
+    q = CheckTag.objects.values_list("tag_id", "owner__status",
+                                     "owner__last_ping", "owner__timeout")
+    for tag_id, status, last_ping, timeout in q:
+        n_checks, n_down, late_after = stats.get(tag_id, (0, 0, None))
+        if status == "down":
+            n_down += 1
+        else:
+            if status == "up" and last_ping:
+                bound = last_ping + timeout
+            else:
+                bound = now + timeout
+            if late_after is None or bound < late_after:
+                late_after = bound
+
+        stats[tag_id] = (n_checks + 1, n_down, late_after)
+
+    for tag_id, (n_checks, n_down, late_after) in stats.items():
+        Tag.objects.filter(id=tag_id).update(
+            n_checks=n_checks, n_down=n_down, late_after=late_after)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0031_tags'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tag',
+            name='changed',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='tag',
+            name='late_after',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='tag',
+            name='n_checks',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='tag',
+            name='n_down',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(fill_stats, migrations.RunPython.noop),
+    ]
@@ -2,15 +2,17 @@
 
 import hashlib
 import json
+import time
 import uuid
 from datetime import timedelta as td
 
 from django.conf import settings
 from django.contrib.auth.models import User
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Case, DateTimeField, F, Value, When
 from django.urls import reverse
 from django.utils import timezone
-from hc.api import transports
+from hc.api import metrics, transports
 from hc.lib import emails
 
 STATUSES = (
@@ -19,7 +21,11 @@ STATUSES = (
     ("new", "New"),
     ("paused", "Paused")
 )
+# Tag aggregates depend on these Check fields
+TAG_FIELDS = ("tags", "status", "timeout", "last_ping")
 DEFAULT_TIMEOUT = td(days=1)
+# Longer tag names would not fit MySQL's index key limit with utf8mb4
+MAX_TAG_LENGTH = 191
 DEFAULT_GRACE = td(hours=1)
 CHANNEL_KINDS = (("email", "Email"), ("webhook", "Webhook"),
                  ("hipchat", "HipChat"),
@@ -49,9 +55,65 @@ class Check(models.Model):
     timeout = models.DurationField(default=DEFAULT_TIMEOUT)
     grace = models.DurationField(default=DEFAULT_GRACE)
     n_pings = models.IntegerField(default=0)
-    last_ping = models.DateTimeField(null=True, blank=True)
+    # sendalerts --scheduler looks for recently pinged checks using this
+    last_ping = models.DateTimeField(null=True, blank=True, db_index=True)
     alert_after = models.DateTimeField(null=True, blank=True, editable=False)
     status = models.CharField(max_length=6, choices=STATUSES, default="new")
+    # Not stored: set by sendalerts when it changes the status, so
+    # notifications can report how long delivery took
+    status_changed = None
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None:
+            if not set(update_fields) & set(TAG_FIELDS):
+                return super(Check, self).save(*args, **kwargs)
+
+        # The tag aggregates change by what the row had before this write,
+        # not by what this instance loaded: sendalerts may have changed
+        # the status since. The lock keeps it from changing it meanwhile.
+        with transaction.atomic():
+            old = None
+            if self.pk is not None:
+                q = Check.objects.select_for_update().filter(id=self.pk)
+                old = q.values(*TAG_FIELDS).first()
+
+            super(Check, self).save(*args, **kwargs)
+            self._update_tags(old, update_fields)
+
+    def _update_tags(self, old, update_fields):
+        """ Update tags and their aggregates after a save. `old` has the
+        TAG_FIELDS values from before the save, None for a new check. """
+
+        if old is None:
+            if self.tags:
+                self.sync_tags()
+            return
+
+        # Deferred fields and fields not in update_fields keep their value
+        new = {}
+        for f in TAG_FIELDS:
+            saved = update_fields is None or f in update_fields
+            new[f] = self.__dict__[f] if saved and f in self.__dict__ \
+                else old[f]
+
+        # First update the aggregates of the tags the check already has,
+        # then add and remove tags. Pings only move last_ping forward, and
+        # with it the check's late bound, which is safe to leave stale.
+        moved_back = old["last_ping"] and (
+            not new["last_ping"] or new["last_ping"] < old["last_ping"])
+        if moved_back or (old["status"], old["timeout"]) != \
+                (new["status"], new["timeout"]):
+            n_down = (new["status"] == "down") - (old["status"] == "down")
+            update_tag_stats({self.id: (0, n_down, self.late_bound())})
+
+        if new["tags"] != old["tags"]:
+            self.sync_tags()
+
+    def delete(self, *args, **kwargs):
+        # Take the check out of its tags' aggregates
+        with transaction.atomic():
+            self.sync_tags(names=set())
+            return super(Check, self).delete(*args, **kwargs)
 
     def name_then_code(self):
         if self.name:
@@ -80,6 +142,18 @@ class Check(models.Model):
 
         return errors
 
+    def queue_alert(self):
+        """ Queue notifications about the current status for all of the
+        check's channels. The sendoutbox command delivers them. """
+
+        if self.status not in ("up", "down"):
+            raise NotImplementedError("Unexpected status: %s" % self.status)
+
+        items = [Outbox(owner=self, channel=channel, check_status=self.status)
+                 for channel in self.channel_set.all()]
+        Outbox.objects.bulk_create(items)
+        return len(items)
+
     def get_status(self):
         if self.status in ("new", "paused"):
             return self.status
@@ -107,6 +181,61 @@ class Check(models.Model):
     def tags_list(self):
         return [t.strip() for t in self.tags.split(" ") if t.strip()]
 
+    def tag_names(self):
+        """ The tags that get Tag rows: none for checks without an owner,
+        and none too long to index, which only older checks can have. """
+
+        if not self.user_id:
+            return set()
+
+        return set(t for t in self.tags_list() if len(t) <= MAX_TAG_LENGTH)
+
+    def late_bound(self, now=None):
+        """ Return the earliest time the check could be late, or None if
+        it is down.
+
+        A new or paused check is not due until `timeout` after its next
+        ping, which is `timeout` from now at the earliest.
+
+        """
+
+        if self.status == "down":
+            return None
+
+        if self.status == "up" and self.last_ping:
+            return self.last_ping + self.timeout
+
+        return (now or timezone.now()) + self.timeout
+
+    def sync_tags(self, names=None):
+        """ Make the check's CheckTag rows match its tags field, or the
+        given set of tag names, and update the tags' aggregates. """
+
+        if names is None:
+            names = self.tag_names()
+
+        q = CheckTag.objects.filter(owner=self)
+        removed = q.exclude(tag__name__in=names)
+        removed_ids = list(removed.values_list("tag_id", flat=True))
+        removed.delete()
+
+        have = set(q.values_list("tag__name", flat=True))
+        rows = []
+        for name in names - have:
+            tag, _ = Tag.objects.get_or_create(user_id=self.user_id, name=name)
+            rows.append(CheckTag(owner=self, tag=tag))
+
+        CheckTag.objects.bulk_create(rows)
+
+        is_down = int(self.status == "down")
+        changes = {}
+        for tag_id in removed_ids:
+            changes[tag_id] = (-1, -is_down, None)
+        for row in rows:
+            changes[row.tag_id] = (1, is_down, self.late_bound())
+
+        Tag.apply(changes)
+
     def to_dict(self):
         pause_rel_url = reverse("hc-api-pause", args=[self.code])
 
@@ -131,10 +260,135 @@ class Check(models.Model):
         return result
 
 
+class Tag(models.Model):
+    """ A tag in use by some of a user's checks.
+
+    Check.tags stays the source of truth. Check.save() mirrors it into
+    the Tag and CheckTag tables, so tag lookups can use indexes.
+
+    """
+
+    class Meta:
+        unique_together = ("user", "name")
+
+    user = models.ForeignKey(User)
+    name = models.CharField(max_length=MAX_TAG_LENGTH)
+    # Aggregates over the tag's checks, updated as the checks change
+    # and rebuilt by the checktags command
+    n_checks = models.IntegerField(default=0)
+    n_down = models.IntegerField(default=0)
+    # No check of the tag can be late before this time. It may be
+    # earlier than needed, get_status() then works out a new one.
+    late_after = models.DateTimeField(null=True, blank=True)
+    # When the aggregates last changed
+    changed = models.DateTimeField(default=timezone.now)
+
+    @staticmethod
+    def combine(items):
+        """ Add up several (n_checks, n_down, late_bound) changes. """
+
+        bounds = [bound for _, _, bound in items if bound is not None]
+        return (sum(item[0] for item in items),
+                sum(item[1] for item in items),
+                min(bounds) if bounds else None)
+
+    @staticmethod
+    def apply(changes):
+        """ Update tags in place, from a dict of tag ids to
+        (n_checks, n_down, late_bound) changes. """
+
+        now = timezone.now()
+        for tag_id, (n_checks, n_down, bound) in changes.items():
+            fields = {"changed": now}
+            if n_checks:
+                fields["n_checks"] = F("n_checks") + n_checks
+            if n_down:
+                fields["n_down"] = F("n_down") + n_down
+            if bound is not None:
+                fields["late_after"] = _earliest("late_after", bound)
+
+            if len(fields) > 1:
+                Tag.objects.filter(id=tag_id).update(**fields)
+
+    def compute_late_after(self, now):
+        """ Work out late_after from the tag's checks. """
+
+        q = Check.objects.filter(checktag__tag=self)
+        bounds = [check.late_bound(now) for check in q]
+        bounds = [bound for bound in bounds if bound is not None]
+        return min(bounds) if bounds else None
+
+    def get_status(self, now=None):
+        """ Return "down" if any of the tag's checks are down, "late" if
+        any are past their period, and "up" otherwise. """
+
+        if now is None:
+            now = timezone.now()
+
+        if self.n_down > 0:
+            return "down"
+
+        if self.late_after is not None and self.late_after <= now:
+            # Some check was due by late_after, but may have been
+            # pinged since
+            late_after = self.compute_late_after(now)
+            if late_after != self.late_after:
+                # Only if no check has moved late_after meanwhile
+                q = Tag.objects.filter(id=self.id, late_after=self.late_after)
+                if q.update(late_after=late_after, changed=now):
+                    self.late_after, self.changed = late_after, now
+                else:
+                    self.refresh_from_db(fields=["late_after", "changed"])
+                    late_after = self.late_after
+
+            if late_after is not None and late_after <= now:
+                return "late"
+
+        return "up"
+
+
+def _earliest(field, value):
+    """ An expression for the earlier of a nullable date field and value. """
+
+    return Case(When(**{field + "__isnull": True, "then": Value(value)}),
+                When(**{field + "__gt": value, "then": Value(value)}),
+                default=F(field), output_field=DateTimeField())
+
+
+def update_tag_stats(changes):
+    """ Update the aggregates of the checks' tags.
+
+    `changes` maps check ids to (n_checks, n_down, late_bound) tuples:
+    how many checks and down checks each of the check's tags gains, or
+    loses if negative, and a time the tags' late_after must not be
+    later than, or None.
+
+    """
+
+    ids = list(changes)
+    per_tag = {}
+    for i in range(0, len(ids), 500):
+        q = CheckTag.objects.filter(owner_id__in=ids[i:i + 500])
+        for check_id, tag_id in q.values_list("owner_id", "tag_id"):
+            per_tag.setdefault(tag_id, []).append(changes[check_id])
+
+    Tag.apply({tag_id: Tag.combine(items)
+               for tag_id, items in per_tag.items()})
+
+
+class CheckTag(models.Model):
+    class Meta:
+        unique_together = ("owner", "tag")
+
+    owner = models.ForeignKey(Check)
+    tag = models.ForeignKey(Tag)
+
+
 class Ping(models.Model):
     n = models.IntegerField(null=True)
     owner = models.ForeignKey(Check)
-    created = models.DateTimeField(auto_now_add=True)
+    # Not auto_now_add: buffered pings are saved after they are received
+    created = models.DateTimeField(default=timezone.now)
     scheme = models.CharField(max_length=10, default="http")
     remote_addr = models.GenericIPAddressField(blank=True, null=True)
     method = models.CharField(max_length=10, blank=True)
@@ -149,6 +403,10 @@ class Channel(models.Model):
     value = models.TextField(blank=True)
     email_verified = models.BooleanField(default=False)
     checks = models.ManyToManyField(Check)
+    # Circuit breaker: consecutive failed notifications, and until when
+    # notifications are skipped. See deliver().
+    n_failures = models.IntegerField(default=0)
+    breaker_until = models.DateTimeField(null=True, blank=True)
 
     def assign_all_checks(self):
         checks = Check.objects.filter(user=self.user)
@@ -186,14 +444,107 @@ class Channel(models.Model):
         else:
             raise NotImplementedError("Unknown channel kind: %s" % self.kind)
 
-    def notify(self, check):
-        # Make 3 attempts--
-        for x in range(0, 3):
-            error = self.transport.notify(check) or ""
+    def breaker_state(self):
+        if self.breaker_until is None:
+            return "closed"
+        elif self.breaker_until > timezone.now():
+            return "open"
+        else:
+            return "half-open"
+
+    def claim_probe(self, now):
+        """ Push breaker_until forward, so no other process probes
+        the channel at the same time. Return False if another process
+        already did. """
+
+        until = now + td(seconds=settings.BREAKER_COOLDOWN)
+        q = Channel.objects.filter(id=self.id)
+        if not q.filter(breaker_until=self.breaker_until).update(
+                breaker_until=until):
+            return False
+
+        self.breaker_until = until
+        return True
+
+    def record_result(self, error, now):
+        """ Update the circuit breaker after a delivery. """
+
+        q = Channel.objects.filter(id=self.id)
+        if error in ("", "no-op"):
+            if self.n_failures or self.breaker_until:
+                q.update(n_failures=0, breaker_until=None)
+                self.n_failures, self.breaker_until = 0, None
+            return
+
+        q.update(n_failures=models.F("n_failures") + 1)
+        self.n_failures = q.values_list("n_failures", flat=True)[0]
+        if self.n_failures >= settings.BREAKER_THRESHOLD:
+            until = now + td(seconds=settings.BREAKER_COOLDOWN)
+            if q.filter(breaker_until=None).update(breaker_until=until):
+                self.breaker_until = until
+
+    def deliver(self, check, attempts=3):
+        """ Send a notification about `check`. See send(). """
+
+        return self.send(self.transport.notify, check, attempts)
+
+    def deliver_digest(self, checks, attempts=3):
+        """ Send a single notification about `checks`. See send(). """
+
+        return self.send(self.transport.notify_digest, checks, attempts)
+
+    def send(self, notify, arg, attempts):
+        """ Call notify(arg), through the channel's circuit breaker.
+
+        After BREAKER_THRESHOLD failed deliveries in a row the breaker
+        opens, and for BREAKER_COOLDOWN seconds deliveries fail right
+        away. After that, a single delivery attempt is let through as a
+        probe: if it succeeds the breaker closes, otherwise it stays open
+        for another BREAKER_COOLDOWN seconds.
+
+        Return the error message, or "" on success.
+
+        """
+
+        now = timezone.now()
+        if self.breaker_until is not None:
+            if self.breaker_until > now or not self.claim_probe(now):
+                metrics.notifications.inc(kind=self.kind)
+                metrics.notification_errors.inc(kind=self.kind)
+                tmpl = "Skipped after %d failed notifications"
+                return tmpl % self.n_failures
+
+            attempts = 1
+
+        start = time.time()
+        for x in range(0, attempts):
+            error = notify(arg) or ""
             if error in ("", "no-op"):
                 break  # Success!
 
         if error != "no-op":
+            duration = time.time() - start
+            metrics.notification_duration.observe(duration, kind=self.kind)
+            metrics.notifications.inc(kind=self.kind)
+            if error:
+                metrics.notification_errors.inc(kind=self.kind)
+
+        self.record_result(error, now)
+        return error
+
+    def record_delay(self, check):
+        """ Record how long after its status change the check's
+        notification went out. """
+
+        if check.status_changed is not None:
+            delay = (timezone.now() - check.status_changed).total_seconds()
+            metrics.delivery_delay.observe(delay, kind=self.kind)
+
+    def notify(self, check):
+        error = self.deliver(check)
+
+        if error != "no-op":
+            self.record_delay(check)
             n = Notification(owner=check, channel=self)
             n.check_status = check.status
             n.error = error
@@ -201,6 +552,34 @@ class Channel(models.Model):
 
         return error
 
+    def notify_many(self, checks):
+        """ Notify about several checks that changed status together.
+
+        If the transport supports digests and there are at least
+        DIGEST_THRESHOLD checks, send a single notification about all
+        of them. Either way, record a Notification for each check.
+
+        Return a list of (check, error) tuples.
+
+        """
+
+        threshold = settings.DIGEST_THRESHOLD
+        if not self.transport.digest or not 0 < threshold <= len(checks):
+            return [(check, self.notify(check)) for check in checks]
+
+        error = self.deliver_digest(checks)
+        if error != "no-op":
+            for check in checks:
+                self.record_delay(check)
+
+            Notification.objects.bulk_create([
+                Notification(owner=check, channel=self, error=error,
+                             check_status=check.status)
+                for check in checks
+            ])
+
+        return [(check, error) for check in checks]
+
     def test(self):
         return self.transport().test()
 
@@ -263,3 +642,38 @@ class Notification(models.Model):
     channel = models.ForeignKey(Channel)
     created = models.DateTimeField(auto_now_add=True)
     error = models.CharField(max_length=200, blank=True)
+
+
+class Outbox(models.Model):
+    """ A notification waiting to be delivered by the sendoutbox command.
+
+    Items are deleted once delivered, or once they are too old to be
+    worth retrying. Every delivery attempt is recorded as a Notification.
+
+    """
+
+    owner = models.ForeignKey(Check)
+    channel = models.ForeignKey(Channel)
+    check_status = models.CharField(max_length=6)
+    created = models.DateTimeField(auto_now_add=True)
+    next_attempt = models.DateTimeField(default=timezone.now, db_index=True)
+    n_attempts = models.IntegerField(default=0)
+
+    def deliver(self):
+        """ Make one delivery attempt. Return the error message. """
+
+        # Notify about the status at the time the item was queued
+        check = self.owner
+        check.status = self.check_status
+        # Queued in the same transaction as the status change
+        check.status_changed = self.created
+
+        error = self.channel.deliver(check, attempts=1)
+        if error != "no-op":
+            self.channel.record_delay(check)
+            n = Notification(owner=check, channel=self.channel)
+            n.check_status = self.check_status
+            n.error = error
+            n.save()
+
+        return error
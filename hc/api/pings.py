@@ -0,0 +1,511 @@
+import atexit
+import json
+import logging
+import threading
+import time
+import uuid
+from datetime import datetime
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import (Case, DateTimeField, F, IntegerField, Value,
+                              When)
+from django.utils import timezone
+from django.utils.timezone import utc
+from six import string_types
+from six.moves import queue
+
+from hc.api.models import Check, Ping
+
+logger = logging.getLogger(__name__)
+
+# Fields that touch() knows the values of, in model field order. The
+# returned Check instances have all other fields deferred.
+TOUCHED_FIELDS = ["id", "code", "n_pings", "last_ping", "alert_after",
+                  "status"]
+MAX_BULK_PINGS = 100
+
+
+def _pg(code, now):
+    with connection.cursor() as cursor:
+        cursor.execute("""
+        UPDATE api_check
+        SET n_pings = n_pings + 1,
+            last_ping = %s,
+            status = CASE
+                WHEN status IN ('new', 'paused') THEN 'up'
+                ELSE status
+            END
+        WHERE code = %s
+        RETURNING id, code, n_pings, last_ping, alert_after, status
+        """, [now, str(code)])
+
+        row = cursor.fetchone()
+
+    if row is None:
+        return None
+
+    return Check.from_db(connection.alias, TOUCHED_FIELDS, row)
+
+
+def _status_after_ping():
+    return Case(When(status__in=("new", "paused"), then=Value("up")),
+                default=F("status"))
+
+
+def _fallback(code, now):
+    q = Check.objects.filter(code=code)
+    status = _status_after_ping()
+
+    # Update and read back in one transaction so the n_pings value we
+    # read is the one we wrote, not a concurrent ping's.
+    with transaction.atomic():
+        if q.update(n_pings=F("n_pings") + 1, last_ping=now, status=status):
+            return q.only(*TOUCHED_FIELDS).get()
+
+
+def touch(code, now=None):
+    """ Record a ping against the check's row.
+
+    Increments n_pings, sets last_ping and moves new and paused checks
+    to "up". Returns the check with updated n_pings, last_ping, status and
+    alert_after loaded (other fields are deferred), or None if there is
+    no check with the given code.
+
+    On PostgreSQL this is a single UPDATE ... RETURNING statement.
+
+    """
+
+    if now is None:
+        now = timezone.now()
+
+    if connection.vendor == "postgresql":
+        return _pg(code, now)
+
+    return _fallback(code, now)
+
+
+def _make_ping(check, n, created=None, remote_addr=None, scheme="http",
+               method="", ua=""):
+    ping = Ping(owner=check, n=n)
+    if created:
+        ping.created = created
+    ping.remote_addr = remote_addr
+    ping.scheme = scheme
+    ping.method = method
+    # If User-Agent is longer than 200 characters, truncate it:
+    ping.ua = ua[:200]
+    return ping
+
+
+def _save_pings(pings):
+    if settings.PING_LOG_BUFFERED:
+        buffer = get_buffer()
+        for ping in pings:
+            buffer.append(ping)
+    elif len(pings) == 1:
+        pings[0].save()
+    else:
+        Ping.objects.bulk_create(pings)
+
+
+def _record(code, **attrs):
+    check = touch(code)
+    if check is None:
+        return None
+
+    _save_pings([_make_ping(check, check.n_pings, **attrs)])
+    return check
+
+
+def record(code, remote_addr=None, scheme="http", method="", ua=""):
+    """ Update the check and write a Ping log entry for it.
+
+    Returns the updated check, or None if the code does not match
+    any check. If ping coalescing is enabled, the returned check may be
+    the one from an earlier ping in the same coalescing window.
+
+    """
+
+    attrs = {"remote_addr": remote_addr, "scheme": scheme, "method": method,
+             "ua": ua}
+
+    if settings.PING_COALESCE_WINDOW:
+        return get_coalescer().record(code, **attrs)
+
+    return _record(code, **attrs)
+
+
+def record_many(items, remote_addr=None, scheme="http", method="", ua="",
+                sample=1):
+    """ Record many pings, possibly for many checks, in a few queries.
+
+    `items` is a list of (code, timestamp) pairs, or (code, timestamp,
+    attrs) triples where `attrs` is a dict that overrides the ping
+    attributes given as keyword arguments for that ping. Timestamp can be
+    None, which means "now". Timestamps in the future are treated as
+    "now". A check's last_ping never moves backwards.
+
+    With `sample` greater than 1, only every sample-th ping of a check is
+    written to the Ping log. n_pings still counts all of them.
+
+    Returns a (checks, unknown_codes) tuple: the updated checks, and
+    the codes that don't match any check.
+
+    """
+
+    defaults = {"remote_addr": remote_addr, "scheme": scheme,
+                "method": method, "ua": ua}
+
+    now = timezone.now()
+    received = {}
+    for item in items:
+        code, ts = item[0], item[1]
+        ts = now if ts is None else min(ts, now)
+        attrs = dict(defaults, **item[2]) if len(item) > 2 else defaults
+        received.setdefault(str(code), []).append((ts, attrs))
+
+    fields = ["id", "code", "n_pings", "last_ping", "status"]
+    with transaction.atomic():
+        q = Check.objects.filter(code__in=list(received))
+        # Lock rows in a fixed order, so concurrent batches do not deadlock
+        q = q.order_by("id").select_for_update()
+        checks = list(q.only(*fields))
+        if not checks:
+            return [], list(received)
+
+        n_pings, last_ping, new_pings = [], [], []
+        for check in checks:
+            check_pings = sorted(received[str(check.code)], key=lambda p: p[0])
+            for ts, attrs in check_pings:
+                check.n_pings += 1
+                if check.n_pings % sample == 0:
+                    new_pings.append(_make_ping(check, check.n_pings,
+                                                created=ts, **attrs))
+
+            latest = check_pings[-1][0]
+            if check.last_ping is None or check.last_ping < latest:
+                check.last_ping = latest
+
+            if check.status in ("new", "paused"):
+                check.status = "up"
+
+            n_pings.append(When(id=check.id, then=Value(check.n_pings)))
+            last_ping.append(When(id=check.id, then=Value(check.last_ping)))
+
+        Check.objects.filter(id__in=[check.id for check in checks]).update(
+            n_pings=Case(*n_pings, output_field=IntegerField()),
+            last_ping=Case(*last_ping, output_field=DateTimeField()),
+            status=_status_after_ping())
+
+    if new_pings:
+        _save_pings(new_pings)
+
+    found = set(str(check.code) for check in checks)
+    unknown = [code for code in received if code not in found]
+    return checks, unknown
+
+
+def _parse_bulk_item(item):
+    """ Return (code, timestamp) or None if the item is not valid. """
+
+    if isinstance(item, string_types):
+        item = {"code": item}
+
+    if not isinstance(item, dict) or "code" not in item:
+        return None
+
+    try:
+        code = uuid.UUID(item["code"])
+    except (TypeError, ValueError, AttributeError):
+        return None
+
+    ts = item.get("timestamp")
+    if ts is None:
+        return code, None
+
+    if isinstance(ts, bool) or not isinstance(ts, (int, float)) or ts < 0:
+        return None
+
+    try:
+        return code, datetime.fromtimestamp(ts, utc)
+    except (OverflowError, OSError, ValueError):
+        # Out of the platform's range
+        return None
+
+
+def parse_bulk(body):
+    """ Parse the body of a bulk ping request into a list of
+    (code, timestamp) pairs for record_many().
+
+    Raise ValueError with a message for the client if it is not valid.
+
+    """
+
+    try:
+        doc = json.loads(body.decode("utf-8"))
+    except ValueError:
+        raise ValueError("could not parse request body")
+
+    if not isinstance(doc, dict) or not isinstance(doc.get("pings"), list):
+        raise ValueError("pings is not a list")
+
+    if len(doc["pings"]) > MAX_BULK_PINGS:
+        raise ValueError("too many pings")
+
+    items = []
+    for item in doc["pings"]:
+        parsed = _parse_bulk_item(item)
+        if parsed is None:
+            raise ValueError("invalid ping: %s" % json.dumps(item))
+        items.append(parsed)
+
+    return items
+
+
+def request_info(headers):
+    """ Return ping attributes from the WSGI environ or request.META
+    of an HTTP request, as keyword arguments for record() and
+    record_many(). """
+
+    remote_addr = headers.get("HTTP_X_FORWARDED_FOR", headers["REMOTE_ADDR"])
+
+    return {
+        "remote_addr": remote_addr.split(",")[0],
+        "scheme": headers.get("HTTP_X_FORWARDED_PROTO", "http"),
+        "method": headers["REQUEST_METHOD"],
+        "ua": headers.get("HTTP_USER_AGENT", "")
+    }
+
+
+def record_request(code, headers):
+    """ Record a ping from the WSGI environ or request.META of an HTTP
+    request. """
+
+    return record(code, **request_info(headers))
+
+
+class PingLogBuffer(object):
+    """ Write-behind buffer for Ping log entries.
+
+    append() puts pings in a bounded queue. A background thread takes them
+    off the queue and writes them with bulk_create when `batch_size` pings
+    have been collected or `flush_interval` seconds have passed since the
+    first one, whichever comes first. If the queue is full, append() blocks
+    until the writer catches up.
+
+    """
+
+    STOP = object()
+
+    def __init__(self, max_size=10000, batch_size=500, flush_interval=1.0):
+        self.queue = queue.Queue(max_size)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.thread = None
+
+    def append(self, ping):
+        self.queue.put(ping)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name="ping-log")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self, timeout=10):
+        """ Write out all queued pings and stop the background thread. """
+
+        if self.thread and self.thread.is_alive():
+            self.queue.put(self.STOP)
+            self.thread.join(timeout)
+
+        self.flush()
+
+    def collect(self):
+        """ Wait for a ping, then collect more until the batch is full
+        or the flush interval is over. """
+
+        batch = [self.queue.get()]
+        deadline = time.time() + self.flush_interval
+        while len(batch) < self.batch_size and batch[-1] is not self.STOP:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+
+        return batch
+
+    def write(self, batch):
+        try:
+            Ping.objects.bulk_create(batch)
+        except Exception:
+            logger.exception("Could not write %d pings" % len(batch))
+            # The connection may be broken, get a fresh one for next batch
+            connection.close()
+
+    def flush(self):
+        """ Write out all currently queued pings in the calling thread. """
+
+        batch = []
+        while True:
+            try:
+                ping = self.queue.get_nowait()
+            except queue.Empty:
+                break
+
+            if ping is not self.STOP:
+                batch.append(ping)
+
+        for i in range(0, len(batch), self.batch_size):
+            self.write(batch[i:i + self.batch_size])
+
+    def run(self):
+        while True:
+            batch = self.collect()
+            if batch[-1] is self.STOP:
+                self.write(batch[:-1])
+                return
+
+            self.write(batch)
+
+
+class PingCoalescer(object):
+    """ Merges pings for the same check into fewer database updates.
+
+    The first ping for a check is recorded right away and starts a
+    `window` seconds long coalescing window. Further pings for that check
+    within the window are only collected in memory. When the window is
+    over, they are recorded together with record_many(): one row update
+    that sets the latest last_ping and adds the number of pings to n_pings.
+
+    A background thread closes expired windows. Each web worker process
+    coalesces its own pings.
+
+    """
+
+    def __init__(self, window=1.0, sample=1):
+        self.window = window
+        self.sample = sample
+        self.lock = threading.Lock()
+        # code -> {"until": ..., "check": ..., "items": [...]}
+        self.hot = {}
+        self.thread = None
+
+    def record(self, code, **attrs):
+        key = str(code)
+        with self.lock:
+            entry = self.hot.get(key)
+            if entry and entry["until"] > time.time():
+                entry["items"].append((key, timezone.now(), attrs))
+                return entry["check"]
+
+            # The window is over but not flushed yet. Its pings came
+            # first, so record them before this one.
+            stale = self.hot.pop(key, None)
+
+        if stale:
+            self.record_items(stale["items"])
+
+        check = _record(code, **attrs)
+        if check is not None:
+            with self.lock:
+                entry = self.hot.get(key)
+                if entry is None or entry["until"] <= time.time():
+                    # Another thread may have opened a window meanwhile
+                    stale = self.hot.pop(key, None)
+                    self.hot[key] = {"until": time.time() + self.window,
+                                     "check": check, "items": []}
+
+            if stale:
+                self.record_items(stale["items"])
+
+        return check
+
+    def record_items(self, items):
+        if not items:
+            return
+
+        try:
+            record_many(items, sample=self.sample)
+        except Exception:
+            logger.exception("Could not record %d pings" % len(items))
+            # The connection may be broken, get a fresh one
+            connection.close()
+
+    def flush(self, everything=False):
+        """ Record the collected pings of expired windows (or of all
+        windows if `everything` is set) in one batch. """
+
+        now = time.time()
+        items = []
+        with self.lock:
+            for key, entry in list(self.hot.items()):
+                if everything or entry["until"] <= now:
+                    items.extend(self.hot.pop(key)["items"])
+
+        self.record_items(items)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name="ping-coalescer")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.flush(everything=True)
+
+    def run(self):
+        while True:
+            time.sleep(self.window)
+            self.flush()
+
+
+_buffer = None
+_coalescer = None
+_lock = threading.Lock()
+
+
+def get_buffer():
+    """ Return the process-wide PingLogBuffer, starting it on first use.
+
+    The buffer is created lazily so that each forked web worker gets
+    its own writer thread. Queued pings are written out on shutdown.
+
+    """
+
+    global _buffer
+    with _lock:
+        if _buffer is None:
+            _buffer = PingLogBuffer(settings.PING_LOG_BUFFER_SIZE,
+                                    settings.PING_LOG_BATCH_SIZE,
+                                    settings.PING_LOG_FLUSH_INTERVAL)
+            _buffer.start()
+
+    return _buffer
+
+
+def get_coalescer():
+    """ Return the process-wide PingCoalescer, starting it on first use. """
+
+    global _coalescer
+    with _lock:
+        if _coalescer is None:
+            _coalescer = PingCoalescer(settings.PING_COALESCE_WINDOW,
+                                       settings.PING_COALESCE_SAMPLE)
+            _coalescer.start()
+
+    return _coalescer
+
+
+def _shutdown():
+    # Coalesced pings may go through the buffer, so stop the coalescer first
+    if _coalescer is not None:
+        _coalescer.stop()
+    if _buffer is not None:
+        _buffer.stop()
+
+
+atexit.register(_shutdown)
@@ -0,0 +1,82 @@
+""" Check statuses for pages and emails that list many checks.
+
+Check.get_status() and Check.in_grace_period() each look up the current
+time and redo the timedelta arithmetic, and templates used to call them
+several times per check. CheckRow.evaluate() works out everything the
+templates need for a whole list of checks in one pass. status_etag()
+tells, without loading the checks, whether any of that has changed.
+
+"""
+
+import hashlib
+
+from django.db.models import (Case, Count, DateTimeField, ExpressionWrapper,
+                              F, IntegerField, Max, Sum, Value, When)
+from django.utils import timezone
+
+
+class CheckRow(object):
+    """ A check with its status, grace flag and next due time worked out
+    once, for templates that show many checks. """
+
+    __slots__ = ("check", "status", "in_grace", "next_due")
+
+    def __init__(self, check, now):
+        self.check = check
+        self.status = check.status
+        self.in_grace = False
+        self.next_due = None
+
+        if check.status in ("new", "paused") or check.last_ping is None:
+            return
+
+        self.next_due = check.last_ping + check.timeout
+        grace_ends = self.next_due + check.grace
+        self.status = "up" if grace_ends > now else "down"
+        self.in_grace = self.next_due < now < grace_ends
+
+    @classmethod
+    def evaluate(cls, checks, now=None):
+        """ Return a row for each check, all against the same "now". """
+
+        if now is None:
+            now = timezone.now()
+
+        return [cls(check, now) for check in checks]
+
+
+def _count(**conditions):
+    return Sum(Case(When(then=Value(1), **conditions), default=Value(0),
+                    output_field=IntegerField()))
+
+
+def status_etag(checks, now=None):
+    """ Return a digest of what CheckRow would show for the checks in a
+    queryset, from one aggregate query.
+
+    Pings change the ping count, and sendalerts and pausing change the
+    counts by status. Checks going late and then down just because time
+    passes change the numbers of checks past their period and past their
+    grace time. The digest does not cover names, tags and periods.
+
+    """
+
+    if now is None:
+        now = timezone.now()
+
+    running = ("up", "down")
+    now = Value(now, output_field=DateTimeField())
+    due = ExpressionWrapper(now - F("timeout"), output_field=DateTimeField())
+    overdue = ExpressionWrapper(now - F("timeout") - F("grace"),
+                                output_field=DateTimeField())
+
+    stats = checks.aggregate(
+        n=Count("id"), max_id=Max("id"), sum_pings=Sum("n_pings"),
+        max_ping=Max("last_ping"),
+        n_new=_count(status="new"), n_paused=_count(status="paused"),
+        n_down=_count(status="down"),
+        n_due=_count(status__in=running, last_ping__lte=due),
+        n_overdue=_count(status__in=running, last_ping__lte=overdue))
+
+    values = ["%s=%s" % item for item in sorted(stats.items())]
+    return hashlib.md5(" ".join(values).encode("utf-8")).hexdigest()
@@ -1,6 +1,7 @@
 from hc.api.models import Channel, Check
 from hc.test import BaseTestCase
 from django.contrib.auth.models import User
+from django.utils import timezone
 
 
 class ApiAdminTestCase(BaseTestCase):
@@ -22,3 +23,18 @@ class ApiAdminTestCase(BaseTestCase):
 
         ### Assert for the push bullet
         self.assertEqual(ch.kind, "pushbullet")
+
+    def test_it_resets_circuit_breaker(self):
+        self.client.login(username="alice@example.org", password="password")
+
+        ch = Channel.objects.create(user=self.alice, kind="webhook",
+                                    value="http://example.org", n_failures=5,
+                                    breaker_until=timezone.now())
+
+        data = {"action": "reset_breaker", "_selected_action": [ch.id]}
+        r = self.client.post("/admin/api/channel/", data)
+        self.assertEqual(r.status_code, 302)
+
+        ch.refresh_from_db()
+        self.assertEqual(ch.n_failures, 0)
+        self.assertIsNone(ch.breaker_until)
@@ -1,6 +1,10 @@
+from datetime import timedelta
+
 from django.conf import settings
 from django.core.signing import base64_hmac
+from django.utils import timezone
 
+from hc.api import views
 from hc.api.models import Check
 from hc.test import BaseTestCase
 
@@ -10,6 +14,11 @@ class BadgeTestCase(BaseTestCase):
     def setUp(self):
         super(BadgeTestCase, self).setUp()
         self.check = Check.objects.create(user=self.alice, tags="foo bar")
+        views._badges.clear()
+
+        sig = base64_hmac(str(self.alice.username), "foo", settings.SECRET_KEY)
+        sig = sig[:8].decode("utf-8")
+        self.url = "/badge/%s/%s/foo.svg" % (self.alice.username, sig)
 
     def test_it_rejects_bad_signature(self):
         r = self.client.get("/badge/%s/12345678/foo.svg" % self.alice.username)
@@ -26,3 +35,58 @@ class BadgeTestCase(BaseTestCase):
 
         ### Assert that the svg is returned
         self.assertEqual(r['Content-Type'], 'image/svg+xml')
+
+    def test_it_matches_whole_tags(self):
+        self.check.last_ping = timezone.now() - timedelta(days=3)
+        self.check.status = "up"
+        self.check.save()
+
+        # "fo" is a substring of "foo", but not one of the check's tags
+        sig = base64_hmac(str(self.alice.username), "fo", settings.SECRET_KEY)
+        sig = sig[:8].decode("utf-8")
+        url = "/badge/%s/%s/fo.svg" % (self.alice.username, sig)
+
+        r = self.client.get(url)
+        self.assertContains(r, "#4c1")
+
+    def test_it_caches_badge(self):
+        r = self.client.get(self.url)
+        self.assertTrue(r["Cache-Control"].startswith("max-age="))
+
+        with self.assertNumQueries(0):
+            r = self.client.get(self.url)
+            self.assertContains(r, "#4c1")
+
+    def test_it_has_no_last_modified(self):
+        self.check.last_ping = timezone.now()
+        self.check.status = "up"
+        self.check.save()
+
+        # Going late would not change it, so clients must use the ETag
+        r = self.client.get(self.url)
+        self.assertFalse(r.has_header("Last-Modified"))
+
+    def test_it_handles_if_none_match(self):
+        etag = self.client.get(self.url)["ETag"]
+
+        r = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(r.status_code, 304)
+
+    def test_it_expires_when_check_goes_late(self):
+        self.check.last_ping = timezone.now() - timedelta(hours=23)
+        self.check.status = "up"
+        self.check.save()
+
+        r = self.client.get(self.url)
+        max_age = int(r["Cache-Control"].split("=")[1])
+        # Capped at BADGE_MAX_AGE
+        self.assertTrue(0 < max_age <= settings.BADGE_MAX_AGE)
+
+        views._badges.clear()
+        self.check.last_ping = timezone.now() - timedelta(days=1, seconds=-5)
+        self.check.save()
+
+        r = self.client.get(self.url)
+        max_age = int(r["Cache-Control"].split("=")[1])
+        # The check is due in 5 seconds
+        self.assertTrue(max_age <= 5)
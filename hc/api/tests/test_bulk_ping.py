@@ -0,0 +1,112 @@
+import json
+import time
+from datetime import timedelta as td
+
+from django.test import TestCase
+from django.utils import timezone
+
+from hc.api.models import Check, Ping
+
+
+class BulkPingTestCase(TestCase):
+
+    def setUp(self):
+        super(BulkPingTestCase, self).setUp()
+        self.check = Check.objects.create()
+        self.paused = Check.objects.create(status="paused", n_pings=10)
+
+    def post(self, doc):
+        return self.client.post("/ping/", json.dumps(doc),
+                                content_type="application/json")
+
+    def test_it_works(self):
+        doc = {"pings": [str(self.check.code), str(self.paused.code),
+                         {"code": str(self.check.code)}]}
+
+        r = self.post(doc)
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(r.json(), {"received": 3, "unknown": []})
+
+        self.check.refresh_from_db()
+        self.assertEqual(self.check.status, "up")
+        self.assertEqual(self.check.n_pings, 2)
+        self.assertIsNotNone(self.check.last_ping)
+
+        self.paused.refresh_from_db()
+        self.assertEqual(self.paused.status, "up")
+        self.assertEqual(self.paused.n_pings, 11)
+
+        ns = Ping.objects.filter(owner=self.check).values_list("n", flat=True)
+        self.assertEqual(sorted(ns), [1, 2])
+        self.assertEqual(Ping.objects.get(owner=self.paused).n, 11)
+
+    def test_it_uses_timestamps(self):
+        earlier = int(time.time()) - 600
+        later = earlier + 300
+        doc = {"pings": [{"code": str(self.check.code), "timestamp": later},
+                         {"code": str(self.check.code), "timestamp": earlier}]}
+
+        self.post(doc)
+
+        self.check.refresh_from_db()
+        self.assertEqual(self.check.last_ping.timestamp(), later)
+
+        pings = Ping.objects.order_by("n")
+        self.assertEqual([p.created.timestamp() for p in pings],
+                         [earlier, later])
+
+    def test_it_does_not_move_last_ping_back(self):
+        now = timezone.now()
+        self.check.last_ping = now
+        self.check.save()
+
+        ts = int(time.time()) - 3600
+        self.post({"pings": [{"code": str(self.check.code), "timestamp": ts}]})
+
+        self.check.refresh_from_db()
+        self.assertEqual(self.check.last_ping, now)
+        self.assertEqual(self.check.n_pings, 1)
+
+    def test_it_clamps_future_timestamps(self):
+        ts = int(time.time()) + 3600
+        self.post({"pings": [{"code": str(self.check.code), "timestamp": ts}]})
+
+        self.check.refresh_from_db()
+        self.assertTrue(self.check.last_ping < timezone.now() + td(seconds=1))
+
+    def test_it_reports_unknown_codes(self):
+        unknown = "07c2f548-9850-4b27-af5d-6c9dc157ec02"
+        r = self.post({"pings": [str(self.check.code), unknown]})
+
+        self.assertEqual(r.json()["unknown"], [unknown])
+        self.assertEqual(Ping.objects.count(), 1)
+
+    def test_it_rejects_bad_codes(self):
+        r = self.post({"pings": [str(self.check.code), "not-uuid"]})
+        self.assertEqual(r.status_code, 400)
+        self.assertEqual(Ping.objects.count(), 0)
+
+    def test_it_rejects_bad_timestamps(self):
+        item = {"code": str(self.check.code), "timestamp": "yesterday"}
+        r = self.post({"pings": [item]})
+        self.assertEqual(r.status_code, 400)
+
+        item = {"code": str(self.check.code), "timestamp": 1e20}
+        r = self.post({"pings": [item]})
+        self.assertEqual(r.status_code, 400)
+
+    def test_it_rejects_non_list(self):
+        r = self.post({"pings": str(self.check.code)})
+        self.assertEqual(r.status_code, 400)
+
+    def test_it_rejects_too_many_pings(self):
+        r = self.post({"pings": [str(self.check.code)] * 101})
+        self.assertEqual(r.status_code, 400)
+
+    def test_it_handles_bad_json(self):
+        r = self.client.post("/ping/", "{", content_type="application/json")
+        self.assertEqual(r.status_code, 400)
+
+    def test_it_rejects_get(self):
+        r = self.client.get("/ping/")
+        self.assertEqual(r.status_code, 405)
@@ -1,8 +1,11 @@
 from datetime import timedelta
 
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
-from hc.api.models import Check
+from django.contrib.auth.models import User
+from hc.api.models import Check, CheckTag, Tag
 
 
 class CheckModelTestCase(TestCase):
@@ -43,3 +46,42 @@ class CheckModelTestCase(TestCase):
         check = Check()
 
         self.assertFalse(check.in_grace_period())
+
+    def test_save_syncs_tags(self):
+        alice = User.objects.create(username="alice")
+        check = Check.objects.create(user=alice, tags="foo bar")
+
+        def names():
+            q = CheckTag.objects.filter(owner=check)
+            return set(q.values_list("tag__name", flat=True))
+
+        self.assertEqual(names(), set(["foo", "bar"]))
+
+        check = Check.objects.get(id=check.id)
+        check.tags = "bar baz"
+        check.save()
+        self.assertEqual(names(), set(["bar", "baz"]))
+
+        # Tags are shared between the user's checks
+        Check.objects.create(user=alice, tags="baz")
+        self.assertEqual(Tag.objects.filter(name="baz").count(), 1)
+
+    def test_save_skips_long_tags(self):
+        alice = User.objects.create(username="alice")
+        Check.objects.create(user=alice, tags="foo " + "x" * 192)
+
+        names = Tag.objects.values_list("name", flat=True)
+        self.assertEqual(list(names), ["foo"])
+
+    def test_save_skips_unchanged_tags(self):
+        alice = User.objects.create(username="alice")
+        check = Check.objects.create(user=alice, tags="foo")
+        check = Check.objects.get(id=check.id)
+
+        check.name = "Foo"
+        with CaptureQueriesContext(connection) as ctx:
+            check.save()
+
+        sql = " ".join(query["sql"] for query in ctx.captured_queries)
+        self.assertNotIn("api_tag", sql)
+        self.assertNotIn("api_checktag", sql)
@@ -0,0 +1,83 @@
+from datetime import timedelta
+
+from django.core.management import call_command
+from django.utils import timezone
+from hc.api.management.commands.checktags import Command
+from hc.api.models import Check, CheckTag, Tag
+from hc.test import BaseTestCase
+from mock import patch
+from six import StringIO
+
+
+class CheckTagsTestCase(BaseTestCase):
+
+    def setUp(self):
+        super(CheckTagsTestCase, self).setUp()
+        self.now = timezone.now()
+        self.check = Check.objects.create(user=self.alice, tags="foo",
+                                          status="up", last_ping=self.now)
+
+    def run_command(self, **options):
+        out = StringIO()
+        call_command("checktags", stdout=out, **options)
+        return out.getvalue()
+
+    def test_it_leaves_good_tags_alone(self):
+        result = self.run_command()
+        self.assertIn("Fixed 0 checks and 0 tags", result)
+
+    def test_it_fixes_drifted_tags(self):
+        late_after = self.now + timedelta(days=2)
+        Tag.objects.filter(name="foo").update(n_checks=5, n_down=1,
+                                              late_after=late_after)
+
+        result = self.run_command(dry_run=True)
+        self.assertIn("Found 0 checks and 1 tags", result)
+
+        result = self.run_command()
+        self.assertIn("Fixed 0 checks and 1 tags", result)
+
+        tag = Tag.objects.get(name="foo")
+        self.assertEqual((tag.n_checks, tag.n_down), (1, 0))
+        self.assertEqual(tag.late_after, self.now + self.check.timeout)
+
+    def test_it_fixes_check_tag_rows(self):
+        # Bypasses Check.save()
+        Check.objects.filter(id=self.check.id).update(tags="bar")
+
+        result = self.run_command()
+        self.assertIn("Fixed 1 checks and 0 tags", result)
+
+        q = CheckTag.objects.filter(owner=self.check)
+        self.assertEqual(list(q.values_list("tag__name", flat=True)), ["bar"])
+        self.assertEqual(Tag.objects.get(name="foo").n_checks, 0)
+        self.assertEqual(Tag.objects.get(name="bar").n_checks, 1)
+
+    def test_dry_run_reports_what_it_would_fix(self):
+        Check.objects.filter(id=self.check.id).update(tags="bar")
+
+        result = self.run_command(dry_run=True)
+        # The check, and the counts of both "foo" and "bar"
+        self.assertIn("Found 1 checks and 1 tags", result)
+        self.assertEqual(Tag.objects.get(name="foo").n_checks, 1)
+
+    def test_it_skips_tags_that_change_meanwhile(self):
+        Tag.objects.filter(name="foo").update(n_checks=5)
+        checks = Command.checks
+        calls = []
+
+        def scan(command):
+            # A check goes down while the command works out the counts,
+            # in its second scan of the checks
+            calls.append(command)
+            if len(calls) == 2:
+                Tag.objects.filter(name="foo").update(n_down=1)
+
+            return checks(command)
+
+        with patch.object(Command, "checks", scan):
+            result = self.run_command()
+
+        self.assertIn("Fixed 0 checks and 0 tags", result)
+        self.assertIn("skipped 1 tags", result)
+        self.assertEqual(Tag.objects.get(name="foo").n_checks, 5)
@@ -86,6 +86,11 @@ class CreateCheckTestCase(BaseTestCase):
         self.post({"api_key": "abc", "name": False},
                   expected_error="name is not a string")
 
+    def test_it_rejects_long_tags(self):
+        self.post({"api_key": "abc", "tags": "foo " + "x" * 192},
+                  expected_error="tags are too long")
+        self.assertEqual(Check.objects.count(), 0)
+
     ### Test for the assignment of channels
     def test_assignment_of_channels(self):
         check = Check()
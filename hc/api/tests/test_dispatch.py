@@ -0,0 +1,131 @@
+import threading
+import time
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.test import TransactionTestCase, override_settings
+from django.utils import timezone
+from hc.api.dispatch import Dispatcher
+from hc.api.management.commands.sendalerts import Command
+from hc.api.models import Channel, Check, Notification
+from mock import patch
+
+
+class DispatcherTestCase(TransactionTestCase):
+    """ Notifications are recorded from worker threads, so each test has
+    to commit its data for the threads to see it. """
+
+    def setUp(self):
+        super(DispatcherTestCase, self).setUp()
+        self.alice = User.objects.create(username="alice")
+        self.dispatcher = Dispatcher(concurrency=10, per_host=2)
+
+    def tearDown(self):
+        self.dispatcher.close()
+        super(DispatcherTestCase, self).tearDown()
+
+    def _setup_webhooks(self, urls, status="down"):
+        self.check = Check(user=self.alice, status=status)
+        self.check.save()
+
+        for url in urls:
+            channel = Channel(user=self.alice, kind="webhook", value=url)
+            channel.save()
+            channel.checks.add(self.check)
+
+    @patch("hc.api.transports.session.request")
+    def test_it_records_notifications(self, mock_request):
+        mock_request.return_value.status_code = 200
+        self._setup_webhooks(["http://a.example.org", "http://b.example.org"])
+
+        errors = self.dispatcher.dispatch([self.check])
+        self.assertEqual(errors, [])
+        self.assertEqual(mock_request.call_count, 2)
+        self.assertEqual(Notification.objects.count(), 2)
+
+    @patch("hc.api.transports.session.request")
+    def test_it_returns_errors(self, mock_request):
+        mock_request.return_value.status_code = 500
+        self._setup_webhooks(["http://example.org"])
+
+        errors = self.dispatcher.dispatch([self.check])
+        self.assertEqual(len(errors), 1)
+
+        check, channel, error = errors[0]
+        self.assertEqual(check, self.check)
+        self.assertEqual(error, "Received status code 500")
+
+        n = Notification.objects.get()
+        self.assertEqual(n.error, "Received status code 500")
+
+    @patch("hc.api.dispatch.Dispatcher.notify")
+    def test_it_limits_requests_per_host(self, mock_notify):
+        lock = threading.Lock()
+        active, peak = {}, {}
+
+        def notify(channel, check):
+            host = channel.transport.destination
+            with lock:
+                active[host] = active.get(host, 0) + 1
+                peak[host] = max(peak.get(host, 0), active[host])
+            time.sleep(0.02)
+            with lock:
+                active[host] -= 1
+            return ""
+
+        mock_notify.side_effect = notify
+        urls = ["http://slow.example.org/%d" % i for i in range(0, 6)]
+        urls.append("http://other.example.org")
+        self._setup_webhooks(urls)
+
+        self.assertEqual(self.dispatcher.dispatch([self.check]), [])
+        self.assertEqual(mock_notify.call_count, 7)
+        self.assertEqual(peak["slow.example.org"], 2)
+        self.assertEqual(peak["other.example.org"], 1)
+
+    def test_it_rejects_unexpected_status(self):
+        self._setup_webhooks(["http://example.org"], status="new")
+        with self.assertRaises(NotImplementedError):
+            self.dispatcher.dispatch([self.check])
+
+    @patch("hc.api.transports.session.request")
+    def test_sendalerts_uses_it(self, mock_request):
+        mock_request.return_value.status_code = 200
+        self._setup_webhooks(["http://example.org"], status="up")
+        self.check.last_ping = timezone.now() - timedelta(days=2)
+        self.check.alert_after = timezone.now() - timedelta(days=1)
+        self.check.save()
+
+        command = Command()
+        command.dispatcher = self.dispatcher
+        self.assertTrue(command.handle_many())
+
+        self.check.refresh_from_db()
+        self.assertEqual(self.check.status, "down")
+        self.assertEqual(Notification.objects.get().check_status, "down")
+
+    @override_settings(DIGEST_THRESHOLD=2)
+    @patch("hc.api.transports.session.request")
+    def test_sendalerts_sends_digests_through_it(self, mock_request):
+        mock_request.return_value.status_code = 200
+        channel = Channel(user=self.alice, kind="slack",
+                          value="http://example.org")
+        channel.save()
+
+        for i in range(0, 3):
+            check = Check(user=self.alice, status="up", name="Check %d" % i)
+            check.last_ping = timezone.now() - timedelta(days=2)
+            check.alert_after = timezone.now() - timedelta(days=1)
+            check.save()
+            channel.checks.add(check)
+
+        command = Command()
+        command.dispatcher = self.dispatcher
+        with patch.object(self.dispatcher, "dispatch_digests",
+                          wraps=self.dispatcher.dispatch_digests) as spy:
+            self.assertTrue(command.handle_many())
+            self.assertTrue(spy.called)
+
+        # One request for all three checks
+        self.assertEqual(mock_request.call_count, 1)
+        self.assertEqual(Notification.objects.count(), 3)
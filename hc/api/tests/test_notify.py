@@ -1,7 +1,9 @@
 import json
+from datetime import timedelta
 
 from django.core import mail
 from django.test import override_settings
+from django.utils import timezone
 from hc.api.models import Channel, Check, Notification
 from hc.test import BaseTestCase
 from mock import patch
@@ -23,7 +25,7 @@ class NotifyTestCase(BaseTestCase):
         self.channel.save()
         self.channel.checks.add(self.check)
 
-    @patch("hc.api.transports.requests.request")
+    @patch("hc.api.transports.session.request")
     def test_webhook(self, mock_get):
         self._setup_data("webhook", "http://example")
         mock_get.return_value.status_code = 200
@@ -31,9 +33,9 @@ class NotifyTestCase(BaseTestCase):
         self.channel.notify(self.check)
         mock_get.assert_called_with(
             "get", u"http://example",
-            headers={"User-Agent": "healthchecks.io"}, timeout=5)
+            headers={"User-Agent": "healthchecks.io"}, timeout=(5, 5))
 
-    @patch("hc.api.transports.requests.request", side_effect=Timeout)
+    @patch("hc.api.transports.session.request", side_effect=Timeout)
     def test_webhooks_handle_timeouts(self, mock_get):
         self._setup_data("webhook", "http://example")
         self.channel.notify(self.check)
@@ -41,7 +43,7 @@ class NotifyTestCase(BaseTestCase):
         n = Notification.objects.get()
         self.assertEqual(n.error, "Connection timed out")
 
-    @patch("hc.api.transports.requests.request")
+    @patch("hc.api.transports.session.request")
     def test_webhooks_ignore_up_events(self, mock_get):
         self._setup_data("webhook", "http://example", status="up")
         self.channel.notify(self.check)
@@ -49,7 +51,7 @@ class NotifyTestCase(BaseTestCase):
         self.assertFalse(mock_get.called)
         self.assertEqual(Notification.objects.count(), 0)
 
-    @patch("hc.api.transports.requests.request")
+    @patch("hc.api.transports.session.request")
     def test_webhooks_support_variables(self, mock_get):
         template = "http://host/$CODE/$STATUS/$TAG1/$TAG2/?name=$NAME"
         self._setup_data("webhook", template)
@@ -63,9 +65,9 @@ class NotifyTestCase(BaseTestCase):
             % self.check.code
 
         mock_get.assert_called_with(
-            "get", url, headers={"User-Agent": "healthchecks.io"}, timeout=5)
+            "get", url, headers={"User-Agent": "healthchecks.io"}, timeout=(5, 5))
 
-    @patch("hc.api.transports.requests.request")
+    @patch("hc.api.transports.session.request")
     def test_webhooks_dollarsign_escaping(self, mock_get):
         # If name or tag contains what looks like a variable reference,
         # that should be left alone:
@@ -80,9 +82,9 @@ class NotifyTestCase(BaseTestCase):
 
         url = u"http://host/%24TAG1"
         mock_get.assert_called_with(
-            "get", url, headers={"User-Agent": "healthchecks.io"}, timeout=5)
+            "get", url, headers={"User-Agent": "healthchecks.io"}, timeout=(5, 5))
 
-    @patch("hc.api.transports.requests.request")
+    @patch("hc.api.transports.session.request")
     def test_webhook_fires_on_up_event(self, mock_get):
         self._setup_data("webhook", "http://foo\nhttp://bar", status="up")
 
@@ -90,7 +92,7 @@ class NotifyTestCase(BaseTestCase):
 
         mock_get.assert_called_with(
             "get", "http://bar", headers={"User-Agent": "healthchecks.io"},
-            timeout=5)
+            timeout=(5, 5))
 
     def test_email(self):
         self._setup_data("email", "alice@example.org")
@@ -128,7 +130,7 @@ class NotifyTestCase(BaseTestCase):
         html, _ = message.alternatives[0]
         self.assertTrue("/pricing/" in html)
 
-    @patch("hc.api.transports.requests.request")
+    @patch("hc.api.transports.session.request")
     def test_pd(self, mock_post):
         self._setup_data("pd", "123")
         mock_post.return_value.status_code = 200
@@ -140,7 +142,7 @@ class NotifyTestCase(BaseTestCase):
         json = kwargs["json"]
         self.assertEqual(json["event_type"], "trigger")
 
-    @patch("hc.api.transports.requests.request")
+    @patch("hc.api.transports.session.request")
     def test_slack(self, mock_post):
         self._setup_data("slack", "123")
         mock_post.return_value.status_code = 200
@@ -154,7 +156,7 @@ class NotifyTestCase(BaseTestCase):
         fields = {f["title"]: f["value"] for f in attachment["fields"]}
         self.assertEqual(fields["Last Ping"], "Never")
 
-    @patch("hc.api.transports.requests.request")
+    @patch("hc.api.transports.session.request")
     def test_slack_with_complex_value(self, mock_post):
         v = json.dumps({"incoming_webhook": {"url": "123"}})
         self._setup_data("slack", v)
@@ -166,7 +168,7 @@ class NotifyTestCase(BaseTestCase):
         args, kwargs = mock_post.call_args
         self.assertEqual(args[1], "123")
 
-    @patch("hc.api.transports.requests.request")
+    @patch("hc.api.transports.session.request")
     def test_slack_handles_500(self, mock_post):
         self._setup_data("slack", "123")
         mock_post.return_value.status_code = 500
@@ -176,7 +178,7 @@ class NotifyTestCase(BaseTestCase):
         n = Notification.objects.get()
         self.assertEqual(n.error, "Received status code 500")
 
-    @patch("hc.api.transports.requests.request", side_effect=Timeout)
+    @patch("hc.api.transports.session.request", side_effect=Timeout)
     def test_slack_handles_timeout(self, mock_post):
         self._setup_data("slack", "123")
 
@@ -185,7 +187,7 @@ class NotifyTestCase(BaseTestCase):
         n = Notification.objects.get()
         self.assertEqual(n.error, "Connection timed out")
 
-    @patch("hc.api.transports.requests.request")
+    @patch("hc.api.transports.session.request")
     def test_hipchat(self, mock_post):
         self._setup_data("hipchat", "123")
         mock_post.return_value.status_code = 204
@@ -198,7 +200,7 @@ class NotifyTestCase(BaseTestCase):
         json = kwargs["json"]
         self.assertIn("DOWN", json["message"])
 
-    @patch("hc.api.transports.requests.request")
+    @patch("hc.api.transports.session.request")
     def test_pushover(self, mock_post):
         self._setup_data("po", "123|0")
         mock_post.return_value.status_code = 200
@@ -210,7 +212,7 @@ class NotifyTestCase(BaseTestCase):
         json = kwargs["data"]
         self.assertIn("DOWN", json["title"])
 
-    @patch("hc.api.transports.requests.request")
+    @patch("hc.api.transports.session.request")
     def test_victorops(self, mock_post):
         self._setup_data("victorops", "123")
         mock_post.return_value.status_code = 200
@@ -223,7 +225,7 @@ class NotifyTestCase(BaseTestCase):
         self.assertEqual(json["message_type"], "CRITICAL")
 
     ### Test that the web hooks handle connection errors and error 500s
-    @patch("hc.api.transports.requests.request", side_effect=ConnectionError)
+    @patch("hc.api.transports.session.request", side_effect=ConnectionError)
     def test_webhooks_handle_connections_errors(self, mock_post):
         self._setup_data("webhook", "http://example")
         self.channel.notify(self.check)
@@ -231,3 +233,127 @@ class NotifyTestCase(BaseTestCase):
         n = Notification.objects.get()
 
         self.assertEqual(n.error, "Connection failed")
+
+    @override_settings(BREAKER_THRESHOLD=2, BREAKER_COOLDOWN=300)
+    @patch("hc.api.transports.session.request", side_effect=ConnectionError)
+    def test_breaker_opens_after_failures(self, mock_get):
+        self._setup_data("webhook", "http://example")
+        self.channel.notify(self.check)
+        self.channel.notify(self.check)
+        self.assertEqual(mock_get.call_count, 6)
+        self.assertEqual(self.channel.breaker_state(), "open")
+
+        # While open, notifications fail right away
+        self.channel.notify(self.check)
+        self.assertEqual(mock_get.call_count, 6)
+
+        n = Notification.objects.order_by("id").last()
+        self.assertEqual(n.error, "Skipped after 2 failed notifications")
+
+    @patch("hc.api.transports.session.request")
+    def test_breaker_probe_closes_it(self, mock_get):
+        mock_get.return_value.status_code = 200
+        self._setup_data("webhook", "http://example")
+        self.channel.n_failures = 5
+        self.channel.breaker_until = timezone.now() - timedelta(seconds=1)
+        self.channel.save()
+
+        self.assertEqual(self.channel.breaker_state(), "half-open")
+        self.channel.notify(self.check)
+        self.assertEqual(mock_get.call_count, 1)
+
+        self.channel.refresh_from_db()
+        self.assertEqual(self.channel.breaker_state(), "closed")
+        self.assertEqual(self.channel.n_failures, 0)
+
+    @patch("hc.api.transports.session.request", side_effect=ConnectionError)
+    def test_failed_probe_keeps_breaker_open(self, mock_get):
+        self._setup_data("webhook", "http://example")
+        self.channel.n_failures = 5
+        self.channel.breaker_until = timezone.now() - timedelta(seconds=1)
+        self.channel.save()
+
+        self.channel.notify(self.check)
+        # Only a single attempt while probing
+        self.assertEqual(mock_get.call_count, 1)
+
+        self.channel.refresh_from_db()
+        self.assertEqual(self.channel.breaker_state(), "open")
+        self.assertEqual(self.channel.n_failures, 6)
+
+    def _add_checks(self, n, status="down"):
+        checks = [self.check]
+        for i in range(1, n):
+            check = Check.objects.create(user=self.alice, status=status,
+                                         name="Check %d" % i)
+            self.channel.checks.add(check)
+            checks.append(check)
+
+        return checks
+
+    @override_settings(DIGEST_THRESHOLD=3)
+    def test_email_digest(self):
+        self._setup_data("email", "alice@example.org")
+        checks = self._add_checks(3)
+
+        results = self.channel.notify_many(checks)
+        self.assertEqual(results, [(check, "") for check in checks])
+        self.assertEqual(Notification.objects.count(), 3)
+
+        # A single email about all three checks
+        self.assertEqual(len(mail.outbox), 1)
+        message = mail.outbox[0]
+        self.assertEqual(message.subject, "3 checks have changed status")
+        self.assertIn("Check 2", message.body)
+
+    @override_settings(DIGEST_THRESHOLD=3)
+    def test_notify_many_below_threshold(self):
+        self._setup_data("email", "alice@example.org")
+        checks = self._add_checks(2)
+
+        self.channel.notify_many(checks)
+        self.assertEqual(Notification.objects.count(), 2)
+        self.assertEqual(len(mail.outbox), 2)
+
+    @override_settings(DIGEST_THRESHOLD=2)
+    @patch("hc.api.transports.session.request")
+    def test_slack_digest(self, mock_post):
+        self._setup_data("slack", "123")
+        mock_post.return_value.status_code = 200
+        checks = self._add_checks(2)
+
+        self.channel.notify_many(checks)
+        self.assertEqual(mock_post.call_count, 1)
+        self.assertEqual(Notification.objects.count(), 2)
+
+        args, kwargs = mock_post.call_args
+        attachment = kwargs["json"]["attachments"][0]
+        self.assertEqual(attachment["color"], "danger")
+        self.assertIn(u"Check 1\u201d is DOWN.", attachment["text"])
+
+    @override_settings(DIGEST_THRESHOLD=2)
+    @patch("hc.api.transports.session.request")
+    def test_pushover_digest(self, mock_post):
+        self._setup_data("po", "123|0")
+        mock_post.return_value.status_code = 500
+        checks = self._add_checks(25)
+
+        results = self.channel.notify_many(checks)
+        self.assertEqual(mock_post.call_count, 3)
+        for check, error in results:
+            self.assertEqual(error, "Received status code 500")
+
+        args, kwargs = mock_post.call_args
+        self.assertEqual(kwargs["data"]["title"],
+                         "25 checks have changed status")
+        self.assertIn("and 5 more", kwargs["data"]["message"])
+
+    @override_settings(DIGEST_THRESHOLD=2)
+    @patch("hc.api.transports.session.request")
+    def test_webhooks_dont_use_digests(self, mock_get):
+        self._setup_data("webhook", "http://example")
+        mock_get.return_value.status_code = 200
+        checks = self._add_checks(2)
+
+        self.channel.notify_many(checks)
+        self.assertEqual(mock_get.call_count, 2)
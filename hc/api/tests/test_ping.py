@@ -99,3 +99,18 @@ class PingTestCase(TestCase):
         r = self.client.get("/ping/%s/" \
             % self.check.code, enable_csrf_token=True)
         self.assertEqual(r.status_code, 200)
+
+    def test_it_increments_n_pings(self):
+        self.client.get("/ping/%s/" % self.check.code)
+        self.client.get("/ping/%s/" % self.check.code)
+
+        self.check.refresh_from_db()
+        self.assertEqual(self.check.n_pings, 2)
+
+        ping = Ping.objects.latest("id")
+        self.assertEqual(ping.n, 2)
+
+    def test_it_handles_missing_check(self):
+        r = self.client.get("/ping/07c2f548-9850-4b27-af5d-6c9dc157ec02/")
+        self.assertEqual(r.status_code, 400)
+        self.assertEqual(Ping.objects.count(), 0)
@@ -0,0 +1,183 @@
+from django.test import TestCase, override_settings
+from mock import patch
+
+from hc.api import pings
+from hc.api.models import Check, Ping
+
+
+class PingsTestCase(TestCase):
+
+    def setUp(self):
+        super(PingsTestCase, self).setUp()
+        self.check = Check.objects.create(status="paused", n_pings=5)
+
+    def test_touch_works(self):
+        check = pings.touch(self.check.code)
+
+        self.assertEqual(check.id, self.check.id)
+        self.assertEqual(check.n_pings, 6)
+        self.assertEqual(check.status, "up")
+        self.assertIsNotNone(check.last_ping)
+
+        self.check.refresh_from_db()
+        self.assertEqual(self.check.n_pings, 6)
+        self.assertEqual(self.check.last_ping, check.last_ping)
+
+    def test_touch_keeps_down_status(self):
+        self.check.status = "down"
+        self.check.save()
+
+        check = pings.touch(self.check.code)
+        self.assertEqual(check.status, "down")
+
+    def test_touch_handles_missing_check(self):
+        self.assertIsNone(pings.touch("07c2f548-9850-4b27-af5d-6c9dc157ec02"))
+
+    def test_record_works(self):
+        check = pings.record(self.check.code, remote_addr="1.2.3.4",
+                             scheme="https", method="POST", ua="x" * 300)
+
+        ping = Ping.objects.get()
+        self.assertEqual(ping.owner_id, check.id)
+        self.assertEqual(ping.n, 6)
+        self.assertEqual(ping.remote_addr, "1.2.3.4")
+        self.assertEqual(ping.scheme, "https")
+        self.assertEqual(ping.method, "POST")
+        self.assertEqual(len(ping.ua), 200)
+
+    @override_settings(PING_LOG_BUFFERED=True)
+    @patch("hc.api.pings.get_buffer")
+    def test_record_uses_buffer(self, mock_get_buffer):
+        pings.record(self.check.code)
+
+        self.assertEqual(Ping.objects.count(), 0)
+        ping, = mock_get_buffer.return_value.append.call_args[0]
+        self.assertEqual(ping.n, 6)
+
+
+class PingLogBufferTestCase(TestCase):
+
+    def setUp(self):
+        super(PingLogBufferTestCase, self).setUp()
+        self.check = Check.objects.create()
+        self.buffer = pings.PingLogBuffer(batch_size=2, flush_interval=60)
+
+    def test_flush_works(self):
+        for n in range(1, 6):
+            self.buffer.append(Ping(owner=self.check, n=n))
+
+        self.assertEqual(Ping.objects.count(), 0)
+        self.buffer.flush()
+
+        ns = Ping.objects.values_list("n", flat=True).order_by("n")
+        self.assertEqual(list(ns), [1, 2, 3, 4, 5])
+
+    def test_collect_respects_batch_size(self):
+        for n in range(1, 4):
+            self.buffer.append(Ping(owner=self.check, n=n))
+
+        batch = self.buffer.collect()
+        self.assertEqual([ping.n for ping in batch], [1, 2])
+
+    def test_run_writes_remaining_pings_on_stop(self):
+        self.buffer.append(Ping(owner=self.check, n=1))
+        self.buffer.append(Ping(owner=self.check, n=2))
+        self.buffer.append(Ping(owner=self.check, n=3))
+        self.buffer.append(self.buffer.STOP)
+
+        # Runs in this thread and returns once it sees STOP
+        self.buffer.run()
+        self.assertEqual(Ping.objects.count(), 3)
+
+    def test_it_keeps_receive_time(self):
+        ping = Ping(owner=self.check)
+        created = ping.created
+
+        self.buffer.append(ping)
+        self.buffer.flush()
+
+        self.assertEqual(Ping.objects.get().created, created)
+
+
+class PingCoalescerTestCase(TestCase):
+
+    def setUp(self):
+        super(PingCoalescerTestCase, self).setUp()
+        self.check = Check.objects.create()
+        self.coalescer = pings.PingCoalescer(window=60)
+
+    def test_it_merges_pings(self):
+        for i in range(0, 3):
+            check = self.coalescer.record(self.check.code, ua="probe")
+            self.assertEqual(check.id, self.check.id)
+
+        # Only the first ping has been written so far
+        self.check.refresh_from_db()
+        self.assertEqual(self.check.n_pings, 1)
+        self.assertEqual(self.check.status, "up")
+        self.assertEqual(Ping.objects.count(), 1)
+
+        self.coalescer.flush(everything=True)
+
+        self.check.refresh_from_db()
+        self.assertEqual(self.check.n_pings, 3)
+        ns = Ping.objects.values_list("n", flat=True).order_by("n")
+        self.assertEqual(list(ns), [1, 2, 3])
+        self.assertEqual(Ping.objects.latest("n").ua, "probe")
+
+    def test_flush_keeps_open_windows(self):
+        self.coalescer.record(self.check.code)
+        self.coalescer.record(self.check.code)
+
+        self.coalescer.flush()
+
+        self.check.refresh_from_db()
+        self.assertEqual(self.check.n_pings, 1)
+
+    def test_it_starts_new_window_after_expiry(self):
+        self.coalescer.window = 0
+        self.coalescer.record(self.check.code)
+        self.coalescer.record(self.check.code)
+
+        self.check.refresh_from_db()
+        self.assertEqual(self.check.n_pings, 2)
+
+    def test_it_records_expired_window_first(self):
+        self.coalescer.record(self.check.code, ua="first")
+        self.coalescer.record(self.check.code, ua="second")
+
+        # The window is over, but has not been flushed yet
+        key = str(self.check.code)
+        self.coalescer.hot[key]["until"] = 0
+        self.coalescer.record(self.check.code, ua="third")
+
+        self.check.refresh_from_db()
+        self.assertEqual(self.check.n_pings, 3)
+        uas = Ping.objects.order_by("n").values_list("ua", flat=True)
+        self.assertEqual(list(uas), ["first", "second", "third"])
+        self.assertEqual(self.coalescer.hot[key]["items"], [])
+
+    def test_it_samples_ping_log(self):
+        self.coalescer.sample = 2
+        for i in range(0, 5):
+            self.coalescer.record(self.check.code)
+        self.coalescer.flush(everything=True)
+
+        self.check.refresh_from_db()
+        self.assertEqual(self.check.n_pings, 5)
+        ns = Ping.objects.values_list("n", flat=True).order_by("n")
+        self.assertEqual(list(ns), [1, 2, 4])
+
+    def test_it_handles_missing_check(self):
+        code = "07c2f548-9850-4b27-af5d-6c9dc157ec02"
+        self.assertIsNone(self.coalescer.record(code))
+        self.assertEqual(self.coalescer.hot, {})
+
+    @override_settings(PING_COALESCE_WINDOW=1)
+    @patch("hc.api.pings.get_coalescer")
+    def test_record_uses_coalescer(self, mock_get_coalescer):
+        pings.record(self.check.code, ua="probe")
+
+        args, kwargs = mock_get_coalescer.return_value.record.call_args
+        self.assertEqual(args, (self.check.code, ))
+        self.assertEqual(kwargs["ua"], "probe")
@@ -1,8 +1,17 @@
+import threading
+from argparse import ArgumentTypeError
 from datetime import timedelta
 
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TransactionTestCase, override_settings
 from django.utils import timezone
-from hc.api.management.commands.sendalerts import Command
-from hc.api.models import Check
+from hc.api.management.commands import sendalerts
+from hc.api.management.commands.sendalerts import (Command,
+                                                   DeadlineScheduler,
+                                                   flip_due, parse_shard)
+from hc.api import metrics
+from hc.api.models import Channel, Check, Outbox, Tag
 from hc.test import BaseTestCase
 from mock import patch
 
@@ -52,3 +61,395 @@ class SendAlertsTestCase(BaseTestCase):
 
     ### Assert when Command's handle many that when handle_many should return True
 
+
+class DeadlineSchedulerTestCase(BaseTestCase):
+
+    def setUp(self):
+        super(DeadlineSchedulerTestCase, self).setUp()
+        self.now = timezone.now()
+        self.scheduler = DeadlineScheduler()
+
+    def _make_check(self, status, alert_after, last_ping=None):
+        check = Check(user=self.alice, status=status)
+        check.last_ping = last_ping or self.now - timedelta(days=1)
+        check.save()
+
+        # Set alert_after directly, as triggers may not be installed:
+        Check.objects.filter(id=check.id).update(alert_after=alert_after)
+        return check
+
+    def test_rebuild_loads_up_checks(self):
+        soon = self.now + timedelta(minutes=1)
+        later = self.now + timedelta(minutes=2)
+        self._make_check("up", later)
+        self._make_check("up", soon)
+        self._make_check("down", self.now + timedelta(minutes=3))
+        self._make_check("paused", self.now + timedelta(minutes=4))
+
+        self.scheduler.rebuild(self.now)
+        self.assertEqual(sorted(self.scheduler.heap), [soon, later])
+
+    def test_pop_due_works(self):
+        self.scheduler.push(self.now - timedelta(seconds=1))
+        self.scheduler.push(self.now + timedelta(seconds=30))
+
+        self.assertTrue(self.scheduler.pop_due(self.now))
+        self.assertFalse(self.scheduler.pop_due(self.now))
+        self.assertEqual(self.scheduler.seconds_to_next(self.now, 60), 30)
+        self.assertEqual(self.scheduler.seconds_to_next(self.now, 5), 5)
+
+    def test_refresh_picks_up_pinged_checks(self):
+        self.scheduler.rebuild(self.now - timedelta(seconds=10))
+
+        deadline = self.now + timedelta(hours=1)
+        self._make_check("up", deadline, last_ping=self.now)
+
+        self.assertFalse(self.scheduler.refresh(self.now))
+        self.assertEqual(self.scheduler.heap, [deadline])
+
+    def test_refresh_detects_checks_going_up(self):
+        self.scheduler.rebuild(self.now - timedelta(seconds=10))
+        self._make_check("down", self.now + timedelta(hours=1),
+                         last_ping=self.now)
+
+        self.assertTrue(self.scheduler.refresh(self.now))
+
+    def test_refresh_ignores_old_pings(self):
+        self.scheduler.rebuild(self.now - timedelta(seconds=10))
+        self._make_check("down", self.now + timedelta(hours=1),
+                         last_ping=self.now - timedelta(minutes=5))
+
+        self.assertFalse(self.scheduler.refresh(self.now))
+        self.assertEqual(self.scheduler.heap, [])
+
+    def test_refresh_picks_up_shortened_timeouts(self):
+        check = self._make_check("up", self.now + timedelta(hours=1))
+        self.scheduler.rebuild(self.now - timedelta(seconds=10))
+
+        # The timeout is shortened, moving alert_after without a ping
+        soon = self.now + timedelta(minutes=1)
+        Check.objects.filter(id=check.id).update(alert_after=soon)
+
+        self.assertFalse(self.scheduler.refresh(self.now))
+        self.assertEqual(self.scheduler.heap[0], soon)
+
+    def test_rebuild_detects_checks_going_up(self):
+        self.assertFalse(self.scheduler.rebuild(self.now))
+
+        # Pinged with a timestamp older than the last scan
+        self._make_check("down", self.now + timedelta(hours=1),
+                         last_ping=self.now - timedelta(minutes=5))
+        self._make_check("down", self.now - timedelta(hours=1))
+
+        self.assertTrue(self.scheduler.rebuild(self.now))
+
+    def test_refresh_sees_pings_across_rebuild(self):
+        self.scheduler.rebuild(self.now - timedelta(minutes=2))
+        self._make_check("down", self.now + timedelta(hours=1),
+                         last_ping=self.now - timedelta(seconds=30))
+
+        # Due for a rebuild, which keeps the time of the last scan
+        self.assertTrue(self.scheduler.refresh(self.now))
+        self.assertEqual(self.scheduler.scanned,
+                         self.now - timedelta(minutes=2))
+
+    @patch("hc.api.management.commands.sendalerts.Command.handle_many")
+    def test_handle_scheduled_waits_for_deadline(self, mock_handle_many):
+        self._make_check("up", self.now + timedelta(seconds=30))
+
+        timeout = Command().handle_scheduled(self.scheduler, 60)
+        self.assertFalse(mock_handle_many.called)
+        self.assertTrue(25 < timeout <= 30)
+
+    @patch("hc.api.management.commands.sendalerts.Command.handle_many")
+    def test_handle_scheduled_handles_due_checks(self, mock_handle_many):
+        self.scheduler.rebuild(self.now)
+        self.scheduler.push(self.now - timedelta(seconds=1))
+
+        timeout = Command().handle_scheduled(self.scheduler, 5)
+        self.assertTrue(mock_handle_many.called)
+        self.assertEqual(timeout, 5)
+
+
+class SerialClaimCommand(Command):
+    """ SQLite's shared in-memory test database fails concurrent writes
+    instead of waiting for them, so there claims take turns. """
+
+    lock = threading.Lock()
+
+    def claim(self, check):
+        with self.lock:
+            return super(SerialClaimCommand, self).claim(check)
+
+
+class MultipleWorkersTestCase(TransactionTestCase):
+    """ The workers run in threads, so each test has to commit its data
+    for them to see it. """
+
+    def setUp(self):
+        super(MultipleWorkersTestCase, self).setUp()
+        self.alice = User.objects.create(username="alice")
+
+    @patch("hc.api.management.commands.sendalerts.Check.send_alert",
+           autospec=True)
+    def test_each_transition_is_notified_once(self, mock_send_alert):
+        sent = []
+
+        def send_alert(check):
+            sent.append(check.id)
+            return []
+
+        mock_send_alert.side_effect = send_alert
+        now = timezone.now()
+
+        for i in range(0, 10):
+            check = Check(user=self.alice, name="Going down %d" % i)
+            check.last_ping = now - timedelta(days=2)
+            check.alert_after = now - timedelta(hours=23)
+            check.status = "up"
+            check.save()
+
+            check = Check(user=self.alice, name="Going up %d" % i)
+            check.last_ping = now
+            check.alert_after = now + timedelta(days=1)
+            check.status = "down"
+            check.save()
+
+        # Three workers select the same checks, wait until all of them
+        # have, and then race to claim them
+        barrier = threading.Barrier(3)
+        errors = []
+
+        cls = SerialClaimCommand if connection.vendor == "sqlite" else Command
+
+        def work():
+            try:
+                checks = list(Check.objects.filter(user=self.alice))
+                barrier.wait()
+                command = cls()
+                for check in checks:
+                    command.handle_one(check)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=work) for i in range(0, 3)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(sorted(sent),
+                         sorted(Check.objects.values_list("id", flat=True)))
+
+        statuses = Check.objects.values_list("name", "status")
+        for name, status in statuses:
+            self.assertEqual(status, "down" if "down" in name else "up")
+
+    def test_handle_one_skips_claimed_check(self):
+        check = Check(user=self.alice, status="up")
+        check.last_ping = timezone.now() - timedelta(days=2)
+        check.save()
+
+        stale = Check.objects.get(id=check.id)
+        Check.objects.filter(id=check.id).update(status="down")
+
+        self.assertFalse(Command().handle_one(stale))
+
+
+class DigestTestCase(BaseTestCase):
+
+    @override_settings(DIGEST_THRESHOLD=2)
+    @patch("hc.api.management.commands.sendalerts.Channel.notify_many")
+    def test_it_groups_checks_by_channel(self, mock_notify_many):
+        mock_notify_many.return_value = []
+        yesterday = timezone.now() - timedelta(days=1)
+
+        email = Channel.objects.create(user=self.alice, kind="email")
+        slack = Channel.objects.create(user=self.alice, kind="slack")
+        for i in range(0, 3):
+            check = Check(user=self.alice, name="Check %d" % i, status="up")
+            check.last_ping = yesterday - timedelta(days=1)
+            check.alert_after = yesterday
+            check.save()
+
+            email.checks.add(check)
+            if i == 0:
+                slack.checks.add(check)
+
+        self.assertTrue(Command().handle_many())
+        self.assertEqual(mock_notify_many.call_count, 2)
+
+        calls = {}
+        for args, kwargs in mock_notify_many.call_args_list:
+            calls[len(args[0])] = [check.name for check in args[0]]
+
+        self.assertEqual(calls[3], ["Check 0", "Check 1", "Check 2"])
+        self.assertEqual(calls[1], ["Check 0"])
+        self.assertEqual(Check.objects.filter(status="down").count(), 3)
+
+
+class BulkTestCase(BaseTestCase):
+
+    def setUp(self):
+        super(BulkTestCase, self).setUp()
+        now = timezone.now()
+
+        self.going_down = Check(user=self.alice, status="up")
+        self.going_down.last_ping = now - timedelta(days=2)
+        self.going_down.alert_after = now - timedelta(hours=23)
+        self.going_down.save()
+
+        self.going_up = Check(user=self.alice, status="down")
+        self.going_up.last_ping = now
+        self.going_up.alert_after = now + timedelta(days=1)
+        self.going_up.save()
+
+        self.unchanged = Check(user=self.alice, status="up")
+        self.unchanged.last_ping = now
+        self.unchanged.alert_after = now + timedelta(days=1)
+        self.unchanged.save()
+
+    def test_flip_due_works(self):
+        checks = flip_due(timezone.now())
+        statuses = {check.id: check.status for check in checks}
+        self.assertEqual(statuses, {self.going_down.id: "down",
+                                    self.going_up.id: "up"})
+
+        self.going_down.refresh_from_db()
+        self.assertEqual(self.going_down.status, "down")
+        self.going_up.refresh_from_db()
+        self.assertEqual(self.going_up.status, "up")
+
+        # Nothing left to do the second time
+        self.assertEqual(flip_due(timezone.now()), [])
+
+    def test_fallback_skips_checks_flipped_meanwhile(self):
+        set_status = sendalerts._set_status
+
+        def other_worker_first(check, status):
+            # Another worker flips the check after it was selected here
+            Check.objects.filter(id=check.id).update(status=status)
+            return set_status(check, status)
+
+        with patch("hc.api.management.commands.sendalerts._set_status",
+                   other_worker_first):
+            self.assertEqual(sendalerts._flip_fallback(timezone.now(), None),
+                             [])
+
+    def test_flip_due_updates_tags(self):
+        for check in (self.going_down, self.going_up, self.unchanged):
+            check.tags = "foo"
+            check.save()
+
+        self.assertEqual(Tag.objects.get(name="foo").n_down, 1)
+
+        Command().flip_due()
+        tag = Tag.objects.get(name="foo")
+        self.assertEqual((tag.n_checks, tag.n_down), (3, 1))
+        self.assertEqual(tag.get_status(), "down")
+
+        check = Check.objects.get(id=self.going_down.id)
+        check.status = "up"
+        check.last_ping = timezone.now()
+        check.save()
+        tag.refresh_from_db()
+        self.assertEqual(tag.get_status(), "up")
+
+    @patch("hc.api.management.commands.sendalerts.Check.send_alert")
+    def test_it_sends_alerts(self, mock_send_alert):
+        mock_send_alert.return_value = []
+
+        command = Command()
+        command.bulk = True
+        self.assertTrue(command.handle_many())
+        self.assertEqual(mock_send_alert.call_count, 2)
+        self.assertFalse(command.handle_many())
+
+    @override_settings(NOTIFICATION_OUTBOX=True)
+    def test_it_queues_alerts(self):
+        channel = Channel.objects.create(user=self.alice, kind="email")
+        channel.checks.add(self.going_down, self.unchanged)
+
+        command = Command()
+        command.bulk = True
+        self.assertTrue(command.handle_many())
+
+        item = Outbox.objects.get()
+        self.assertEqual(item.owner, self.going_down)
+        self.assertEqual(item.check_status, "down")
+
+    @patch("hc.api.management.commands.sendalerts.Check.send_alert")
+    def test_it_records_flip_delay(self, mock_send_alert):
+        mock_send_alert.return_value = []
+        before = metrics.flip_delay.values.get(("down", ), [0, 0.0, 0])[2]
+
+        command = Command()
+        command.bulk = True
+        command.handle_many()
+
+        after = metrics.flip_delay.values[("down", )][2]
+        self.assertEqual(after, before + 1)
+        self.assertEqual(metrics.due_checks.values[()], 2)
+
+
+class ShardTestCase(BaseTestCase):
+
+    def setUp(self):
+        super(ShardTestCase, self).setUp()
+        now = timezone.now()
+
+        self.ids = []
+        for user in (self.alice, self.bob, self.charlie):
+            for i in range(0, 5):
+                check = Check(user=user, status="up")
+                check.last_ping = now - timedelta(days=2)
+                check.alert_after = now - timedelta(hours=23)
+                check.save()
+                self.ids.append(check.id)
+
+    def test_parse_shard_works(self):
+        self.assertEqual(parse_shard("1/4"), (1, 4))
+        with self.assertRaises(ArgumentTypeError):
+            parse_shard("4/4")
+        with self.assertRaises(ArgumentTypeError):
+            parse_shard("foo")
+
+    @patch("hc.api.management.commands.sendalerts.Command.handle_one")
+    def test_each_check_is_selected_by_one_shard(self, mock_handle_one):
+        for i in range(0, 2):
+            command = Command()
+            command.shard = (i, 2)
+            command.handle_many()
+
+        handled = [args[0].id for args, kwargs in
+                   mock_handle_one.call_args_list]
+        self.assertEqual(sorted(handled), sorted(self.ids))
+
+    @patch("hc.api.management.commands.sendalerts.Check.send_alert")
+    def test_each_check_is_flipped_by_one_shard(self, mock_send_alert):
+        mock_send_alert.return_value = []
+
+        flipped = []
+        for i in range(0, 3):
+            command = Command()
+            command.bulk = True
+            command.shard = (i, 3)
+            flipped.extend(check.id for check in command.flip_due())
+
+            # Each shard only gets one user's checks
+            self.assertEqual(len(flipped), 5 * (i + 1))
+
+        self.assertEqual(sorted(flipped), sorted(self.ids))
+        self.assertFalse(Check.objects.filter(status="up").exists())
+
+    def test_scheduler_loads_own_shard(self):
+        scheduler = DeadlineScheduler(shard=(self.alice.id % 2, 2))
+        scheduler.rebuild(timezone.now())
+
+        n = Check.objects.filter(user_id__in=[
+            user.id for user in (self.alice, self.bob, self.charlie)
+            if user.id % 2 == self.alice.id % 2]).count()
+        self.assertEqual(len(scheduler.heap), n)
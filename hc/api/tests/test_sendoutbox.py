@@ -0,0 +1,130 @@
+from datetime import timedelta as td
+
+from django.test import override_settings
+from django.utils import timezone
+from hc.api import metrics
+from hc.api.management.commands.sendalerts import Command as SendAlerts
+from hc.api.management.commands.sendoutbox import Command, retry_delay
+from hc.api.models import Channel, Check, Notification, Outbox
+from hc.test import BaseTestCase
+from mock import patch
+
+
+class SendOutboxTestCase(BaseTestCase):
+
+    def setUp(self):
+        super(SendOutboxTestCase, self).setUp()
+        self.check = Check(user=self.alice, status="down")
+        self.check.last_ping = timezone.now() - td(days=2)
+        self.check.save()
+
+        self.channel = Channel(user=self.alice, kind="webhook")
+        self.channel.value = "http://example"
+        self.channel.save()
+        self.channel.checks.add(self.check)
+
+    def _queue(self):
+        self.check.queue_alert()
+        return Outbox.objects.get()
+
+    @override_settings(NOTIFICATION_OUTBOX=True)
+    @patch("hc.api.transports.session.request")
+    def test_sendalerts_only_queues(self, mock_request):
+        self.check.status = "up"
+        self.check.save()
+
+        self.assertTrue(SendAlerts().handle_one(self.check))
+        self.assertFalse(mock_request.called)
+
+        item = Outbox.objects.get()
+        self.assertEqual(item.check_status, "down")
+        self.assertEqual(item.channel, self.channel)
+
+    @patch("hc.api.transports.session.request")
+    def test_it_delivers(self, mock_request):
+        mock_request.return_value.status_code = 200
+        item = self._queue()
+
+        self.assertEqual(Command().deliver(item), "")
+        self.assertEqual(Outbox.objects.count(), 0)
+
+        n = Notification.objects.get()
+        self.assertEqual(n.check_status, "down")
+        self.assertEqual(n.error, "")
+
+    @patch("hc.api.transports.session.request")
+    def test_it_uses_queued_status(self, mock_request):
+        mock_request.return_value.status_code = 200
+        item = self._queue()
+
+        # The check goes up before the item gets delivered
+        self.check.status = "up"
+        self.check.save()
+
+        Command().deliver(item)
+        args, kwargs = mock_request.call_args
+        self.assertEqual(args, ("get", "http://example"))
+
+    @patch("hc.api.transports.session.request")
+    def test_it_retries(self, mock_request):
+        mock_request.return_value.status_code = 500
+        item = self._queue()
+
+        Command().deliver(item)
+
+        item = Outbox.objects.get()
+        self.assertEqual(item.n_attempts, 1)
+        self.assertTrue(item.next_attempt > timezone.now())
+
+        n = Notification.objects.get()
+        self.assertEqual(n.error, "Received status code 500")
+
+    @patch("hc.api.transports.session.request")
+    def test_it_gives_up(self, mock_request):
+        mock_request.return_value.status_code = 500
+        item = self._queue()
+        item.created = timezone.now() - td(days=1)
+
+        Command().deliver(item)
+        self.assertEqual(Outbox.objects.count(), 0)
+        self.assertEqual(Notification.objects.count(), 1)
+
+    @patch("hc.api.transports.session.request")
+    def test_it_handles_no_op(self, mock_request):
+        self.channel.value = "\nhttp://example"
+        self.channel.save()
+
+        Command().deliver(self._queue())
+
+        self.assertFalse(mock_request.called)
+        self.assertEqual(Outbox.objects.count(), 0)
+        self.assertEqual(Notification.objects.count(), 0)
+
+    def test_it_reports_queue_depth(self):
+        self._queue()
+        with patch.object(Command, "claim", return_value=[]):
+            Command().handle_many()
+
+        self.assertEqual(metrics.outbox_items.values[()], 1)
+
+    def test_claim_works(self):
+        item = self._queue()
+        later = Outbox(owner=self.check, channel=self.channel)
+        later.next_attempt = timezone.now() + td(minutes=1)
+        later.save()
+
+        command = Command()
+        now = timezone.now()
+        self.assertEqual(command.claim(now), [item])
+
+        # Claimed items are not handed out again
+        self.assertEqual(command.claim(now), [])
+
+        item.refresh_from_db()
+        self.assertTrue(item.next_attempt > now)
+
+    @override_settings(OUTBOX_RETRY_DELAY=10, OUTBOX_MAX_RETRY_DELAY=60)
+    def test_retry_delay_backs_off(self):
+        self.assertTrue(5 <= retry_delay(1) <= 10)
+        self.assertTrue(20 <= retry_delay(3) <= 40)
+        self.assertTrue(30 <= retry_delay(10) <= 60)
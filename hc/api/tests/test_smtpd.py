@@ -0,0 +1,102 @@
+import asyncio
+import smtplib
+import threading
+
+from django.test import TestCase
+from django.utils import timezone
+from mock import patch
+
+from hc.api.management.commands.smtpd import Command, PingBatcher
+from hc.api.models import Check, Ping
+
+
+class SmtpdTestCase(TestCase):
+
+    def setUp(self):
+        super(SmtpdTestCase, self).setUp()
+        self.check = Check.objects.create()
+
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.command = Command()
+        self.server = self.command.start(self.loop, "127.0.0.1", 0)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+        self.thread = threading.Thread(target=self.loop.run_forever)
+        self.thread.start()
+
+    def tearDown(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+        asyncio.set_event_loop(None)
+        super(SmtpdTestCase, self).tearDown()
+
+    def send(self, to):
+        client = smtplib.SMTP("127.0.0.1", self.port)
+        client.sendmail("alice@example.org", to, "Subject: hi\r\n\r\nhello")
+        client.quit()
+
+    def stop(self):
+        """ Stop the server and write out the pending pings. """
+
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.command.stop(self.loop, self.server)
+
+    @patch("hc.api.management.commands.smtpd.pings.record_many")
+    def test_it_records_pings(self, mock_record):
+        self.send(["%s@example.org" % self.check.code])
+        self.stop()
+
+        args, kwargs = mock_record.call_args
+        (code, ts), = args[0]
+        self.assertEqual(code, self.check.code)
+        self.assertEqual(kwargs["scheme"], "email")
+        self.assertEqual(kwargs["remote_addr"], "127.0.0.1")
+        self.assertEqual(kwargs["ua"], "Email from alice@example.org")
+
+    @patch("hc.api.management.commands.smtpd.pings.record_many")
+    def test_it_batches_pings(self, mock_record):
+        for i in range(0, 5):
+            self.send(["%s@example.org" % self.check.code])
+        self.stop()
+
+        self.assertEqual(mock_record.call_count, 1)
+        self.assertEqual(len(mock_record.call_args[0][0]), 5)
+
+    @patch("hc.api.management.commands.smtpd.pings.record_many")
+    def test_it_rejects_bad_recipients(self, mock_record):
+        with self.assertRaises(smtplib.SMTPRecipientsRefused):
+            self.send(["alice@example.org"])
+        self.stop()
+
+        self.assertFalse(mock_record.called)
+
+    @patch("hc.api.management.commands.smtpd.pings.record_many")
+    def test_it_skips_bad_recipients(self, mock_record):
+        self.send(["alice@example.org", "%s@example.org" % self.check.code])
+        self.stop()
+
+        (code, ts), = mock_record.call_args[0][0]
+        self.assertEqual(code, self.check.code)
+
+
+class PingBatcherTestCase(TestCase):
+
+    def test_write_works(self):
+        check = Check.objects.create()
+        batcher = PingBatcher(asyncio.new_event_loop())
+
+        now = timezone.now()
+        batcher.write([(check.code, now, "1.2.3.4", "alice@example.org"),
+                       (check.code, now, "1.2.3.4", "alice@example.org")])
+
+        check.refresh_from_db()
+        self.assertEqual(check.n_pings, 2)
+        self.assertEqual(check.status, "up")
+
+        ping = Ping.objects.latest("n")
+        self.assertEqual(ping.scheme, "email")
+        self.assertEqual(ping.remote_addr, "1.2.3.4")
+        self.assertEqual(ping.created, now)
@@ -0,0 +1,36 @@
+from datetime import timedelta
+
+from django.test import TestCase
+from django.utils import timezone
+from hc.api.models import Check
+from hc.api.status import CheckRow
+
+
+class CheckRowTestCase(TestCase):
+
+    def test_it_matches_check_methods(self):
+        now = timezone.now()
+        checks = [Check(status="new"), Check(status="paused")]
+        for ago in (timedelta(), timedelta(days=1, minutes=30),
+                    timedelta(days=3)):
+            checks.append(Check(status="up", last_ping=now - ago))
+
+        for row in CheckRow.evaluate(checks):
+            self.assertEqual(row.status, row.check.get_status())
+            self.assertEqual(row.in_grace, row.check.in_grace_period())
+
+    def test_it_computes_next_due(self):
+        now = timezone.now()
+        check = Check(status="up", last_ping=now)
+
+        row, = CheckRow.evaluate([check], now)
+        self.assertEqual(row.next_due, now + check.timeout)
+
+    def test_it_uses_one_now(self):
+        now = timezone.now()
+        # Late at `now`, even if the clock has moved on
+        check = Check(status="up", last_ping=now - timedelta(days=1, hours=1))
+
+        row, = CheckRow.evaluate([check], now - timedelta(minutes=30))
+        self.assertEqual(row.status, "up")
+        self.assertTrue(row.in_grace)
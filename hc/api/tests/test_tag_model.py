@@ -0,0 +1,116 @@
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+from django.utils import timezone
+from hc.api.models import Check, Tag, update_tag_stats
+
+
+class TagModelTestCase(TestCase):
+
+    def setUp(self):
+        super(TagModelTestCase, self).setUp()
+        self.alice = User.objects.create(username="alice")
+
+    def stats(self, name):
+        tag = Tag.objects.get(user=self.alice, name=name)
+        return tag.n_checks, tag.n_down
+
+    def test_it_counts_checks(self):
+        check = Check.objects.create(user=self.alice, tags="foo bar")
+        Check.objects.create(user=self.alice, tags="foo")
+        self.assertEqual(self.stats("foo"), (2, 0))
+        self.assertEqual(self.stats("bar"), (1, 0))
+
+        check = Check.objects.get(id=check.id)
+        check.tags = "baz"
+        check.save()
+        self.assertEqual(self.stats("foo"), (1, 0))
+        self.assertEqual(self.stats("bar"), (0, 0))
+        self.assertEqual(self.stats("baz"), (1, 0))
+
+        check.delete()
+        self.assertEqual(self.stats("baz"), (0, 0))
+
+    def test_it_counts_down_checks(self):
+        check = Check.objects.create(user=self.alice, tags="foo",
+                                     status="down")
+        self.assertEqual(self.stats("foo"), (1, 1))
+
+        # Pausing a check takes it out of the down count
+        check = Check.objects.get(id=check.id)
+        check.status = "paused"
+        check.save()
+        self.assertEqual(self.stats("foo"), (1, 0))
+
+        check.status = "down"
+        check.save()
+        check.tags = ""
+        check.save()
+        self.assertEqual(self.stats("foo"), (0, 0))
+
+    def test_save_uses_current_status(self):
+        check = Check.objects.create(user=self.alice, tags="foo",
+                                     status="up")
+        check = Check.objects.get(id=check.id)
+
+        # sendalerts flips the check after it was loaded here
+        Check.objects.filter(id=check.id).update(status="down")
+        update_tag_stats({check.id: (0, 1, None)})
+        self.assertEqual(self.stats("foo"), (1, 1))
+
+        # Pausing the stale instance takes it out of the down count
+        check.status = "paused"
+        check.tags = "bar"
+        check.save()
+        self.assertEqual(self.stats("foo"), (0, 0))
+        self.assertEqual(self.stats("bar"), (1, 0))
+
+    def test_get_status_works(self):
+        now = timezone.now()
+        check = Check.objects.create(user=self.alice, tags="foo",
+                                     status="up", last_ping=now)
+        tag = Tag.objects.get(name="foo")
+        self.assertEqual(tag.late_after, now + check.timeout)
+        self.assertEqual(tag.get_status(), "up")
+        self.assertEqual(tag.get_status(now + timedelta(days=2)), "late")
+
+        check.status = "down"
+        check.save()
+        tag.refresh_from_db()
+        self.assertEqual(tag.get_status(), "down")
+
+    def test_get_status_notices_pings(self):
+        now = timezone.now()
+        check = Check.objects.create(user=self.alice, tags="foo",
+                                     status="up", last_ping=now)
+
+        # A ping does not touch the tag, late_after is now too early
+        Check.objects.filter(id=check.id).update(
+            last_ping=now + timedelta(days=1))
+
+        tag = Tag.objects.get(name="foo")
+        later = now + timedelta(days=1, hours=1)
+        self.assertEqual(tag.get_status(later), "up")
+
+        tag.refresh_from_db()
+        self.assertEqual(tag.late_after, now + timedelta(days=2))
+
+    def test_get_status_keeps_concurrent_updates(self):
+        now = timezone.now()
+        Check.objects.create(user=self.alice, tags="foo", status="up",
+                             last_ping=now - timedelta(days=2))
+        tag = Tag.objects.get(name="foo")
+
+        # A check's timeout is shortened, moving late_after earlier,
+        # while get_status() is working out a new one
+        def compute_late_after(now):
+            Tag.objects.filter(id=tag.id).update(
+                late_after=now - timedelta(minutes=1))
+            return now + timedelta(days=1)
+
+        tag.compute_late_after = compute_late_after
+        self.assertEqual(tag.get_status(now), "late")
+
+        tag.refresh_from_db()
+        self.assertEqual(tag.late_after, now - timedelta(minutes=1))
@@ -0,0 +1,85 @@
+from django.core import mail
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from mock import patch
+from requests import Request
+from requests.cookies import MockRequest, create_cookie
+
+from hc.api.models import Channel, Check
+from hc.api.transports import Summary, SummaryCache, make_session
+from hc.test import BaseTestCase
+
+
+class MakeSessionTestCase(TestCase):
+
+    @override_settings(HTTP_POOL_HOSTS=5, HTTP_POOL_SIZE=3)
+    def test_it_configures_pool(self):
+        session = make_session()
+        adapter = session.get_adapter("https://hooks.example.org/")
+        self.assertEqual(adapter._pool_connections, 5)
+        self.assertEqual(adapter._pool_maxsize, 3)
+
+    def test_it_does_not_keep_cookies(self):
+        session = make_session()
+        cookie = create_cookie("sessionid", "123", domain="example.org")
+        request = MockRequest(Request("GET", "http://example.org/").prepare())
+
+        policy = session.cookies._policy
+        self.assertFalse(policy.set_ok(cookie, request))
+
+
+class SummaryCacheTestCase(BaseTestCase):
+
+    def setUp(self):
+        super(SummaryCacheTestCase, self).setUp()
+        self.check = Check.objects.create(user=self.alice, name="Foo",
+                                          status="down")
+        self.check.last_ping = timezone.now()
+        self.check.save()
+        self.other = Check.objects.create(user=self.alice, name="Bar",
+                                          status="down")
+        self.other.last_ping = timezone.now()
+        self.other.save()
+
+    def test_it_does_not_cache_by_default(self):
+        cache = SummaryCache()
+        self.assertIsNot(cache.get(self.alice), cache.get(self.alice))
+
+    def test_it_shares_summaries_after_begin(self):
+        cache = SummaryCache()
+        cache.begin()
+
+        summary = cache.get(self.alice)
+        self.assertIs(cache.get(self.alice), summary)
+        self.assertIsNot(cache.get(self.bob), summary)
+
+        cache.begin()
+        self.assertIsNot(cache.get(self.alice), summary)
+
+    @patch("hc.api.transports.emails.render_fragment")
+    def test_it_renders_once(self, mock_render):
+        mock_render.return_value = "<table></table>"
+        summary = Summary([self.check, self.other])
+
+        self.assertEqual(summary.html, "<table></table>")
+        self.assertEqual(summary.html, "<table></table>")
+        self.assertEqual(mock_render.call_count, 1)
+
+    def test_down_checks_excludes_check(self):
+        summary = Summary([self.check, self.other])
+        self.assertEqual(summary.down_checks(exclude=self.check), [self.other])
+
+    @patch("hc.api.transports.summaries")
+    def test_emails_use_summary(self, mock_summaries):
+        mock_summaries.get.return_value = Summary([self.check, self.other])
+        channel = Channel.objects.create(user=self.alice, kind="email",
+                                         value="alice@example.org",
+                                         email_verified=True)
+
+        channel.notify(self.check)
+        mock_summaries.get.assert_called_once_with(self.alice)
+
+        message = mail.outbox[0]
+        html, _ = message.alternatives[0]
+        self.assertIn("Bar", html)
+        self.assertIn("Bar", message.body)
@@ -0,0 +1,85 @@
+import json
+
+from django.test import RequestFactory, TestCase
+from mock import patch
+
+from hc.api.models import Check, Ping
+from hc.wsgi_ping import application
+
+
+@patch("hc.wsgi_ping.close_old_connections")
+class WsgiPingTestCase(TestCase):
+
+    def setUp(self):
+        super(WsgiPingTestCase, self).setUp()
+        self.check = Check.objects.create()
+        self.factory = RequestFactory()
+
+    def call(self, path, method="get", **extra):
+        environ = getattr(self.factory, method)(path, **extra).environ
+        result = {}
+
+        def start_response(status, headers):
+            result["status"] = status
+            result["headers"] = dict(headers)
+
+        result["body"] = b"".join(application(environ, start_response))
+        return result
+
+    def test_it_works(self, mock_close):
+        r = self.call("/ping/%s/" % self.check.code,
+                      HTTP_X_FORWARDED_FOR="1.1.1.1, 2.2.2.2")
+
+        self.assertEqual(r["status"], "200 OK")
+        self.assertEqual(r["body"], b"OK")
+        self.assertEqual(r["headers"]["Access-Control-Allow-Origin"], "*")
+        self.assertTrue("no-cache" in r["headers"]["Cache-Control"])
+
+        self.check.refresh_from_db()
+        self.assertEqual(self.check.status, "up")
+        self.assertEqual(self.check.n_pings, 1)
+
+        ping = Ping.objects.get()
+        self.assertEqual(ping.remote_addr, "1.1.1.1")
+        self.assertEqual(ping.method, "GET")
+
+    def test_it_works_without_trailing_slash(self, mock_close):
+        r = self.call("/ping/%s" % self.check.code)
+        self.assertEqual(r["status"], "200 OK")
+
+    def test_it_handles_bad_uuid(self, mock_close):
+        r = self.call("/ping/not-uuid/")
+        self.assertEqual(r["status"], "400 Bad Request")
+
+    def test_it_handles_missing_check(self, mock_close):
+        r = self.call("/ping/07c2f548-9850-4b27-af5d-6c9dc157ec02/")
+        self.assertEqual(r["status"], "400 Bad Request")
+
+    def test_it_serves_only_pings(self, mock_close):
+        r = self.call("/checks/")
+        self.assertEqual(r["status"], "404 Not Found")
+
+    def test_it_serves_bulk_pings(self, mock_close):
+        doc = {"pings": [str(self.check.code)]}
+        r = self.call("/ping/", "post", data=json.dumps(doc),
+                      content_type="application/json")
+
+        self.assertEqual(r["status"], "200 OK")
+        self.assertEqual(r["headers"]["Content-Type"], "application/json")
+        self.assertEqual(json.loads(r["body"].decode("utf-8")),
+                         {"received": 1, "unknown": []})
+
+        self.check.refresh_from_db()
+        self.assertEqual(self.check.n_pings, 1)
+
+    def test_bulk_pings_handle_bad_body(self, mock_close):
+        r = self.call("/ping/", "post", data="not json",
+                      content_type="application/json")
+
+        self.assertEqual(r["status"], "400 Bad Request")
+        self.assertEqual(json.loads(r["body"].decode("utf-8")),
+                         {"error": "could not parse request body"})
+
+    def test_bulk_pings_need_post(self, mock_close):
+        r = self.call("/ping/")
+        self.assertEqual(r["status"], "405 Method Not Allowed")
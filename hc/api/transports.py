@@ -2,18 +2,124 @@ from django.conf import settings
 from django.template.loader import render_to_string
 from django.utils import timezone
 import json
+import threading
+
 import requests
-from six.moves.urllib.parse import quote
+from requests.adapters import HTTPAdapter
+from six.moves.http_cookiejar import DefaultCookiePolicy
+from six.moves.urllib.parse import quote, urlparse
 
+from hc.api.status import CheckRow
 from hc.lib import emails
 
 
+def make_session():
+    """ Return a requests session that keeps connections alive.
+
+    The session keeps a pool of up to HTTP_POOL_SIZE connections for
+    each of the HTTP_POOL_HOSTS most recently used hosts, and can be used
+    from several threads at once. It doesn't store cookies, so
+    notifications for different users to the same host never share any.
+
+    """
+
+    adapter = HTTPAdapter(pool_connections=settings.HTTP_POOL_HOSTS,
+                          pool_maxsize=settings.HTTP_POOL_SIZE)
+
+    s = requests.Session()
+    s.mount("http://", adapter)
+    s.mount("https://", adapter)
+    s.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+    return s
+
+
+session = make_session()
+
+
 def tmpl(template_name, **ctx):
     template_path = "integrations/%s" % template_name
     return render_to_string(template_path, ctx).strip()
 
 
+class Summary(object):
+    """ A snapshot of all of a user's checks, as shown in alerts.
+
+    The checks are loaded once, and the summary tables in alert emails,
+    which compute every check's status, are rendered once, however many
+    alerts use them.
+
+    """
+
+    def __init__(self, checks):
+        self.checks = list(checks)
+        self._rows = self._html = self._text = None
+
+    def down_checks(self, exclude=None):
+        return [check for check in self.checks
+                if check.status == "down" and check != exclude]
+
+    @property
+    def rows(self):
+        if self._rows is None:
+            self._rows = CheckRow.evaluate(self.checks)
+        return self._rows
+
+    @property
+    def html(self):
+        if self._html is None:
+            ctx = {"rows": self.rows}
+            self._html = emails.render_fragment("emails/summary-html.html",
+                                                ctx)
+        return self._html
+
+    @property
+    def text(self):
+        if self._text is None:
+            ctx = {"rows": self.rows}
+            self._text = render_to_string("emails/summary-text.html", ctx)
+        return self._text
+
+
+class SummaryCache(object):
+    """ Shares Summary objects between the alerts of one sendalerts pass.
+
+    Caching only starts once begin() is called, so alerts sent from
+    elsewhere always see fresh data. Calling begin() again discards all
+    cached summaries.
+
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.summaries = None
+
+    def begin(self):
+        with self.lock:
+            self.summaries = {}
+
+    def get(self, user):
+        if self.summaries is None:
+            return Summary(user.check_set.order_by("created"))
+
+        with self.lock:
+            summary = self.summaries.get(user.id)
+
+        if summary is None:
+            # Built outside the lock, so alerts for other users don't wait
+            summary = Summary(user.check_set.order_by("created"))
+            with self.lock:
+                summary = self.summaries.setdefault(user.id, summary)
+
+        return summary
+
+
+summaries = SummaryCache()
+
+
 class Transport(object):
+    # Set in transports that implement notify_digest()
+    digest = False
+
     def __init__(self, channel):
         self.channel = channel
 
@@ -27,6 +133,27 @@ class Transport(object):
 
         raise NotImplementedError()
 
+    def notify_digest(self, checks):
+        """ Send a single notification about several checks at once.
+
+        Only transports with `digest = True` implement this. It returns
+        None on success, and error message on error.
+
+        """
+
+        raise NotImplementedError()
+
+    @property
+    def destination(self):
+        """ Name of the service or host notifications are sent to.
+
+        Transports that always talk to the same API use the channel's
+        kind. Transports that post to user-supplied URLs use the host.
+
+        """
+
+        return self.channel.kind
+
     def test(self):
         """ Send test message.
 
@@ -40,8 +167,13 @@ class Transport(object):
     def checks(self):
         return self.channel.user.check_set.order_by("created")
 
+    def summary(self):
+        return summaries.get(self.channel.user)
+
 
 class Email(Transport):
+    digest = True
+
     def notify(self, check):
         if not self.channel.email_verified:
             return "Email not verified"
@@ -53,12 +185,29 @@ class Email(Transport):
 
         ctx = {
             "check": check,
-            "checks": self.checks(),
+            "summary": self.summary(),
             "now": timezone.now(),
             "show_upgrade_note": show_upgrade_note
         }
         emails.alert(self.channel.value, ctx)
 
+    def notify_digest(self, checks):
+        if not self.channel.email_verified:
+            return "Email not verified"
+
+        show_upgrade_note = False
+        if settings.USE_PAYMENTS and all(c.status == "up" for c in checks):
+            if not self.channel.user.profile.team_access_allowed:
+                show_upgrade_note = True
+
+        ctx = {
+            "changed": checks,
+            "summary": self.summary(),
+            "now": timezone.now(),
+            "show_upgrade_note": show_upgrade_note
+        }
+        emails.digest(self.channel.value, ctx)
+
 
 class HttpTransport(Transport):
 
@@ -68,10 +217,11 @@ class HttpTransport(Transport):
             if "headers" not in options:
                 options["headers"] = {}
 
-            options["timeout"] = 5
+            options["timeout"] = (settings.HTTP_CONNECT_TIMEOUT,
+                                  settings.HTTP_READ_TIMEOUT)
             options["headers"]["User-Agent"] = "healthchecks.io"
 
-            r = requests.request(method, url, **options)
+            r = session.request(method, url, **options)
             if r.status_code not in (200, 201, 204):
                 return "Received status code %d" % r.status_code
         except requests.exceptions.Timeout:
@@ -89,6 +239,9 @@ class HttpTransport(Transport):
     def post_form(self, url, data):
         return self.request("post", url, data=data)
 
+    def host(self, url):
+        return urlparse(url).hostname or self.channel.kind
+
 
 class Webhook(HttpTransport):
     def notify(self, check):
@@ -120,16 +273,32 @@ class Webhook(HttpTransport):
 
         return self.get(url)
 
+    @property
+    def destination(self):
+        return self.host(self.channel.value_down or self.channel.value_up)
+
     def test(self):
         return self.get(self.channel.value)
 
 
 class Slack(HttpTransport):
+    digest = True
+
     def notify(self, check):
         text = tmpl("slack_message.json", check=check)
         payload = json.loads(text)
         return self.post(self.channel.slack_webhook_url, payload)
 
+    def notify_digest(self, checks):
+        n_down = len([c for c in checks if c.status == "down"])
+        text = tmpl("slack_digest.json", changed=checks, n_down=n_down)
+        payload = json.loads(text)
+        return self.post(self.channel.slack_webhook_url, payload)
+
+    @property
+    def destination(self):
+        return self.host(self.channel.slack_webhook_url)
+
 
 class HipChat(HttpTransport):
     def notify(self, check):
@@ -140,6 +309,10 @@ class HipChat(HttpTransport):
         }
         return self.post(self.channel.value, payload)
 
+    @property
+    def destination(self):
+        return self.host(self.channel.value)
+
 
 class PagerDuty(HttpTransport):
     URL = "https://events.pagerduty.com/generic/2010-04-15/create_event.json"
@@ -176,16 +349,24 @@ class Pushbullet(HttpTransport):
 
 
 class Pushover(HttpTransport):
+    digest = True
     URL = "https://api.pushover.net/1/messages.json"
 
     def notify(self, check):
-        others = self.checks().filter(status="down").exclude(code=check.code)
         ctx = {
             "check": check,
-            "down_checks": others,
+            "down_checks": self.summary().down_checks(exclude=check),
         }
         text = tmpl("pushover_message.html", **ctx)
         title = tmpl("pushover_title.html", **ctx)
+        return self.send(text, title)
+
+    def notify_digest(self, checks):
+        text = tmpl("pushover_digest_message.html", changed=checks)
+        title = tmpl("pushover_digest_title.html", changed=checks)
+        return self.send(text, title)
+
+    def send(self, text, title):
         user_key, prio = self.channel.value.split("|")
         payload = {
             "token": settings.PUSHOVER_API_TOKEN,
@@ -216,3 +397,7 @@ class VictorOps(HttpTransport):
         }
 
         return self.post(self.channel.value, payload)
+
+    @property
+    def destination(self):
+        return self.host(self.channel.value)
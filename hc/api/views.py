@@ -1,46 +1,55 @@
+import hashlib
 from datetime import timedelta as td
 
-from django.db.models import F
+from django.conf import settings
 from django.http import HttpResponse, HttpResponseBadRequest, JsonResponse
 from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
 from django.views.decorators.cache import never_cache
 from django.views.decorators.csrf import csrf_exempt
 
-from hc.api import schemas
-from hc.api.decorators import check_api_key, uuid_or_400, validate_json
-from hc.api.models import Check, Ping
+from hc.api import pings, schemas
+from hc.api.decorators import (check_api_key, make_error, uuid_or_400,
+                               validate_json)
+from hc.api.models import MAX_TAG_LENGTH, Check, Tag
 from hc.lib.badges import check_signature, get_badge_svg
+from hc.lib.lru import LRUCache
+
+# Badge states by (username, signature, tag), see _badge_state()
+MAX_CACHED_BADGES = 10000
+_badges = LRUCache(MAX_CACHED_BADGES)
 
 
 @csrf_exempt
 @uuid_or_400
 @never_cache
 def ping(request, code):
-    try:
-        check = Check.objects.get(code=code)
-    except Check.DoesNotExist:
+    check = pings.record_request(code, request.META)
+    if check is None:
         return HttpResponseBadRequest()
 
-    check.n_pings = F("n_pings") + 1
-    check.last_ping = timezone.now()
-    if check.status in ("new", "paused"):
-        check.status = "up"
+    response = HttpResponse("OK")
+    response["Access-Control-Allow-Origin"] = "*"
+    return response
 
-    check.save()
-    check.refresh_from_db()
-
-    ping = Ping(owner=check)
-    headers = request.META
-    ping.n = check.n_pings
-    remote_addr = headers.get("HTTP_X_FORWARDED_FOR", headers["REMOTE_ADDR"])
-    ping.remote_addr = remote_addr.split(",")[0]
-    ping.scheme = headers.get("HTTP_X_FORWARDED_PROTO", "http")
-    ping.method = headers["REQUEST_METHOD"]
-    # If User-Agent is longer than 200 characters, truncate it:
-    ping.ua = headers.get("HTTP_USER_AGENT", "")[:200]
-    ping.save()
 
-    response = HttpResponse("OK")
+@csrf_exempt
+@never_cache
+def bulk_ping(request):
+    if request.method != "POST":
+        # Method not allowed
+        return HttpResponse(status=405)
+
+    try:
+        items = pings.parse_bulk(request.body)
+    except ValueError as e:
+        return make_error(str(e))
+
+    info = pings.request_info(request.META)
+    _, unknown = pings.record_many(items, **info)
+
+    response = JsonResponse({"received": len(items), "unknown": unknown})
     response["Access-Control-Allow-Origin"] = "*"
     return response
 
@@ -58,6 +67,9 @@ def checks(request):
         check = Check(user=request.user)
         check.name = str(request.json.get("name", ""))
         check.tags = str(request.json.get("tags", ""))
+        if any(len(tag) > MAX_TAG_LENGTH for tag in check.tags_list()):
+            return make_error("tags are too long")
+
         if "timeout" in request.json:
             check.timeout = td(seconds=request.json["timeout"])
         if "grace" in request.json:
@@ -93,23 +105,51 @@ def pause(request, code):
     return JsonResponse(check.to_dict())
 
 
-@never_cache
-def badge(request, username, signature, tag):
-    if not check_signature(username, tag, signature):
-        return HttpResponseBadRequest()
+def _badge_state(username, tag):
+    """ Return the tag's aggregate status, its ETag, and until when this
+    answer holds.
+
+    There is no Last-Modified: a tag goes late just because time passes,
+    without any change to its row. The ETag covers the status itself.
+
+    """
 
-    status = "up"
-    q = Check.objects.filter(user__username=username, tags__contains=tag)
-    for check in q:
-        if tag not in check.tags_list():
-            continue
+    now = timezone.now()
+    expires = now + td(seconds=settings.BADGE_MAX_AGE)
 
-        if status == "up" and check.in_grace_period():
-            status = "late"
+    q = Tag.objects.filter(user__username=username, name=tag, n_checks__gt=0)
+    obj = q.first()
+    if obj is None:
+        status, modified = "up", None
+    else:
+        status, modified = obj.get_status(now), obj.changed
+        # Without any changes, an up tag goes late just because time passes
+        if status == "up" and obj.late_after:
+            expires = min(expires, obj.late_after)
 
-        if check.get_status() == "down":
-            status = "down"
-            break
+    stamp = modified.isoformat() if modified else ""
+    digest = hashlib.md5(("%s %s" % (status, stamp)).encode("utf-8"))
+    return status, digest.hexdigest(), expires
 
-    svg = get_badge_svg(tag, status)
-    return HttpResponse(svg, content_type="image/svg+xml")
+
+def badge(request, username, signature, tag):
+    key = (username, signature, tag)
+    state = _badges.get(key)
+    if state is None or state[2] <= timezone.now():
+        # Only valid signatures make it into the cache
+        if not check_signature(username, tag, signature):
+            return HttpResponseBadRequest()
+
+        state = _badge_state(username, tag)
+        _badges.set(key, state)
+
+    status, etag, expires = state
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        svg = get_badge_svg(tag, status)
+        response = HttpResponse(svg, content_type="image/svg+xml")
+
+    max_age = (expires - timezone.now()).total_seconds()
+    response["Cache-Control"] = "max-age=%d" % max(0, max_age)
+    response["ETag"] = quote_etag(etag)
+    return response
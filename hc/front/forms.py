@@ -1,5 +1,5 @@
 from django import forms
-from hc.api.models import Channel
+from hc.api.models import MAX_TAG_LENGTH, Channel
 
 
 class NameTagsForm(forms.Form):
@@ -11,6 +11,10 @@ class NameTagsForm(forms.Form):
 
         for part in self.cleaned_data["tags"].split(" "):
             part = part.strip()
+            if len(part) > MAX_TAG_LENGTH:
+                msg = "Tags can be at most %d characters" % MAX_TAG_LENGTH
+                raise forms.ValidationError(msg)
+
             if part != "":
                 l.append(part)
 
@@ -0,0 +1,79 @@
+from datetime import timedelta as td
+
+from django.utils import timezone
+from hc.api.models import Check
+from hc.test import BaseTestCase
+from mock import patch
+
+
+class StatusTestCase(BaseTestCase):
+
+    def setUp(self):
+        super(StatusTestCase, self).setUp()
+        self.check = Check(user=self.alice, name="Alice Was Here")
+        self.check.last_ping = timezone.now()
+        self.check.status = "up"
+        self.check.save()
+
+    def get(self, **headers):
+        self.client.login(username="alice@example.org", password="password")
+        return self.client.get("/checks/status/", **headers)
+
+    def test_it_works(self):
+        r = self.get()
+        self.assertEqual(r.status_code, 200)
+
+        doc = r.json()
+        self.assertEqual(doc["checks"], [{
+            "code": str(self.check.code),
+            "status": "up",
+            "last_ping": self.check.last_ping.isoformat()
+        }])
+
+    def test_it_shows_late_check(self):
+        self.check.last_ping = timezone.now() - td(days=1, minutes=30)
+        self.check.save()
+
+        doc = self.get().json()
+        self.assertEqual(doc["checks"][0]["status"], "late")
+
+    def test_it_handles_if_none_match(self):
+        etag = self.get()["ETag"]
+
+        r = self.get(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(r.status_code, 304)
+
+    def test_unchanged_poll_is_cheap(self):
+        etag = self.get()["ETag"]
+
+        # Session, user and profile lookups, then the status digest
+        with self.assertNumQueries(4):
+            r = self.client.get("/checks/status/", HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(r.status_code, 304)
+
+    def test_etag_changes_with_pings(self):
+        etag = self.get()["ETag"]
+
+        Check.objects.filter(id=self.check.id).update(n_pings=1)
+        r = self.get(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(r.status_code, 200)
+
+    def test_etag_changes_when_check_goes_late(self):
+        self.check.last_ping = timezone.now() - td(days=1, seconds=-1)
+        self.check.save()
+        etag = self.get()["ETag"]
+
+        # Nothing but time passes
+        later = timezone.now() + td(seconds=2)
+        with patch("hc.front.views.timezone.now") as mock_now:
+            mock_now.return_value = later
+            r = self.get(HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(r.json()["checks"][0]["status"], "late")
+
+    def test_it_shows_only_team_checks(self):
+        Check.objects.create(user=self.charlie)
+
+        doc = self.get().json()
+        self.assertEqual(len(doc["checks"]), 1)
@@ -20,6 +20,16 @@ class UpdateNameTestCase(BaseTestCase):
         check = Check.objects.get(code=self.check.code)
         assert check.name == "Alice Was Here"
 
+    def test_it_rejects_long_tags(self):
+        url = "/checks/%s/name/" % self.check.code
+        payload = {"name": "Alice Was Here", "tags": "foo " + "x" * 192}
+
+        self.client.login(username="alice@example.org", password="password")
+        self.client.post(url, data=payload)
+
+        check = Check.objects.get(code=self.check.code)
+        self.assertEqual(check.tags, "")
+
     def test_team_access_works(self):
         url = "/checks/%s/name/" % self.check.code
         payload = {"name": "Bob Was Here"}
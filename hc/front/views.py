@@ -1,4 +1,3 @@
-from collections import Counter
 from datetime import timedelta as td
 from itertools import tee
 
@@ -7,14 +6,19 @@ from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
 from django.db.models import Count
-from django.http import Http404, HttpResponseBadRequest, HttpResponseForbidden
+from django.http import (Http404, HttpResponseBadRequest,
+                         HttpResponseForbidden, JsonResponse)
 from django.shortcuts import get_object_or_404, redirect, render
 from django.urls import reverse
 from django.utils import timezone
+from django.utils.cache import get_conditional_response
 from django.utils.crypto import get_random_string
+from django.utils.http import quote_etag
 from django.utils.six.moves.urllib.parse import urlencode
 from hc.api.decorators import uuid_or_400
-from hc.api.models import DEFAULT_GRACE, DEFAULT_TIMEOUT, Channel, Check, Ping
+from hc.api.models import (DEFAULT_GRACE, DEFAULT_TIMEOUT, Channel, Check,
+                           Ping, Tag)
+from hc.api.status import CheckRow, status_etag
 from hc.front.forms import (AddChannelForm, AddWebhookForm, NameTagsForm,
                             TimeoutForm)
 
@@ -31,27 +35,26 @@ def pairwise(iterable):
 def my_checks(request):
     q = Check.objects.filter(user=request.team.user).order_by("created")
     checks = list(q)
+    now = timezone.now()
+    rows = CheckRow.evaluate(checks, now)
 
-    counter = Counter()
-    down_tags, grace_tags = set(), set()
-    for check in checks:
-        status = check.get_status()
-        for tag in check.tags_list():
-            if tag == "":
-                continue
-
-            counter[tag] += 1
+    tags = Tag.objects.filter(user=request.team.user, n_checks__gt=0)
+    tags = list(tags.order_by("-n_checks", "name"))
 
-            if status == "down":
-                down_tags.add(tag)
-            elif check.in_grace_period():
-                grace_tags.add(tag)
+    down_tags, grace_tags = set(), set()
+    for tag in tags:
+        status = tag.get_status(now)
+        if status == "down":
+            down_tags.add(tag.name)
+        elif status == "late":
+            grace_tags.add(tag.name)
 
     ctx = {
         "page": "checks",
         "checks": checks,
-        "now": timezone.now(),
-        "tags": counter.most_common(),
+        "rows": rows,
+        "now": now,
+        "tags": [(tag.name, tag.n_checks) for tag in tags],
         "down_tags": down_tags,
         "grace_tags": grace_tags,
         "ping_endpoint": settings.PING_ENDPOINT
@@ -60,6 +63,34 @@ def my_checks(request):
     return render(request, "front/my_checks.html", ctx)
 
 
+@login_required
+def status(request):
+    """ The statuses shown on My Checks, for the page to refresh itself. """
+
+    q = Check.objects.filter(user=request.team.user)
+    now = timezone.now()
+    etag = status_etag(q, now)
+
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        q = q.only("code", "status", "last_ping", "timeout", "grace")
+        checks = []
+        for row in CheckRow.evaluate(q, now):
+            last_ping = row.check.last_ping
+            checks.append({
+                "code": str(row.check.code),
+                "status": "late" if row.in_grace else row.status,
+                "last_ping": last_ping.isoformat() if last_ping else None
+            })
+
+        response = JsonResponse({"checks": checks})
+
+    # Browsers and jQuery revalidate with If-None-Match on every poll
+    response["Cache-Control"] = "private, no-cache"
+    response["ETag"] = quote_etag(etag)
+    return response
+
+
 def _welcome_check(request):
     check = None
     if "welcome_code" in request.session:
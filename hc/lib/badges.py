@@ -2,6 +2,7 @@ from django.conf import settings
 from django.core.signing import base64_hmac
 from django.template.loader import render_to_string
 from django.urls import reverse
+from hc.lib.lru import LRUCache
 
 WIDTHS = {"a": 7, "b": 7, "c": 6, "d": 7, "e": 6, "f": 4, "g": 7, "h": 7,
           "i": 3, "j": 3, "k": 7, "l": 3, "m": 10, "n": 7, "o": 7, "p": 7,
@@ -18,6 +19,10 @@ COLORS = {
     "down": "#e05d44"
 }
 
+# Rendered badges by (tag, status)
+MAX_CACHED_SVGS = 1000
+_svgs = LRUCache(MAX_CACHED_SVGS)
+
 
 def get_width(s):
     total = 0
@@ -27,6 +32,15 @@ def get_width(s):
 
 
 def get_badge_svg(tag, status):
+    svg = _svgs.get((tag, status))
+    if svg is None:
+        svg = render_badge_svg(tag, status)
+        _svgs.set((tag, status), svg)
+
+    return svg
+
+
+def render_badge_svg(tag, status):
     w1 = get_width(tag) + 10
     w2 = get_width(status) + 10
     ctx = {
@@ -0,0 +1,45 @@
+""" Reuse of database connections outside the request cycle.
+
+Django decides at the start and end of every request whether to keep the
+request's database connection, based on CONN_MAX_AGE. Management commands
+that work in threads have no request cycle, so they call release() after
+each piece of work instead of closing the connection. With the default
+CONN_MAX_AGE = 0 release() still closes it every time.
+
+A connection kept open can be dropped by the server or a proxy while it
+sits idle. check() tests connections that have been idle for longer than
+DB_HEALTH_CHECK_AFTER seconds, and closes the ones that no longer work,
+so the next query opens a new connection instead of failing.
+
+"""
+
+import time
+
+from django.conf import settings
+from django.db import connection
+
+
+def check(**kwargs):
+    """ Close this thread's connection if it has gone bad while idle.
+
+    Also works as a receiver for the request_started signal.
+
+    """
+
+    released_at = getattr(connection, "released_at", None)
+    if connection.connection is None or released_at is None:
+        return
+
+    if time.time() - released_at > settings.DB_HEALTH_CHECK_AFTER:
+        connection.released_at = None
+        if not connection.is_usable():
+            connection.close()
+
+
+def release(**kwargs):
+    """ Finish using this thread's connection for now. Keep it if it is
+    healthy and younger than CONN_MAX_AGE, close it otherwise. """
+
+    connection.close_if_unusable_or_obsolete()
+    if connection.connection is not None:
+        connection.released_at = time.time()
@@ -1,9 +1,124 @@
+import re
+import threading
+
+import premailer
 from django.conf import settings
-from djmail.template_mail import InlineCSSTemplateMail
+from django.template import engines, loader
+from djmail.template_mail import TemplateMail
+
+EXTENDS = re.compile(r"""{%\s*extends\s+["'](.+?)["']\s*%}""")
+INCLUDE = re.compile(r"""{%\s*include\s+["'](.+?)["']\s*%}""")
+BLOCK = re.compile(r"{%\s*block\s+(\w+)\s*%}(.*?)"
+                   r"{%\s*endblock(?:\s+\w+)?\s*%}", re.DOTALL)
+LOAD = re.compile(r"{%\s*load\s.*?%}")
+STYLE = re.compile(r"<style.*?</style>", re.DOTALL)
+# Any template tag, variable or comment
+TAG = re.compile(r"{%.*?%}|{{.*?}}|{#.*?#}", re.DOTALL)
+PLACEHOLDER = re.compile(r"hctag(\d+)x")
+
+FRAGMENT = """<html><head>%s</head><body>
+<!--fragment-->%s<!--/fragment-->
+</body></html>"""
+
+_compiled = {}
+_lock = threading.Lock()
+
+
+def _flatten(name):
+    """ Return the template's source, with {% include %} and
+    {% extends %} resolved by copying in the other templates' source. """
+
+    source = loader.get_template(name).template.source
+    source = INCLUDE.sub(lambda m: _flatten(m.group(1)), source)
+
+    m = EXTENDS.search(source)
+    if m:
+        blocks = dict(BLOCK.findall(source))
+        loads = LOAD.findall(source)
+        parent = _flatten(m.group(1))
+
+        def fill(m):
+            block, default = m.groups()
+            content = blocks.get(block, default)
+            return "{%% block %s %%}%s{%% endblock %%}" % (block, content)
+
+        source = "".join(loads) + BLOCK.sub(fill, parent)
+
+    return source
+
+
+def compile_template(name, fragment=False):
+    """ Return the template with its CSS inlined.
+
+    With fragment=True, the template is a piece of an email, like the
+    check summary. It is inlined using the styles of emails/base.html
+    as well as its own, so it looks the same as when included in an
+    email, and it is not wrapped in <html> and <body>.
+
+    """
+
+    source = BLOCK.sub(lambda m: m.group(2), _flatten(name))
+
+    # {% load %} must stay in front, where lxml would drop it
+    loads = []
+    for tag in LOAD.findall(source):
+        if tag not in loads:
+            loads.append(tag)
+    source = LOAD.sub("", source)
+
+    # Hide the template syntax from premailer, as plain words
+    tags = []
+
+    def protect(m):
+        tags.append(m.group(0))
+        return "hctag%dx" % (len(tags) - 1)
+
+    source = TAG.sub(protect, source)
+
+    if fragment:
+        base_styles = STYLE.findall(_flatten("emails/base.html"))
+        source = FRAGMENT % ("".join(base_styles), source)
+
+    html = premailer.transform(source)
+    if fragment:
+        html = html.split("<!--fragment-->")[1].split("<!--/fragment-->")[0]
+
+    html = PLACEHOLDER.sub(lambda m: tags[int(m.group(1))], html)
+    return engines["django"].from_string("".join(loads) + html)
+
+
+def get_template(name, fragment=False):
+    """ Return the compiled template, compiling it on first use. """
+
+    template = _compiled.get((name, fragment))
+    if template is None:
+        template = compile_template(name, fragment)
+        with _lock:
+            _compiled[(name, fragment)] = template
+
+    return template
+
+
+def render(name, ctx):
+    return get_template(name).render(ctx)
+
+
+def render_fragment(name, ctx):
+    return get_template(name, fragment=True).render(ctx)
+
+
+class CompiledTemplateMail(TemplateMail):
+    """ Like djmail's InlineCSSTemplateMail, but the CSS inlining is done
+    once per template instead of once per message. """
+
+    def _render_message_body_as_html(self, context):
+        name = self._body_template_name.format(name=self.name, type="html",
+                                               ext="html")
+        return render(name, context)
 
 
 def send(name, to, ctx):
-    o = InlineCSSTemplateMail(name)
+    o = CompiledTemplateMail(name)
     ctx["SITE_ROOT"] = settings.SITE_ROOT
     o.send(to, ctx)
 
@@ -20,6 +135,10 @@ def alert(to, ctx):
     send("alert", to, ctx)
 
 
+def digest(to, ctx):
+    send("digest", to, ctx)
+
+
 def verify_email(to, ctx):
     send("verify-email", to, ctx)
 
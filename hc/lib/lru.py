@@ -0,0 +1,39 @@
+""" A small thread-safe, size-bounded cache for per-process memoizing. """
+
+import threading
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    """ Maps keys to values, and drops the least recently used entry
+    once there are more than `maxsize` of them. """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.items)
+
+    def get(self, key, default=None):
+        with self.lock:
+            try:
+                value = self.items.pop(key)
+            except KeyError:
+                return default
+
+            # Back to the most recently used end
+            self.items[key] = value
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.items.pop(key, None)
+            self.items[key] = value
+            while len(self.items) > self.maxsize:
+                self.items.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
@@ -0,0 +1,127 @@
+""" A mail queue: djmail Message rows, delivered by the sendemails command.
+
+With EMAIL_BACKEND = "hc.lib.mailqueue.EmailBackend", sending an email
+only saves it as a pending djmail Message, all of a call's messages in
+one INSERT. The sendemails command then delivers pending messages in
+batches, each worker thread over its own SMTP connection that stays
+open between batches.
+
+"""
+
+import logging
+import traceback
+import uuid
+
+from django.conf import settings
+from django.core.mail import get_connection
+from django.utils import timezone
+from djmail import models
+from djmail.backends.base import BaseEmailBackend
+
+logger = logging.getLogger(__name__)
+
+# Claimed by a sendemails worker, not in djmail's own status choices
+STATUS_SENDING = 25
+
+
+class EmailBackend(BaseEmailBackend):
+    """ Queues messages for the sendemails command. """
+
+    def _send_messages(self, email_messages):
+        rows = []
+        for email in email_messages:
+            row = models.Message.from_email_message(email)
+            # bulk_create() skips djmail's pre_save signal
+            row.uuid = str(uuid.uuid1())
+            row.status = models.STATUS_PENDING
+            row.priority = getattr(email, "priority", row.priority)
+            rows.append(row)
+
+        models.Message.objects.bulk_create(rows)
+        return len(rows)
+
+
+def get_real_backend():
+    path = getattr(settings, "DJMAIL_REAL_BACKEND",
+                   "django.core.mail.backends.console.EmailBackend")
+    return get_connection(backend=path, fail_silently=False)
+
+
+def claim(limit):
+    """ Mark up to `limit` pending messages as being sent, and return
+    them, highest priority and oldest first. """
+
+    q = models.Message.objects.filter(status=models.STATUS_PENDING)
+    q = q.order_by("-priority", "created_at")
+    rows = list(q[:limit])
+
+    uuids = [row.uuid for row in rows]
+    models.Message.objects.filter(uuid__in=uuids).update(status=STATUS_SENDING)
+    return rows
+
+
+def release():
+    """ Put messages claimed by a previous, interrupted run back in the
+    queue. """
+
+    q = models.Message.objects.filter(status=STATUS_SENDING)
+    return q.update(status=models.STATUS_PENDING)
+
+
+class Sender(object):
+    """ Sends batches of messages over one connection, which is opened
+    on first use and kept open. Not safe to share between threads. """
+
+    def __init__(self):
+        self.connection = None
+
+    def send_one(self, email):
+        if self.connection is None:
+            self.connection = get_real_backend()
+            self.connection.open()
+
+        try:
+            return self.connection.send_messages([email])
+        except Exception:
+            # The connection may be broken, the next message gets a new one
+            self.close()
+            raise
+
+    def send(self, rows):
+        """ Send the messages, then record the results. Return the number
+        of messages sent. """
+
+        sent, failed = [], []
+        for row in rows:
+            try:
+                if self.send_one(row.get_email_message()) == 1:
+                    sent.append(row.uuid)
+                    continue
+
+                row.exception = "Not sent"
+            except Exception:
+                row.exception = traceback.format_exc()
+                logger.error(row.exception)
+
+            failed.append(row)
+
+        # All successful deliveries in one UPDATE
+        q = models.Message.objects.filter(uuid__in=sent)
+        q.update(status=models.STATUS_SENT, sent_at=timezone.now())
+
+        for row in failed:
+            # Same as djmail, so djmail_retry_send_messages retries these
+            row.status = models.STATUS_FAILED
+            row.retry_count += 1
+            row.save()
+
+        return len(sent)
+
+    def close(self):
+        if self.connection is not None:
+            try:
+                self.connection.close()
+            except Exception:
+                pass
+
+            self.connection = None
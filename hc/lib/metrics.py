@@ -0,0 +1,165 @@
+""" Minimal metrics in the Prometheus text exposition format.
+
+Metrics are created once, at import time, and registered in a global
+registry. render() returns the current values of all of them, ready to
+be served over HTTP (see serve()) or written to a file for the node
+exporter's textfile collector (see write()).
+
+"""
+
+import os
+import threading
+
+from six.moves import BaseHTTPServer
+
+DEFAULT_BUCKETS = (0.1, 0.5, 1, 2, 5, 10, 30, 60, 120, 300)
+
+_metrics = []
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+
+    parts = []
+    for name, value in pairs:
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"')
+        parts.append('%s="%s"' % (name, value))
+
+    return "{%s}" % ",".join(parts)
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric(object):
+    kind = None
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.values = {}
+        self.lock = threading.Lock()
+        _metrics.append(self)
+
+    def _key(self, labels):
+        return tuple(labels[name] for name in self.labels)
+
+    def samples(self):
+        raise NotImplementedError()
+
+    def render(self):
+        lines = ["# HELP %s %s" % (self.name, self.help_text),
+                 "# TYPE %s %s" % (self.name, self.kind)]
+
+        with self.lock:
+            samples = list(self.samples())
+
+        for name, labels, value in samples:
+            lines.append("%s%s %s" % (name, labels, _format_value(value)))
+
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        for key, value in sorted(self.values.items()):
+            yield self.name, _format_labels(self.labels, key), value
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[self._key(labels)] = value
+
+    def samples(self):
+        for key, value in sorted(self.values.items()):
+            yield self.name, _format_labels(self.labels, key), value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        super(Histogram, self).__init__(name, help_text, labels)
+        self.buckets = tuple(buckets) + (float("inf"), )
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            if key not in self.values:
+                # Counts per bucket, sum, count
+                self.values[key] = [[0] * len(self.buckets), 0.0, 0]
+
+            counts, total, n = self.values[key]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+
+            self.values[key][1] = total + value
+            self.values[key][2] = n + 1
+
+    def samples(self):
+        for key, (counts, total, n) in sorted(self.values.items()):
+            for bound, count in zip(self.buckets, counts):
+                extra = [("le", _format_value(bound))]
+                labels = _format_labels(self.labels, key, extra)
+                yield self.name + "_bucket", labels, count
+
+            labels = _format_labels(self.labels, key)
+            yield self.name + "_sum", labels, total
+            yield self.name + "_count", labels, n
+
+
+def render():
+    return "\n".join(metric.render() for metric in _metrics) + "\n"
+
+
+def write(path):
+    """ Write all metrics to a file, replacing it in one step so readers
+    never see a half-written file. """
+
+    tmp_path = "%s.%d.tmp" % (path, os.getpid())
+    with open(tmp_path, "w") as f:
+        f.write(render())
+
+    os.rename(tmp_path, path)
+
+
+class MetricsHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def serve(host, port):
+    """ Serve the metrics over HTTP from a background thread. Return the
+    server. """
+
+    server = BaseHTTPServer.HTTPServer((host, port), MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever, name="metrics")
+    thread.daemon = True
+    thread.start()
+    return server
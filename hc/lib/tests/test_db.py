@@ -0,0 +1,38 @@
+import time
+
+from django.test import SimpleTestCase
+from hc.lib import db
+from mock import Mock, patch
+
+
+@patch("hc.lib.db.connection")
+class DbTestCase(SimpleTestCase):
+
+    def test_release_remembers_kept_connection(self, connection):
+        before = time.time()
+        db.release()
+
+        connection.close_if_unusable_or_obsolete.assert_called_once_with()
+        self.assertTrue(connection.released_at >= before)
+
+    def test_check_skips_recently_used_connection(self, connection):
+        connection.released_at = time.time()
+        db.check()
+
+        self.assertFalse(connection.is_usable.called)
+
+    def test_check_closes_broken_connection(self, connection):
+        connection.released_at = time.time() - 3600
+        connection.is_usable = Mock(return_value=False)
+        db.check()
+
+        connection.close.assert_called_once_with()
+
+    def test_check_keeps_working_connection(self, connection):
+        connection.released_at = time.time() - 3600
+        connection.is_usable = Mock(return_value=True)
+        db.check()
+
+        self.assertFalse(connection.close.called)
+        # Not checked again until it has been released and idle again
+        self.assertIsNone(connection.released_at)
@@ -0,0 +1,42 @@
+from django.core import mail
+from django.test import TestCase
+from django.utils import timezone
+
+from hc.api.models import Check
+from hc.api.status import CheckRow
+from hc.lib import emails
+
+
+class EmailsTestCase(TestCase):
+
+    def test_it_inlines_css(self):
+        template = emails.get_template("emails/alert-body-html.html")
+        source = template.template.source
+
+        self.assertIn('<h1 style="', source)
+        # Template syntax survives
+        self.assertIn("{{ check.name_then_code }}", source)
+        self.assertIn("{% if show_upgrade_note %}", source)
+
+    def test_it_caches_compiled_templates(self):
+        a = emails.get_template("emails/verify-email-body-html.html")
+        b = emails.get_template("emails/verify-email-body-html.html")
+        self.assertIs(a, b)
+
+    def test_it_renders_fragments(self):
+        check = Check(name="Foo", status="up", last_ping=timezone.now())
+        html = emails.render_fragment("emails/summary-html.html",
+                                      {"rows": CheckRow.evaluate([check])})
+
+        self.assertNotIn("<html", html)
+        self.assertNotIn("<style", html)
+        self.assertIn("Foo", html)
+        self.assertIn('<table cellpadding="0" cellspacing="0" style="', html)
+
+    def test_it_sends_email(self):
+        emails.verify_email("alice@example.org", {"verify_link": "http://x"})
+
+        message = mail.outbox[0]
+        html, _ = message.alternatives[0]
+        self.assertIn('<a href="http://x"', html)
+        self.assertIn("http://x", message.body)
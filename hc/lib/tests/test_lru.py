@@ -0,0 +1,24 @@
+from django.test import SimpleTestCase
+from hc.lib.lru import LRUCache
+
+
+class LRUCacheTestCase(SimpleTestCase):
+
+    def test_it_works(self):
+        cache = LRUCache(2)
+        cache.set("a", 1)
+        self.assertEqual(cache.get("a"), 1)
+        self.assertEqual(cache.get("b"), None)
+        self.assertEqual(cache.get("b", 2), 2)
+
+    def test_it_drops_least_recently_used(self):
+        cache = LRUCache(2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+
+        cache.set("c", 3)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.get("a"), 1)
+        self.assertEqual(cache.get("b"), None)
+        self.assertEqual(cache.get("c"), 3)
@@ -0,0 +1,124 @@
+import asyncore
+import smtpd
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+from django.core import mail
+from django.core.mail import EmailMessage, get_connection
+from django.test import TransactionTestCase, override_settings
+from djmail.models import STATUS_FAILED, STATUS_PENDING, STATUS_SENT, Message
+from mock import patch
+
+from hc.api.management.commands.sendemails import Command
+from hc.lib import mailqueue
+
+
+class SinkServer(smtpd.SMTPServer):
+    """ Accepts and keeps messages, and counts connections. """
+
+    def __init__(self):
+        smtpd.SMTPServer.__init__(self, ("127.0.0.1", 0), None,
+                                  decode_data=True)
+        self.n_connections = 0
+        self.messages = []
+
+    def handle_accepted(self, conn, addr):
+        self.n_connections += 1
+        smtpd.SMTPServer.handle_accepted(self, conn, addr)
+
+    def process_message(self, peer, mailfrom, rcpttos, data, **kwargs):
+        self.messages.append((rcpttos, data))
+
+
+class MailQueueTestCase(TransactionTestCase):
+    """ sendemails updates messages from worker threads, so each test
+    has to commit its data for the threads to see it. """
+
+    def _queue(self, n):
+        backend = get_connection("hc.lib.mailqueue.EmailBackend")
+        emails = [EmailMessage("Subject %d" % i, "Body", to=["a@example.org"])
+                  for i in range(0, n)]
+        backend.send_messages(emails)
+
+    def test_backend_queues_messages(self):
+        self._queue(3)
+
+        rows = Message.objects.all()
+        self.assertEqual(len(rows), 3)
+        for row in rows:
+            self.assertEqual(row.status, STATUS_PENDING)
+            self.assertTrue(row.uuid)
+
+    def test_claim_works(self):
+        self._queue(3)
+
+        rows = mailqueue.claim(2)
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(Message.objects.filter(status=STATUS_PENDING).count(),
+                         1)
+
+        self.assertEqual(mailqueue.release(), 2)
+
+    @override_settings(
+        DJMAIL_REAL_BACKEND="django.core.mail.backends.locmem.EmailBackend")
+    def test_sender_sends(self):
+        self._queue(3)
+
+        sender = mailqueue.Sender()
+        self.assertEqual(sender.send(mailqueue.claim(10)), 3)
+        self.assertEqual(len(mail.outbox), 3)
+
+        for row in Message.objects.all():
+            self.assertEqual(row.status, STATUS_SENT)
+            self.assertIsNotNone(row.sent_at)
+
+    @patch("hc.lib.mailqueue.get_real_backend")
+    def test_sender_handles_errors(self, mock_get_real_backend):
+        mock_get_real_backend.return_value.send_messages.side_effect = \
+            IOError("Connection refused")
+        self._queue(1)
+
+        sender = mailqueue.Sender()
+        self.assertEqual(sender.send(mailqueue.claim(10)), 0)
+
+        row = Message.objects.get()
+        self.assertEqual(row.status, STATUS_FAILED)
+        self.assertEqual(row.retry_count, 0)
+        self.assertIn("Connection refused", row.exception)
+
+    def test_it_reuses_smtp_connection(self):
+        sink = SinkServer()
+        port = sink.socket.getsockname()[1]
+        stopped = threading.Event()
+
+        def run():
+            while not stopped.is_set():
+                asyncore.loop(timeout=0.05, count=1)
+
+        thread = threading.Thread(target=run)
+        thread.start()
+
+        self._queue(5)
+        command = Command()
+        command.workers = 1
+        command.executor = ThreadPoolExecutor(max_workers=1)
+        command.batch_size = 2
+
+        real_backend = "django.core.mail.backends.smtp.EmailBackend"
+        try:
+            with override_settings(DJMAIL_REAL_BACKEND=real_backend,
+                                   EMAIL_HOST="127.0.0.1", EMAIL_PORT=port,
+                                   EMAIL_USE_TLS=False):
+                while command.handle_many():
+                    pass
+
+                command.close()
+        finally:
+            stopped.set()
+            thread.join()
+            sink.close()
+
+        self.assertEqual(len(sink.messages), 5)
+        self.assertEqual(sink.n_connections, 1)
+        self.assertEqual(Message.objects.filter(status=STATUS_SENT).count(),
+                         5)
@@ -0,0 +1,58 @@
+import os
+import tempfile
+
+from django.test import TestCase
+
+from hc.lib import metrics
+
+
+class MetricsTestCase(TestCase):
+
+    def setUp(self):
+        super(MetricsTestCase, self).setUp()
+        # The metrics created here should not outlive the test
+        self.registered = list(metrics._metrics)
+
+    def tearDown(self):
+        metrics._metrics[:] = self.registered
+        super(MetricsTestCase, self).tearDown()
+
+    def test_counter_works(self):
+        counter = metrics.Counter("test_total", "Things", labels=["kind"])
+        counter.inc(kind="email")
+        counter.inc(2, kind="email")
+
+        text = counter.render()
+        self.assertIn("# TYPE test_total counter", text)
+        self.assertIn('test_total{kind="email"} 3', text)
+
+    def test_histogram_works(self):
+        histogram = metrics.Histogram("test_seconds", "Delay",
+                                      buckets=(1, 10))
+        histogram.observe(0.5)
+        histogram.observe(5)
+
+        text = histogram.render()
+        self.assertIn('test_seconds_bucket{le="1"} 1', text)
+        self.assertIn('test_seconds_bucket{le="10"} 2', text)
+        self.assertIn('test_seconds_bucket{le="+Inf"} 2', text)
+        self.assertIn("test_seconds_sum 5.5", text)
+        self.assertIn("test_seconds_count 2", text)
+
+    def test_tests_start_with_a_clean_registry(self):
+        names = [metric.name for metric in metrics._metrics]
+        self.assertFalse([name for name in names if name.startswith("test_")])
+
+    def test_it_writes_file(self):
+        gauge = metrics.Gauge("test_gauge", "A gauge")
+        gauge.set(7)
+
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, "hc.prom")
+        metrics.write(path)
+
+        with open(path) as f:
+            self.assertIn("test_gauge 7", f.read())
+
+        # No temporary file left behind
+        self.assertEqual(os.listdir(directory), ["hc.prom"])
@@ -80,6 +80,13 @@ WSGI_APPLICATION = 'hc.wsgi.application'
 TEST_RUNNER = 'hc.api.tests.CustomRunner'
 
 
+# Keep database connections open for this many seconds, in web workers and
+# in the worker threads of sendalerts, sendoutbox and sendemails. 0 closes
+# them after every request or alert. An empty DB_CONN_MAX_AGE keeps them
+# open indefinitely.
+DB_CONN_MAX_AGE = os.environ.get('DB_CONN_MAX_AGE', '0')
+DB_CONN_MAX_AGE = int(DB_CONN_MAX_AGE) if DB_CONN_MAX_AGE else None
+
 DATABASES = {}
 
 if os.environ.get('TRAVIS_DB', None):
@@ -92,8 +99,12 @@ if os.environ.get('TRAVIS_DB', None):
     }
 else:
 
-    DATABASES['default'] = dj_database_url.config()
+    DATABASES['default'] = dj_database_url.config(
+        conn_max_age=DB_CONN_MAX_AGE)
 
+# Before reusing a connection that has been idle for longer than this
+# many seconds, check that the database still answers on it.
+DB_HEALTH_CHECK_AFTER = 30
 
 
 LANGUAGE_CODE = 'en-us'
@@ -122,8 +133,58 @@ STATICFILES_FINDERS = (
 
 COMPRESS_OFFLINE = True
 
+# Ping log -- if enabled, Ping rows are queued in memory and written in
+# batches by a background thread in each web worker
+PING_LOG_BUFFERED = False
+PING_LOG_BUFFER_SIZE = 10000
+PING_LOG_BATCH_SIZE = 500
+PING_LOG_FLUSH_INTERVAL = 1.0
+
+# Hot checks -- further pings for a check within this many seconds of a
+# recorded ping are merged into one database update. 0 disables merging.
+PING_COALESCE_WINDOW = 0
+# Write only every Nth merged ping to the ping log
+PING_COALESCE_SAMPLE = 1
+
 EMAIL_BACKEND = "djmail.backends.default.EmailBackend"
 
+# Notification outbox -- if enabled, sendalerts only queues notifications
+# and the sendoutbox command delivers them, retrying failed deliveries
+NOTIFICATION_OUTBOX = False
+OUTBOX_RETRY_DELAY = 10
+OUTBOX_MAX_RETRY_DELAY = 600
+OUTBOX_MAX_AGE = 3600
+
+# Outgoing HTTP requests from integrations -- connections are kept alive
+# and reused, up to HTTP_POOL_SIZE per host
+HTTP_POOL_HOSTS = 100
+HTTP_POOL_SIZE = 10
+HTTP_CONNECT_TIMEOUT = 5
+HTTP_READ_TIMEOUT = 5
+
+# sendalerts --asyncio -- max. notifications in flight, overall and
+# to any single destination host
+DISPATCH_CONCURRENCY = 100
+DISPATCH_PER_HOST = 10
+
+# Circuit breaker -- after this many failed notifications in a row,
+# a channel's notifications are skipped for BREAKER_COOLDOWN seconds
+BREAKER_THRESHOLD = 5
+BREAKER_COOLDOWN = 300
+
+# Notification digests -- when at least this many of a channel's checks
+# change status in the same sendalerts pass, the channel gets a single
+# notification about all of them. 0 disables digests.
+DIGEST_THRESHOLD = 0
+
+# sendalerts writes alert latency metrics to this file after every pass,
+# in Prometheus text format. None disables writing.
+METRICS_FILE = None
+
+# Badges are cached in each web process, and by clients, for at most this
+# many seconds. A ping shows on a badge after at most this long.
+BADGE_MAX_AGE = 30
+
 # Slack integration -- override these in local_settings
 SLACK_CLIENT_ID = None
 SLACK_CLIENT_SECRET = None
@@ -142,3 +203,7 @@ if os.path.exists(os.path.join(BASE_DIR, "hc/local_settings.py")):
     from .local_settings import *
 else:
     warnings.warn("local_settings.py not found, using defaults")
+
+# Also applies to a DATABASES entry from local_settings.py, unless it
+# sets its own CONN_MAX_AGE
+DATABASES['default'].setdefault('CONN_MAX_AGE', DB_CONN_MAX_AGE)
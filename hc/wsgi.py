@@ -9,6 +9,7 @@ https://docs.djangoproject.com/en/1.8/howto/deployment/wsgi/
 
 import os
 
+from django.core.signals import request_finished, request_started
 from django.core.wsgi import get_wsgi_application
 from whitenoise.django import DjangoWhiteNoise
 
@@ -16,3 +17,10 @@ os.environ.setdefault("DJANGO_SETTINGS_MODULE", "hc.settings")
 
 application = get_wsgi_application()
 application = DjangoWhiteNoise(application)
+
+from hc.lib import db  # noqa: E402 (needs the settings loaded first)
+
+# Connections kept between requests (DB_CONN_MAX_AGE) are checked before
+# they are used again
+request_started.connect(db.check)
+request_finished.connect(db.release)
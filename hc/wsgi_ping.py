@@ -0,0 +1,108 @@
+"""
+Minimal WSGI application that only serves the ping endpoints,
+/ping/<code>/ and bulk pings POSTed to /ping/.
+
+Pings are anonymous and don't need sessions, CSRF protection, auth or
+team lookups, so this skips Django's URL resolver and middleware chain
+and calls hc.api.pings directly. Run it as a separate pool next to the
+main application and route /ping/ to it:
+
+    gunicorn hc.wsgi_ping
+
+"""
+
+import json
+import os
+import re
+import uuid
+
+import django
+from django.db import close_old_connections
+from django.utils.http import http_date
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "hc.settings")
+django.setup()
+
+from hc.api import pings  # noqa: E402 (needs django.setup() first)
+from hc.lib import db  # noqa: E402
+
+PING_PATH = re.compile(r"^/ping/([\w-]+)/?$")
+BULK_PATH = re.compile(r"^/ping/?$")
+
+
+def _respond(start_response, status, body,
+             content_type="text/html; charset=utf-8"):
+    headers = [
+        ("Content-Type", content_type),
+        ("Content-Length", str(len(body))),
+        ("Access-Control-Allow-Origin", "*"),
+        # Same as what the never_cache decorator sends:
+        ("Expires", http_date()),
+        ("Cache-Control", "max-age=0, no-cache, no-store, must-revalidate")
+    ]
+
+    start_response(status, headers)
+    return [body]
+
+
+def _respond_json(start_response, status, doc):
+    body = json.dumps(doc).encode("utf-8")
+    return _respond(start_response, status, body, "application/json")
+
+
+def bulk_ping(environ, start_response):
+    """ Same as hc.api.views.bulk_ping. """
+
+    if environ["REQUEST_METHOD"] != "POST":
+        return _respond(start_response, "405 Method Not Allowed", b"")
+
+    try:
+        length = int(environ.get("CONTENT_LENGTH") or 0)
+    except ValueError:
+        length = 0
+
+    try:
+        items = pings.parse_bulk(environ["wsgi.input"].read(length))
+    except ValueError as e:
+        return _respond_json(start_response, "400 Bad Request",
+                             {"error": str(e)})
+
+    close_old_connections()
+    db.check()
+    try:
+        _, unknown = pings.record_many(items, **pings.request_info(environ))
+    finally:
+        db.release()
+
+    return _respond_json(start_response, "200 OK",
+                         {"received": len(items), "unknown": unknown})
+
+
+def application(environ, start_response):
+    path = environ.get("PATH_INFO", "")
+    if BULK_PATH.match(path):
+        return bulk_ping(environ, start_response)
+
+    m = PING_PATH.match(path)
+    if m is None:
+        return _respond(start_response, "404 Not Found", b"Not Found")
+
+    code = m.group(1)
+    try:
+        uuid.UUID(code)
+    except ValueError:
+        return _respond(start_response, "400 Bad Request", b"Bad Request")
+
+    # This is what Django and hc.wsgi do on request_started and
+    # request_finished
+    close_old_connections()
+    db.check()
+    try:
+        check = pings.record_request(code, environ)
+    finally:
+        db.release()
+
+    if check is None:
+        return _respond(start_response, "400 Bad Request", b"Bad Request")
+
+    return _respond(start_response, "200 OK", b"OK")
@@ -181,6 +181,118 @@ $(function () {
     });
 
 
+    // Desktop status icons and mobile status labels, as in the templates
+    var ICONS = {
+        "new": '<span class="status icon-up new" data-toggle="tooltip" ' +
+               'title="New. Has never received a ping."></span>',
+        "paused": '<span class="status icon-paused" data-toggle="tooltip" ' +
+                  'title="Monitoring paused. Ping to resume."></span>',
+        "late": '<span class="status icon-grace"></span>',
+        "up": '<span class="status icon-up"></span>',
+        "down": '<span class="status icon-down"></span>'
+    };
+
+    var LABELS = {
+        "new": ["label-default", "NEW"],
+        "paused": ["label-default", "PAUSED"],
+        "late": ["label-warning", "LATE"],
+        "up": ["label-success", "UP"],
+        "down": ["label-danger", "DOWN"]
+    };
+
+    var statuses = {};
+    var lastPings = {};
+
+    function renderLastPings() {
+        $.each(lastPings, function(code, value) {
+            var lastPing = "Never";
+            if (value) {
+                lastPing = moment(value).fromNow();
+            }
+
+            var $row = $("#checks-table tr[data-code='" + code + "']");
+            var $item = $("#checks-list > li[data-code='" + code + "']");
+            // Keep the tooltip with the exact time, if there is one
+            var $cell = $(".last-ping-cell", $row);
+            var $span = $("span", $cell);
+            ($span.length ? $span : $cell).text(lastPing);
+            $(".last-ping-cell", $item).text(lastPing);
+        });
+    }
+
+    function updateCheck(check) {
+        lastPings[check.code] = check.last_ping;
+        if (statuses[check.code] == check.status) {
+            return;
+        }
+
+        var $row = $("#checks-table tr[data-code='" + check.code + "']");
+        var $item = $("#checks-list > li[data-code='" + check.code + "']");
+        statuses[check.code] = check.status;
+        $(".indicator-cell", $row).html(ICONS[check.status]);
+        $('[data-toggle="tooltip"]', $row).tooltip();
+
+        var label = LABELS[check.status];
+        var $label = $("<span>").addClass("label " + label[0]).text(label[1]);
+        $(".status-cell", $item).empty().append($label);
+    }
+
+    function updateTags() {
+        $("#my-checks-tags button").each(function(index, el) {
+            var tag = el.textContent;
+            var down = false, late = false;
+
+            $("#checks-table tr.checks-row").each(function(index, row) {
+                // Not .data(): it turns tags like "2017" into numbers
+                var tags = $(".my-checks-name", row).attr("data-tags").split(" ");
+                if (tags.indexOf(tag) == -1) {
+                    return;
+                }
+
+                var status = statuses[row.getAttribute("data-code")];
+                down = down || status == "down";
+                late = late || status == "late";
+            });
+
+            var cls = down ? "btn-danger" : late ? "btn-warning" : "btn-default";
+            $(el).removeClass("btn-danger btn-warning btn-default");
+            $(el).addClass(cls);
+        });
+    }
+
+    // Poll for status changes and patch the page in place. The server
+    // answers 304 Not Modified while nothing has changed.
+    var statusUrl = $("#my-checks").data("status-url");
+    function refreshStatus() {
+        if (document.hidden) {
+            return;
+        }
+
+        $.ajax({
+            url: statusUrl,
+            dataType: "json",
+            ifModified: true,
+            success: function(data, textStatus) {
+                if (textStatus == "notmodified" || !data) {
+                    return;
+                }
+
+                $.each(data.checks, function(index, check) {
+                    updateCheck(check);
+                });
+                updateTags();
+            },
+            // "5 minutes ago" goes stale even while nothing changes,
+            // so re-render the relative times on every tick
+            complete: renderLastPings
+        });
+    }
+
+    if (statusUrl && $("#checks-table").length) {
+        setInterval(refreshStatus, 10000);
+    }
+
+
     var clipboard = new Clipboard('button.copy-link');
     $("button.copy-link").mouseout(function(e) {
         setTimeout(function() {